@@ -0,0 +1,121 @@
+"""
+Banded local alignment of a primer against a read window, used by
+pbtranscript.PrimerMatcher to find primers without calling phmmer.
+"""
+from libc.stdlib cimport malloc, free
+
+# Integer scores of the affine gap local alignment.
+DEF MATCH = 2
+DEF MISMATCH = -3
+DEF GAP_OPEN = -5    # score of the first base of a gap
+DEF GAP_EXTEND = -2  # score of every following base of a gap
+DEF NEG_INF = -1000000
+
+
+cdef int _align(const char *p, int m, const char *s, int n,
+                int max_start, int band, int *H, int *HS, int *F, int *FS,
+                int *out) nogil:
+    """
+    Smith-Waterman with affine gaps of p[0:m] against s[0:n], keeping
+    one row of H (best score ending at a cell), F (best score ending
+    with a gap in s) and their start cells HS, FS, encoded as
+    p_start * (n + 1) + s_start.
+
+    An alignment may only start at p[i], s[j] if i <= max_start and
+    j <= max_start, and only cells within max_start + band diagonals
+    of the main diagonal are computed.
+
+    Write (score, pStart, pEnd, sStart, sEnd) to out and return score,
+    or return 0 if there is no alignment.
+    """
+    cdef int i, j, j_lo, j_hi, w = max_start + band
+    cdef int diag, diag_start, left, left_start, up, up_start
+    cdef int h, hs, e, es, f, fs, sc, k
+    cdef int best = 0, best_start = -1, best_i = 0, best_j = 0
+
+    for j in range(n + 1):
+        H[j] = 0
+        HS[j] = -1
+        F[j] = NEG_INF
+        FS[j] = -1
+
+    for i in range(1, m + 1):
+        j_lo = i - w if i - w > 1 else 1
+        j_hi = i + w if i + w < n else n
+        if j_lo > j_hi:
+            break
+        # H[j - 1] still holds row i - 1 while computing cell (i, j)
+        diag, diag_start = H[j_lo - 1], HS[j_lo - 1]
+        # the cell left of the band is empty in row i
+        left, left_start = 0, -1
+        e, es = NEG_INF, -1
+        for j in range(j_lo, j_hi + 1):
+            up, up_start = H[j], HS[j]
+            sc = MATCH if p[i - 1] == s[j - 1] else MISMATCH
+
+            # gap in p, consuming s[j - 1]
+            if left > 0 and left + GAP_OPEN >= e + GAP_EXTEND:
+                e, es = left + GAP_OPEN, left_start
+            else:
+                e = e + GAP_EXTEND
+            # gap in s, consuming p[i - 1]
+            if up > 0 and up + GAP_OPEN >= F[j] + GAP_EXTEND:
+                F[j], FS[j] = up + GAP_OPEN, up_start
+            else:
+                F[j] = F[j] + GAP_EXTEND
+
+            h, hs = NEG_INF, -1
+            if diag > 0:
+                h, hs = diag + sc, diag_start
+            if i - 1 <= max_start and j - 1 <= max_start and sc > h:
+                h, hs = sc, (i - 1) * (n + 1) + (j - 1)
+            if e > h:
+                h, hs = e, es
+            if F[j] > h:
+                h, hs = F[j], FS[j]
+            if h <= 0:
+                h, hs = 0, -1
+            elif h > best:
+                best, best_start, best_i, best_j = h, hs, i, j
+
+            diag, diag_start = up, up_start
+            left, left_start = h, hs
+            H[j], HS[j] = h, hs
+        # cells right of the band are empty in row i
+        if j_hi < n:
+            H[j_hi + 1], HS[j_hi + 1] = 0, -1
+            F[j_hi + 1], FS[j_hi + 1] = NEG_INF, -1
+
+    if best <= 0:
+        return 0
+    out[0] = best
+    out[1] = best_start / (n + 1)
+    out[2] = best_i
+    out[3] = best_start % (n + 1)
+    out[4] = best_j
+    return best
+
+
+def align_primer(bytes primer, bytes window, int max_start, int band):
+    """
+    Locally align primer against window (both upper case), and return
+    (score, pStart, pEnd, sStart, sEnd) of the best alignment which
+    starts within the first max_start + 1 bases of both primer and
+    window, or None if there is no such alignment. Positions are
+    0-based and ends are exclusive, score is an integer with match 2,
+    mismatch -3, gap open -5 and gap extension -2.
+    """
+    cdef int m = len(primer), n = len(window), score
+    cdef const char *p = primer
+    cdef const char *s = window
+    cdef int out[5]
+    cdef int *buf = <int *>malloc(4 * (n + 1) * sizeof(int))
+    if buf == NULL:
+        raise MemoryError()
+    with nogil:
+        score = _align(p, m, s, n, max_start, band, buf, buf + (n + 1),
+                       buf + 2 * (n + 1), buf + 3 * (n + 1), out)
+    free(buf)
+    if score <= 0:
+        return None
+    return (out[0], out[1], out[2], out[3], out[4])
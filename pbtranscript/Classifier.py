@@ -4,9 +4,11 @@ import os
 import os.path as op
 import math
 import re
+import time
+import shutil
 import logging
-import multiprocessing
-from collections import defaultdict, namedtuple
+from multiprocessing.pool import ThreadPool
+from collections import defaultdict, namedtuple, deque
 
 from pbcore.util.Process import backticks
 from pbcore.io import FastaWriter
@@ -17,6 +19,7 @@ from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbtranscript.io import ReadAnnotation
 from pbtranscript.io.PbiBamIO import CCSInput
 from pbtranscript.io.Summary import ClassifySummary
+from pbtranscript.PrimerMatcher import PrimerMatcher, PRIMER_ENGINES
 from pbtranscript.Utils import (revcmp, realpath, as_contigset,
     generateChunkedFN, cat_files, real_upath, ln)
 
@@ -31,6 +34,13 @@ FLCHIMERADOMFN = "hmmer.fl.chimera.dom"
 NFLCHIMERADOMFN = "hmmer.nfl.chimera.dom"
 CLASSIFYSUMMARY = "classify_summary.txt"
 
+# Split reads into this many phmmer chunks per cpu, so that an idle
+# worker can pick up remaining chunks while another one is slow.
+PHMMER_CHUNKS_PER_CPU = 4
+
+# Number of reads per batch in streaming mode.
+STREAM_BATCH_SIZE = 1000
+
 
 # ChimeraDetectionOptions:
 # Minimum length to output a (trimmed) sequence.
@@ -43,6 +53,9 @@ ChimeraDetectionOptions = namedtuple("ChimeraDetectionOptions",
                                      ("min_seq_len min_score min_dist_from_end max_adjacent_hit_dist " +
                                       "primer_search_window detect_chimera_nfl"))
 
+# A read held in a batch in streaming mode, detached from its reader.
+StreamRead = namedtuple("StreamRead", ("name", "sequence"))
+
 
 class PBRead(object):
 
@@ -102,7 +115,8 @@ class Classifier(object):
                  opts=ChimeraDetectionOptions(50, 10, 100, 50, 100, False),
                  out_nfl_fn=None, out_flnc_fn=None,
                  ignore_polyA=False, reuse_dom=False,
-                 ignore_empty_output=False):
+                 ignore_empty_output=False, primer_engine="phmmer",
+                 streaming=False, batch_size=STREAM_BATCH_SIZE):
         self.reads_fn = realpath(reads_fn)
         self.out_dir = realpath(out_dir)
         self.cpus = cpus
@@ -111,6 +125,20 @@ class Classifier(object):
         self.ignore_polyA = ignore_polyA
         self.reuse_dom = reuse_dom
         self.ignore_empty_output = ignore_empty_output
+        if primer_engine not in PRIMER_ENGINES:
+            raise ClassifierException(
+                "Unknown primer engine {e}, must be one of {es}.".
+                format(e=primer_engine, es=", ".join(PRIMER_ENGINES)))
+        # phmmer: run phmmer on chunks of read windows,
+        # native: align primers to read windows in-process.
+        self.primer_engine = primer_engine
+        # If streaming, classify reads in one pass in batches of
+        # batch_size reads using the native primer engine.
+        self.streaming = streaming
+        self.batch_size = batch_size
+        if streaming and primer_engine != "native":
+            logging.info("Streaming mode uses native primer engine.")
+            self.primer_engine = "native"
         self._numReads = None
 
         # The input primer file: primers.fasta
@@ -366,33 +394,65 @@ class Classifier(object):
             if fwriter is not None:
                 fwriter.close()
 
+    def _numPhmmerChunks(self, num_reads):
+        """Return number of chunks to split num_reads reads for phmmer."""
+        return max(min(num_reads, self.cpus * PHMMER_CHUNKS_PER_CPU), 1)
+
     def _startPhmmers(self, chunked_reads_fns, chunked_dom_fns,
-                      out_dom_fn, primer_fn, pbmatrix_fn):
+                      out_dom_fn, primer_fn, pbmatrix_fn, dom_callback=None):
         """Run phmmers on chunked reads files in 'chunked_reads_fns' and
         generate chunked dom files as listed in 'chunked_dom_fns', finally
-        concatenate dom files to 'out_dom_fn'."""
-        logging.info("Start to launch phmmer on chunked reads.")
-        jobs = []
-        for reads_fn, domFN in zip(chunked_reads_fns, chunked_dom_fns):
-            p = multiprocessing.Process(
-                target=self._phmmer,
-                args=(reads_fn, domFN, primer_fn, pbmatrix_fn))
-            jobs.append((p, domFN))
-            p.start()
-
-        for p, domFN in jobs:
-            p.join()
-            cmd = "cat {0} >> {1}".format(real_upath(domFN),
-                                          real_upath(out_dom_fn))
-            _output, errCode, errMsg = backticks(cmd)
-            if errCode != 0:
-                raise ClassifierException(
-                    "Error concatenating dom files: {e}".
-                    format(e=str(errMsg)))
+        concatenate dom files to 'out_dom_fn'.
+
+        At most self.cpus phmmer jobs run at the same time, and each idle
+        worker picks up the next chunk, so that a slow chunk does not hold
+        up the others. Chunked dom files are appended to 'out_dom_fn' in
+        order as soon as they are done, and passed to dom_callback if it
+        is not None.
+        """
+        num_workers = max(1, min(self.cpus, len(chunked_reads_fns)))
+        logging.info("Start to launch phmmer on {n} chunked reads using {w} workers.".
+                     format(n=len(chunked_reads_fns), w=num_workers))
+        args = [(i, reads_fn, domFN, primer_fn, pbmatrix_fn) for i, (reads_fn, domFN)
+                in enumerate(zip(chunked_reads_fns, chunked_dom_fns))]
+        elapsed = []
+        pool = ThreadPool(processes=num_workers)
+        try:
+            with open(out_dom_fn, 'w') as writer:
+                for i, domFN, secs in pool.imap(self._timedPhmmer, args):
+                    logging.debug("phmmer on chunk {i} took {t:.2f} sec.".
+                                  format(i=i, t=secs))
+                    elapsed.append(secs)
+                    with open(domFN, 'r') as reader:
+                        shutil.copyfileobj(reader, writer)
+                    if dom_callback is not None:
+                        dom_callback(domFN)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if len(elapsed) > 0:
+            elapsed.sort()
+            logging.info("phmmer took {s:.2f} sec on {n} chunks, ".
+                         format(s=sum(elapsed), n=len(elapsed)) +
+                         "min/median/max {a:.2f}/{b:.2f}/{c:.2f} sec per chunk.".
+                         format(a=elapsed[0], b=elapsed[len(elapsed) / 2],
+                                c=elapsed[-1]))
 
         self._cleanup(chunked_reads_fns)
         self._cleanup(chunked_dom_fns)
 
+    def _timedPhmmer(self, args):
+        """Invoke phmmer on a chunk, args = (chunk index, reads_fn, domFN,
+        primer_fn, pbmatrix_fn), return (chunk index, domFN, seconds)."""
+        i, reads_fn, domFN, primer_fn, pbmatrix_fn = args
+        start_t = time.time()
+        self._phmmer(reads_fn, domFN, primer_fn, pbmatrix_fn)
+        return (i, domFN, time.time() - start_t)
+
     def _phmmer(self, reads_fn, domFN, primer_fn, pbmaxtrixFN):
         """Invoke phmmer once."""
         cmd = "phmmer --cpu 1 --domtblout {d} --noali --domE 1 ".\
@@ -414,7 +474,13 @@ class Classifier(object):
         # bestOf_ = {} # key: sid --> primer name --> DOMRecord
         best_of_front = defaultdict(lambda: None)
         best_of_back = defaultdict(lambda: None)
+        self._updateBestFrontBackRecord(domFN, best_of_front, best_of_back)
+        return (best_of_front, best_of_back)
 
+    def _updateBestFrontBackRecord(self, domFN, best_of_front, best_of_back):
+        """Parses DOM output from phmmer and update best_of_front and
+        best_of_back in place. Since all hits of a read are in the same
+        chunk, dom files of chunks can be parsed one by one."""
         reader = DOMReader(domFN)
         for r in reader:
             # allow missing adapter
@@ -437,7 +503,6 @@ class Classifier(object):
                 bestOf[r.sid][r.pid].score < r.score) or \
                (r.pid not in bestOf[r.sid]):
                 bestOf[r.sid][r.pid] = r
-        return (best_of_front, best_of_back)
 
     def _getChimeraRecord(self, domFN, opts):
         """Parses phmmer DOM output from trimmed reads for chimera
@@ -449,6 +514,12 @@ class Classifier(object):
         # sid --> list of DOMRecord with primer hits in the middle
         # of sequence.
         suspicous_hits = defaultdict(lambda: [])
+        self._updateChimeraRecord(domFN, opts, suspicous_hits)
+        return suspicous_hits
+
+    def _updateChimeraRecord(self, domFN, opts, suspicous_hits):
+        """Parses phmmer DOM output and add DOMRecord of suspicious
+        chimeras to suspicous_hits in place."""
         reader = DOMReader(domFN)
         for r in reader:
             # A hit has to be in the middle of sequence, and with
@@ -457,7 +528,6 @@ class Classifier(object):
                r.sEnd < r.sLen - opts.min_dist_from_end and \
                r.score > opts.min_score:
                 suspicous_hits[r.sid].append(r)
-        return suspicous_hits
 
     def _updateChimeraInfo(self, suspicous_hits, in_read_fn, out_nc_fn,
                            out_c_fn, primer_report_fn,
@@ -623,75 +693,12 @@ class Classifier(object):
                 FastaWriter(out_fl_reads_fn) as fl_fawriter, \
                 open(primer_report_nfl_fn, 'w') as reporter:
             for read in fareader:
-                self.summary.num_reads += 1  # number of ROI reads
-                pbread = PBRead(read)
-                logging.debug("Pick up best primer combo for {r}".
-                              format(r=read.name))
-                primerIndex, strand, fw, rc = self._pickBestPrimerCombo(
-                    best_of_front[read.name], best_of_back[read.name],
-                    primer_indices, min_score)
-                logging.debug("read={0}\n".format(read.name) +
-                              "primer={0} strand={1} fw={2} rc={3}".
-                              format(primerIndex, strand, fw, rc))
-
-                if fw is None and rc is None:
-                    # No primer seen in this sequence, classified
-                    # as non-full-length
-                    newName = pbread.name
-                    if change_read_id:
-                        newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
-                                  m=pbread.movie, z=pbread.zmw,
-                                  s1=pbread.start, e1=pbread.end,
-                                  isccs=("_CCS" if pbread.isCCS else ""))
-                    annotation = ReadAnnotation(ID=newName)
-                    # Write reports of nfl reads
-                    reporter.write(annotation.toReportRecord(delimitor=",") + "\n")
-                    if len(read.sequence) >= min_seq_len:
-                        # output non-full-length reads to nfl.trimmed.fasta
-                        nfl_fawriter.writeRecord(annotation.toAnnotation(),
-                                                 read.sequence[:])
-                        self.summary.num_nfl += 1
-                    else:
-                        self.summary.num_filtered_short_reads += 1
-                    continue
-                seq = read.sequence[:] if strand == "+" else revcmp(read.sequence[:])
-                five_end, three_start = None, None
-                if fw is not None:
-                    five_end = fw.sEnd
-                    self.summary.num_5_seen += 1
-                if rc is not None:
-                    three_start = len(seq) - rc.sEnd
-                    self.summary.num_3_seen += 1
-
-                s, e = pbread.start, pbread.end
-                # Try to find polyA tail in read
-                polyAPos = self._findPolyA(seq, three_start=three_start)
-                if polyAPos >= 0:  # polyA found
-                    seq = seq[:polyAPos]
-                    e1 = s + polyAPos if strand == "+" else e - polyAPos
-                    self.summary.num_polya_seen += 1
-                elif three_start is not None:  # polyA not found
-                    seq = seq[:three_start]
-                    e1 = s + three_start if strand == "+" else e - three_start
-                else:
-                    e1 = e if strand == "+" else s
-
-                if five_end is not None:
-                    seq = seq[five_end:]
-                    s1 = s + five_end if strand == "+" else e - five_end
-                else:
-                    s1 = s if strand == "+" else e
-
-                newName = pbread.name
-                if change_read_id:
-                    newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
-                        m=pbread.movie, z=pbread.zmw, s1=s1, e1=e1,
-                        isccs=("_CCS" if pbread.isCCS else ""))
-                # Create an annotation
-                annotation = ReadAnnotation(ID=newName, strand=strand,
-                                            fiveend=five_end, polyAend=polyAPos,
-                                            threeend=three_start, primer=primerIndex,
-                                            ignore_polyA=ignore_polyA)
+                annotation, seq = self._trimRead(
+                    read=read, dFront=best_of_front[read.name],
+                    dBack=best_of_back[read.name],
+                    primer_indices=primer_indices, min_score=min_score,
+                    change_read_id=change_read_id, ignore_polyA=ignore_polyA)
+                self._summarizeRead(annotation)
 
                 # Write reports for nfl reads
                 if annotation.isFullLength is not True:
@@ -709,6 +716,79 @@ class Classifier(object):
                 else:
                     self.summary.num_filtered_short_reads += 1
 
+    def _trimRead(self, read, dFront, dBack, primer_indices, min_score,
+                  change_read_id, ignore_polyA):
+        """Pick up the best primer combo of a read given its front and
+        back primer hits (dFront/dBack: {primer_name:DOMRecord} or None),
+        find its polyA tail, trim primers and polyA away, and
+        return (annotation, trimmed sequence). Reads without any primer
+        are not trimmed.
+        """
+        pbread = PBRead(read)
+        logging.debug("Pick up best primer combo for {r}".
+                      format(r=read.name))
+        primerIndex, strand, fw, rc = self._pickBestPrimerCombo(
+            dFront, dBack, primer_indices, min_score)
+        logging.debug("read={0}\n".format(read.name) +
+                      "primer={0} strand={1} fw={2} rc={3}".
+                      format(primerIndex, strand, fw, rc))
+
+        if fw is None and rc is None:
+            # No primer seen in this sequence, classified
+            # as non-full-length
+            newName = pbread.name
+            if change_read_id:
+                newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
+                          m=pbread.movie, z=pbread.zmw,
+                          s1=pbread.start, e1=pbread.end,
+                          isccs=("_CCS" if pbread.isCCS else ""))
+            return ReadAnnotation(ID=newName), read.sequence[:]
+
+        seq = read.sequence[:] if strand == "+" else revcmp(read.sequence[:])
+        five_end, three_start = None, None
+        if fw is not None:
+            five_end = fw.sEnd
+        if rc is not None:
+            three_start = len(seq) - rc.sEnd
+
+        s, e = pbread.start, pbread.end
+        # Try to find polyA tail in read
+        polyAPos = self._findPolyA(seq, three_start=three_start)
+        if polyAPos >= 0:  # polyA found
+            seq = seq[:polyAPos]
+            e1 = s + polyAPos if strand == "+" else e - polyAPos
+        elif three_start is not None:  # polyA not found
+            seq = seq[:three_start]
+            e1 = s + three_start if strand == "+" else e - three_start
+        else:
+            e1 = e if strand == "+" else s
+
+        if five_end is not None:
+            seq = seq[five_end:]
+            s1 = s + five_end if strand == "+" else e - five_end
+        else:
+            s1 = s if strand == "+" else e
+
+        newName = pbread.name
+        if change_read_id:
+            newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
+                m=pbread.movie, z=pbread.zmw, s1=s1, e1=e1,
+                isccs=("_CCS" if pbread.isCCS else ""))
+        # Create an annotation
+        annotation = ReadAnnotation(ID=newName, strand=strand,
+                                    fiveend=five_end, polyAend=polyAPos,
+                                    threeend=three_start, primer=primerIndex,
+                                    ignore_polyA=ignore_polyA)
+        return annotation, seq
+
+    def _summarizeRead(self, annotation):
+        """Count a read and whether its 5' primer, 3' primer and polyA
+        tail are seen in summary."""
+        self.summary.num_reads += 1  # number of ROI reads
+        self.summary.num_5_seen += annotation.fiveseen
+        self.summary.num_3_seen += annotation.threeseen
+        self.summary.num_polya_seen += annotation.polyAseen
+
     def _validate_outputs(self, out_dir, out_all_reads_fn):
         """Validate and create output directory."""
         logging.info("Creating output directory {d}.".format(d=out_dir))
@@ -738,6 +818,8 @@ class Classifier(object):
         (2) copy input with just the first/last k bases
         (3) run phmmer
         (4) parse phmmer DOM output, trim barcodes and output summary
+        If primer_engine is native, (2)-(4) are replaced by aligning
+        primers to the first/last k bases of reads in-process.
         """
         logging.info("Start to find and trim 3'/5' primers and polyAs.")
         # Sanity check input primers and create forward/reverse primers
@@ -748,13 +830,28 @@ class Classifier(object):
             primer_out_fn=self.primer_front_back_fn,
             revcmp_primers=False)
 
+        # read id --> primer name --> best DOMRecord
+        best_of_front = defaultdict(lambda: None)
+        best_of_back = defaultdict(lambda: None)
+
         logging.info("reuse_dom = {0}".format(self.reuse_dom))
-        if op.exists(self.out_front_back_dom_fn) and self.reuse_dom:
+        if self.primer_engine == "native":
+            logging.info("Find primers in-process using native primer engine.")
+            matcher = PrimerMatcher(
+                primer_fn=self.primer_front_back_fn,
+                window_size=self.chimera_detection_opts.primer_search_window)
+            with CCSInput(self.reads_fn) as reader:
+                matcher.update(reader, best_of_front, best_of_back)
+        elif op.exists(self.out_front_back_dom_fn) and self.reuse_dom:
             logging.warn("Primer detection output already exists. Parsing {0}".
                          format(self.out_front_back_dom_fn))
+            # Parse dom file, and fill in dictionary of front & back.
+            logging.info("Get the best front & back primer hits.")
+            self._updateBestFrontBackRecord(self.out_front_back_dom_fn,
+                                            best_of_front, best_of_back)
         else:
             # Split reads in reads_fn into smaller chunks.
-            num_chunks = max(min(self.cpus, self.numReads), 1)
+            num_chunks = self._numPhmmerChunks(self.numReads)
             reads_per_chunk = int(math.ceil(self.numReads / (float(num_chunks))))
             num_chunks = int(math.ceil(self.numReads / float(reads_per_chunk)))
 
@@ -778,17 +875,16 @@ class Classifier(object):
                              extract_front_back_only=True,
                              window_size=window_size)
 
-            # Start n='num_chunks' phmmer.
+            # Run phmmer on n='num_chunks' chunks, and parse dom file of
+            # each chunk as soon as it is done.
             self._startPhmmers(
                 chunked_reads_fns=self.chunked_front_back_reads_fns,
                 chunked_dom_fns=self.chunked_front_back_dom_fns,
                 out_dom_fn=self.out_front_back_dom_fn,
                 primer_fn=self.primer_front_back_fn,
-                pbmatrix_fn=self.pbmatrix_fn)
-
-        # Parse dome file, and return dictionary of front & back.
-        best_of_front, best_of_back = self._getBestFrontBackRecord(
-            self.out_front_back_dom_fn)
+                pbmatrix_fn=self.pbmatrix_fn,
+                dom_callback=lambda domFN: self._updateBestFrontBackRecord(
+                    domFN, best_of_front, best_of_back))
 
         # Trim bar code away
         self._trimBarCode(reads_fn=self.reads_fn,
@@ -824,11 +920,15 @@ class Classifier(object):
         Return:
             (num_nc, num_c, num_nc_bases, num_c_bases)
         """
+        # sid --> list of DOMRecord with primer hits in the middle
+        suspicous_hits = defaultdict(lambda: [])
         if op.exists(out_dom) and self.reuse_dom:
             logging.warn("Chimera detection output already exists. Parse {o}.".
                          format(o=out_dom))
+            suspicous_hits = self._getChimeraRecord(out_dom,
+                                                    self.chimera_detection_opts)
         else:
-            num_chunks = max(min(num_reads, self.cpus), 1)
+            num_chunks = self._numPhmmerChunks(num_reads)
             reads_per_chunk = int(math.ceil(num_reads / float(num_chunks)))
             num_chunks = int(math.ceil(num_reads / float(reads_per_chunk)))
 
@@ -843,14 +943,14 @@ class Classifier(object):
                              chunked_reads_fns=chunked_reads_fns,
                              extract_front_back_only=False)
 
+            logging.info("Identify chimera records from {f}.".format(f=out_dom))
             self._startPhmmers(chunked_reads_fns=chunked_reads_fns,
                                chunked_dom_fns=chunked_dom_fns,
                                out_dom_fn=out_dom,
                                primer_fn=self.primer_chimera_fn,
-                               pbmatrix_fn=self.pbmatrix_fn)
-
-        suspicous_hits = self._getChimeraRecord(out_dom,
-                                                self.chimera_detection_opts)
+                               pbmatrix_fn=self.pbmatrix_fn,
+                               dom_callback=lambda domFN: self._updateChimeraRecord(
+                                   domFN, self.chimera_detection_opts, suspicous_hits))
 
         # Update chimera information
         (num_nc, num_c, num_nc_bases, num_c_bases) = \
@@ -932,6 +1032,157 @@ class Classifier(object):
         self._cleanup([self._primer_report_nfl_fn,
                        self._primer_report_fl_fn])
 
+    def _iterBatches(self, reader, batch_size):
+        """Yield lists of at most batch_size StreamReads from reader."""
+        batch = []
+        for read in reader:
+            batch.append(StreamRead(name=read.name, sequence=read.sequence[:]))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _classifyBatch(self, batch, primer_indices, matcher, chimera_matcher):
+        """Find primers, trim primers and polyAs, and detect chimeras of
+        a batch of reads in-process. Return a list of
+        (annotation, trimmed sequence) in the order of batch, where
+        annotation.chimera is set if chimera detection applies.
+        """
+        opts = self.chimera_detection_opts
+        ret = []
+        for read in batch:
+            dFront, dBack = matcher.match(read.name, read.sequence)
+            annotation, seq = self._trimRead(
+                read=read, dFront=dFront, dBack=dBack,
+                primer_indices=primer_indices, min_score=opts.min_score,
+                change_read_id=self.change_read_id,
+                ignore_polyA=self.ignore_polyA)
+            if len(seq) >= opts.min_seq_len and \
+               (annotation.isFullLength is True or opts.detect_chimera_nfl):
+                hits = chimera_matcher.match_middle(
+                    annotation.ID, seq, opts.min_dist_from_end)
+                annotation.chimera = 1 if any(h.score > opts.min_score
+                                              for h in hits.itervalues()) else 0
+            ret.append((annotation, seq))
+        return ret
+
+    def runStreaming(self):
+        """Find and trim primers and polyAs, and detect chimeras of reads
+        in a single pass over reads_fn, using the native primer engine.
+
+        Reads are classified in batches of self.batch_size reads on at
+        most self.cpus threads, results are written in input order as
+        soon as a batch is done, and at most 2 * self.cpus batches are
+        held in memory. Outputs are the same files as runPrimerTrimmer
+        followed by runChimeraDetector would produce.
+        """
+        logging.info("Start to classify reads in streaming mode.")
+        opts = self.chimera_detection_opts
+        primer_indices = self._processPrimers(
+            primer_fn=self.primer_fn,
+            window_size=opts.primer_search_window,
+            primer_out_fn=self.primer_front_back_fn,
+            revcmp_primers=False)
+        self._processPrimers(
+            primer_fn=self.primer_fn,
+            window_size=opts.primer_search_window,
+            primer_out_fn=self.primer_chimera_fn,
+            revcmp_primers=True)
+        matcher = PrimerMatcher(primer_fn=self.primer_front_back_fn,
+                                window_size=opts.primer_search_window)
+        chimera_matcher = PrimerMatcher(primer_fn=self.primer_chimera_fn)
+
+        # Without chimera detection on nfl reads, nfl reads are final.
+        nfl_fn = self.out_nflnc_fn_fasta if opts.detect_chimera_nfl \
+            else self.out_nfl_fn_fasta
+        num_workers = max(1, self.cpus)
+        pool = ThreadPool(processes=num_workers)
+        with CCSInput(self.reads_fn) as reader, \
+                FastaWriter(self.out_flnc_fn_fasta) as flnc_writer, \
+                FastaWriter(self.out_flc_fn) as flc_writer, \
+                FastaWriter(nfl_fn) as nfl_writer, \
+                FastaWriter(self.out_nflc_fn_fasta) as nflc_writer, \
+                open(self._primer_report_fl_fn, 'w') as fl_reporter, \
+                open(self._primer_report_nfl_fn, 'w') as nfl_reporter:
+            fl_reporter.write(ReadAnnotation.header(delimiter=",") + "\n")
+            writers = (flnc_writer, flc_writer, nfl_writer, nflc_writer,
+                       fl_reporter, nfl_reporter)
+            pending = deque()
+            try:
+                for batch in self._iterBatches(reader, self.batch_size):
+                    pending.append(pool.apply_async(
+                        self._classifyBatch,
+                        (batch, primer_indices, matcher, chimera_matcher)))
+                    if len(pending) >= 2 * num_workers:
+                        self._writeBatch(pending.popleft().get(), *writers)
+                while len(pending) > 0:
+                    self._writeBatch(pending.popleft().get(), *writers)
+                pool.close()
+            except Exception:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        if opts.detect_chimera_nfl is True:
+            # Concatenate out_nflnc_fn and out_nflc_fn as out_nfl_fn
+            cat_files(src=[self.out_nflnc_fn_fasta, self.out_nflc_fn_fasta],
+                      dst=self.out_nfl_fn_fasta)
+            # Concatenate out_flnc and out_nflnc to make out_all_reads_fn
+            cat_files(src=[self.out_flnc_fn_fasta, self.out_nflnc_fn_fasta],
+                      dst=self.out_all_reads_fn_fasta)
+        else:
+            self._cleanup([self.out_nflc_fn_fasta])
+            # Concatenate out_flnc and out_nfl to make out_all_reads_fn
+            cat_files(src=[self.out_flnc_fn_fasta, self.out_nfl_fn_fasta],
+                      dst=self.out_all_reads_fn_fasta)
+
+        cat_files(src=[self._primer_report_fl_fn, self._primer_report_nfl_fn],
+                  dst=self.primer_report_fn)
+        self._cleanup([self._primer_report_nfl_fn,
+                       self._primer_report_fl_fn])
+        logging.info("Done with classifying reads in streaming mode.")
+
+    def _writeBatch(self, results, flnc_writer, flc_writer, nfl_writer,
+                    nflc_writer, fl_reporter, nfl_reporter):
+        """Write (annotation, trimmed sequence) of a classified batch to
+        outputs and count them in summary."""
+        min_seq_len = self.chimera_detection_opts.min_seq_len
+        detect_chimera_nfl = self.chimera_detection_opts.detect_chimera_nfl
+        for annotation, seq in results:
+            self._summarizeRead(annotation)
+            isFullLength = annotation.isFullLength is True
+            if len(seq) < min_seq_len:
+                self.summary.num_filtered_short_reads += 1
+                # Short nfl reads are reported unless nfl reads are
+                # reported after chimera detection.
+                if not isFullLength and not detect_chimera_nfl:
+                    nfl_reporter.write(annotation.toReportRecord(delimitor=",") + "\n")
+                continue
+
+            if isFullLength:
+                self.summary.num_fl += 1
+                if annotation.chimera == 0:
+                    self.summary.num_flnc += 1
+                    self.summary.num_flnc_bases += len(seq)
+                    flnc_writer.writeRecord(annotation.toAnnotation(), seq[:])
+                else:
+                    self.summary.num_flc += 1
+                    flc_writer.writeRecord(annotation.toAnnotation(), seq[:])
+                fl_reporter.write(annotation.toReportRecord(delimitor=",") + "\n")
+            else:
+                self.summary.num_nfl += 1
+                if not detect_chimera_nfl:
+                    nfl_writer.writeRecord(annotation.toAnnotation(), seq[:])
+                elif annotation.chimera == 0:
+                    self.summary.num_nflnc += 1
+                    nfl_writer.writeRecord(annotation.toAnnotation(), seq[:])
+                else:
+                    self.summary.num_nflc += 1
+                    nflc_writer.writeRecord(annotation.toAnnotation(), seq[:])
+                nfl_reporter.write(annotation.toReportRecord(delimitor=",") + "\n")
+
     def run(self):
         """Classify/annotate reads according to 5' primer seen,
         3' primer seen, polyA seen, chimera (concatenation of two
@@ -941,6 +1192,7 @@ class Classifier(object):
         (2) Check phmmer is runnable
         (3) Find primers using phmmer and trim away primers and polyAs
         (4) Detect chimeras from trimmed reads
+        In streaming mode, (2)-(4) are replaced by runStreaming.
         """
         # Validate input files and required data files.
         self._validate_inputs(self.reads_fn, self.primer_fn, self.pbmatrix_fn)
@@ -948,11 +1200,15 @@ class Classifier(object):
         # Validate and create output dir.
         self._validate_outputs(self.out_dir, self.out_all_reads_fn_fasta)
 
-        # Sanity check phmmer can be called successfully.
-        self._checkPhmmer()
+        if self.streaming:
+            # Find primers, trim and detect chimeras in one pass.
+            self.runStreaming()
+        else:
+            # Sanity check phmmer can be called successfully.
+            self._checkPhmmer()
 
-        # Find and trim primers and polyAs.
-        self.runPrimerTrimmer()
+            # Find and trim primers and polyAs.
+            self.runPrimerTrimmer()
 
         # Check whether no fl reads detected.
         no_flnc_errMsg = "No full-length non-chimeric reads detected."
@@ -960,7 +1216,7 @@ class Classifier(object):
             logging.error(no_flnc_errMsg)
             if not self.ignore_empty_output:
                 raise ClassifierException(no_flnc_errMsg)
-        else:
+        elif not self.streaming:
             # Detect chimeras and generate primer reports.
             self.runChimeraDetector()
 
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""
+Job completion notification, so that a stage waiting for SGE jobs or
+for output files wakes up as soon as a dependency finishes, instead
+of sleeping between qstat calls or between checks of DONE files.
+
+(1) JobNotifier listens on a TCP socket of the submit host, on all
+    interfaces by default, since the fqdn of a host may resolve to a
+    loopback address (e.g., 127.0.1.1 on Debian). Job scripts
+    wrapped by JobNotifier.wrap_cmd send a 'start' and an 'end' event
+    with a random token of the notifier, $JOB_ID, time stamps and exit
+    code to it, using bash /dev/tcp, so that no extra program is
+    required on compute nodes. Events without the token, or which can
+    not be parsed, are ignored.
+(2) FileWatcher uses Linux inotify to wake up when files in local
+    directories are created or closed. Events of files written on
+    other hosts may not be seen on a shared file system, so watchers
+    always re-check files after a timeout.
+
+Example:
+    notifier = JobNotifier()
+    write_cmd_to_script(notifier.wrap_cmd("blasr ..."), "a.sh")
+    jid = sge_submit("qsub ... a.sh")
+    notifier.add_job(jid)
+    notifier.wait(jids=[jid], timeout=60)
+    notifier.log_timing([jid])
+    notifier.close()
+
+    wait_for_files(["a.pickle", "a.pickle.DONE"], recheck_every=60)
+"""
+
+import os
+import os.path as op
+import binascii
+import errno
+import socket
+import select
+import time
+import logging
+import ctypes
+import ctypes.util
+
+__author__ = 'etseng|yli@pacificbiosciences.com'
+
+__all__ = ["JobNotifier", "FileWatcher", "wait_for_files"]
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+# Max size of a job event, longer messages are dropped.
+MAX_EVENT_SIZE = 1024
+
+
+class JobNotifier(object):
+
+    """
+    Collect 'start' and 'end' events sent by job scripts to a TCP
+    socket, and record when jobs were submitted, started and ended.
+    """
+
+    def __init__(self, host=None, port=0, bind_address=''):
+        """
+        Listen on port (0: any free port) of bind_address ('': all
+        interfaces), and let jobs send events to host:port, where host
+        is this host by default.
+        """
+        self.host = host if host is not None else socket.getfqdn()
+        self.token = binascii.hexlify(os.urandom(16))
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((bind_address, port))
+        self._sock.listen(128)
+        self._sock.setblocking(0)
+        self.port = self._sock.getsockname()[1]
+        self.submitted = {}  # jid --> time submitted
+        self.started = {}    # jid --> time started
+        self.ended = {}      # jid --> (time ended, exit code)
+        self.num_events = 0  # number of valid events received
+
+    @classmethod
+    def create(cls):
+        """Return a JobNotifier, or None if unable to listen on a socket."""
+        try:
+            return cls()
+        except (socket.error, socket.gaierror) as e:
+            logging.warning("Unable to create job notifier, " +
+                            "fall back to polling: %s", str(e))
+            return None
+
+    def close(self):
+        """Stop listening. Warn if jobs were added but no event was
+        ever received, as jobs may be unable to connect to host."""
+        if len(self.submitted) > 0 and self.num_events == 0:
+            logging.warning("Job notifier on %s:%d received no event from %d jobs, " +
+                            "which may be unable to connect to it, waiting " +
+                            "fell back to polling.", self.host, self.port,
+                            len(self.submitted))
+        self._sock.close()
+
+    def wrap_cmd(self, cmd):
+        """
+        Return a list of cmds which run cmd, and notify this notifier
+        when cmd starts and ends. The exit code of cmd is kept.
+        Notification failures are ignored.
+        """
+        dev = "/dev/tcp/{h}/{p}".format(h=self.host, p=self.port)
+        notify = '(echo "{e} ' + self.token + ' ${{JOB_ID:-$$}} $(date +%s) {c}" > ' + \
+                 dev + ') >/dev/null 2>&1 || true'
+        return [notify.format(e="start", c="0"),
+                cmd,
+                "_code=$?",
+                notify.format(e="end", c="$_code"),
+                "exit $_code\n"]
+
+    def add_job(self, jid, submitted_time=None):
+        """Record that job jid was submitted."""
+        self.submitted[str(jid)] = submitted_time if submitted_time \
+            is not None else time.time()
+
+    def finished(self, jids):
+        """Return jids which have ended."""
+        return set(str(jid) for jid in jids if str(jid) in self.ended)
+
+    def fileno(self):
+        """Return file descriptor of the socket, for select."""
+        return self._sock.fileno()
+
+    def poll(self):
+        """Read all pending events without blocking."""
+        while True:
+            try:
+                conn, dummy_addr = self._sock.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            try:
+                conn.settimeout(5)
+                data = ""
+                while not data.endswith("\n") and len(data) <= MAX_EVENT_SIZE:
+                    chunk = conn.recv(1024)
+                    if not chunk:
+                        break
+                    data += chunk
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+            self._add_event(data)
+
+    def _add_event(self, line):
+        """Parse an event 'start|end token jid time code', ignore events
+        which are malformed or do not carry the token of this notifier."""
+        fields = line.strip().split()
+        if len(fields) != 5 or fields[0] not in ("start", "end") or \
+                fields[1] != self.token:
+            logging.debug("Ignoring job event %r", line[:MAX_EVENT_SIZE])
+            return
+        try:
+            event, jid, t, code = fields[0], fields[2], float(fields[3]), int(fields[4])
+        except ValueError:
+            logging.debug("Ignoring job event %r", line[:MAX_EVENT_SIZE])
+            return
+        self.num_events += 1
+        if event == "start":
+            self.started[jid] = t
+        else:
+            self.ended[jid] = (t, code)
+            logging.debug("Job %s ended with exit code %d.", jid, code)
+
+    def wait(self, jids, timeout=None):
+        """
+        Wait until any job in jids which has not ended yet ends, or
+        timeout seconds have passed. Return jids which have ended.
+        """
+        jids = set(str(jid) for jid in jids)
+        deadline = None if timeout is None else time.time() + timeout
+        pending = jids - self.finished(jids)
+        while len(pending) > 0:
+            left = None if deadline is None else max(0, deadline - time.time())
+            readable, dummy_w, dummy_x = select.select([self._sock], [], [], left)
+            if len(readable) > 0:
+                self.poll()
+            if len(pending - self.finished(pending)) < len(pending):
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+        return self.finished(jids)
+
+    def run_time(self, jid, now=None):
+        """Return seconds job jid has been running, or None if not started."""
+        jid = str(jid)
+        if jid not in self.started:
+            return None
+        end = self.ended[jid][0] if jid in self.ended else \
+            (now if now is not None else time.time())
+        return end - self.started[jid]
+
+    def log_timing(self, jids):
+        """Log queue wait time and run time of jobs."""
+        for jid in jids:
+            jid = str(jid)
+            if jid not in self.started:
+                continue
+            queued = self.started[jid] - self.submitted[jid] \
+                if jid in self.submitted else float('nan')
+            logging.info("SGE job %s waited %.0f sec in queue, ran %.0f sec.",
+                         jid, queued, self.run_time(jid))
+
+
+class FileWatcher(object):
+
+    """
+    Wake up when files are created, written or moved into a set of
+    local directories, using inotify. If inotify is unavailable,
+    wait() simply sleeps until timeout.
+    """
+
+    _libc = None
+
+    def __init__(self, dirs):
+        self.fd = None
+        try:
+            if FileWatcher._libc is None:
+                FileWatcher._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                                use_errno=True)
+            fd = FileWatcher._libc.inotify_init()
+        except (OSError, AttributeError):
+            fd = -1
+        if fd < 0:
+            logging.debug("inotify is not available, fall back to polling.")
+            return
+        self.fd = fd
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        for d in set(op.abspath(d) for d in dirs):
+            if FileWatcher._libc.inotify_add_watch(self.fd, d, mask) < 0:
+                logging.debug("Unable to watch %s, errno %d", d,
+                              ctypes.get_errno())
+
+    def close(self):
+        """Stop watching."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def fileno(self):
+        """Return inotify file descriptor for select, or None."""
+        return self.fd
+
+    def drain(self):
+        """Discard pending events, only whether anything changed matters."""
+        if self.fd is not None:
+            os.read(self.fd, 64 * 1024)
+
+    def wait(self, timeout):
+        """Wait until any watched directory changes or timeout seconds
+        have passed. Return True if woken up by a change."""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        readable, dummy_w, dummy_x = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return False
+        self.drain()
+        return True
+
+
+def wait_for_files(filenames, timeout=None, recheck_every=60, notifier=None):
+    """
+    Wait until all filenames exist, or timeout seconds have passed.
+    Return filenames which still do not exist.
+
+    Files are checked again as soon as a file is created in their
+    directories (inotify), or a job event is sent to notifier, and at
+    least every recheck_every seconds.
+    """
+    start_t = time.time()
+    missing = [f for f in filenames if not op.exists(f)]
+    if len(missing) == 0:
+        return []
+    with FileWatcher(op.dirname(op.abspath(f)) for f in missing) as watcher:
+        while True:
+            missing = [f for f in missing if not op.exists(f)]
+            if len(missing) == 0:
+                break
+            wait_t = recheck_every
+            if timeout is not None:
+                wait_t = min(wait_t, timeout - (time.time() - start_t))
+                if wait_t <= 0:
+                    break
+            # wake up on either a file event or a job event
+            readers = [x for x in (watcher, notifier)
+                       if x is not None and x.fileno() is not None]
+            if len(readers) == 0:
+                time.sleep(wait_t)
+                continue
+            readable, dummy_w, dummy_x = select.select(readers, [], [], wait_t)
+            if notifier is not None and notifier in readable:
+                notifier.poll()
+            if watcher in readable:
+                watcher.drain()
+    return missing
@@ -121,6 +121,26 @@ def add_classify_arguments(parser):
                            dest="cpus",
                            help="Number of CPUs to run HMMER (default: 8)")
 
+    helpstr = "Engine to find primers, phmmer runs phmmer on read " + \
+              "windows, native aligns primers to read windows " + \
+              "in-process using banded Smith-Waterman (default: phmmer)"
+    hmm_group.add_argument("--primer_engine",
+                           default="phmmer",
+                           type=str,
+                           choices=["phmmer", "native"],
+                           dest="primer_engine",
+                           help=helpstr)
+
+    helpstr = "Find primers, trim primers and polyA tails, and " + \
+              "detect chimeras in a single streaming pass over reads " + \
+              "in batches, implies --primer_engine native " + \
+              "(default: turned off)"
+    hmm_group.add_argument("--streaming",
+                           default=False,
+                           action="store_true",
+                           dest="streaming",
+                           help=helpstr)
+
     hmm_group.add_argument("--summary",
                            default=None,
                            type=str,
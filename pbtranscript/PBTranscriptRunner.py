@@ -116,6 +116,8 @@ class PBTranscript(PBMultiToolRunner):
                                  out_nfl_fn=self.args.nfl_fa,
                                  ignore_polyA=self.args.ignore_polyA,
                                  reuse_dom=self.args.reuse_dom,
+                                 primer_engine=self.args.primer_engine,
+                                 streaming=self.args.streaming,
                                  ignore_empty_output=self.args.ignore_empty_output)
                 obj.run()
             elif cmd == 'cluster':
@@ -0,0 +1,138 @@
+"""
+Define class `PrimerMatcher`, which finds primers in the front and back
+windows of reads in-process, as an alternative to running phmmer on
+chunked read windows and parsing its dom output.
+"""
+
+import logging
+from pbcore.io import FastaReader
+
+from pbtranscript.io import DOMRecord
+from pbtranscript.Utils import revcmp
+from pbtranscript.c_primer import align_primer
+
+__all__ = ["PrimerMatcher", "PRIMER_ENGINES", "NATIVE_BITS_PER_SCORE",
+           "NATIVE_NULL_BITS", "native_bits"]
+
+# Primer detection engines supported by Classifier.
+PRIMER_ENGINES = ("phmmer", "native")
+
+# align_primer scores a matched base as 2. Scores are converted to bits
+# as NATIVE_BITS_PER_SCORE * score - NATIVE_NULL_BITS, which is within
+# 0.3 bits of phmmer domain scores of the same primer hits (see
+# tests/data/test_parseHmmDom.dom), so that --min_score applies to both
+# engines, while chance hits of a primer in 1 kb of random sequence stay
+# below the default --min_score, as they do with phmmer.
+NATIVE_BITS_PER_SCORE = 0.6
+NATIVE_NULL_BITS = 3.0
+
+# Hits starting after this position of a primer or a read window are
+# ignored, the same as parsing phmmer dom output.
+MAX_HIT_START = 48
+
+# Number of diagonals an alignment may drift away from where it starts.
+BAND_WIDTH = 16
+
+
+def native_bits(score):
+    """Return phmmer-like bit score of an align_primer score."""
+    return round(score * NATIVE_BITS_PER_SCORE - NATIVE_NULL_BITS, 1)
+
+
+class PrimerMatcher(object):
+
+    """
+    Find the best hit of each primer in the front window and in the
+    reverse complemented back window of a read, using banded
+    Smith-Waterman, and return hits as DOMRecords with phmmer-like
+    scores, so that they can be used by Classifier._pickBestPrimerCombo
+    and Classifier._trimBarCode unchanged.
+    """
+
+    def __init__(self, primer_fn, window_size=100,
+                 max_hit_start=MAX_HIT_START, band_width=BAND_WIDTH):
+        """
+        primer_fn --- primers generated by Classifier._processPrimers,
+                      e.g., >F0, >R0 (reverse complemented), ...
+        window_size --- search primers in the first and the last
+                        window_size bases of reads.
+        """
+        self.window_size = window_size
+        self.max_hit_start = max_hit_start
+        self.band_width = band_width
+        with FastaReader(primer_fn) as reader:
+            self.primers = [(r.name.split()[0], str(r.sequence).upper())
+                            for r in reader]
+        logging.debug("PrimerMatcher loaded {n} primers from {f}.".
+                      format(n=len(self.primers), f=primer_fn))
+
+    def windows(self, sequence):
+        """Return (front window, reverse complemented back window)."""
+        sequence = str(sequence).upper()
+        return (sequence[:self.window_size],
+                revcmp(sequence)[:self.window_size])
+
+    def match_window(self, sid, window):
+        """
+        Return {primer name: DOMRecord} of the best hit of each primer
+        in window, primers without a hit are excluded.
+        """
+        hits = {}
+        for pid, pseq in self.primers:
+            aln = align_primer(pseq, window, self.max_hit_start,
+                               self.band_width)
+            if aln is None:
+                continue
+            score, pStart, pEnd, sStart, sEnd = aln
+            hits[pid] = DOMRecord(pid=pid, sid=sid,
+                                  score=native_bits(score),
+                                  pStart=pStart, pEnd=pEnd, pLen=len(pseq),
+                                  sStart=sStart, sEnd=sEnd, sLen=len(window))
+        return hits
+
+    def match(self, read_name, sequence):
+        """
+        Return ({primer name: DOMRecord} of the front window,
+                 {primer name: DOMRecord} of the back window)
+        of a read, or None instead of an empty dict.
+        """
+        front, back = self.windows(sequence)
+        return (self.match_window(read_name, front) or None,
+                self.match_window(read_name, back) or None)
+
+    def match_middle(self, read_name, sequence, min_dist_from_end):
+        """
+        Return {primer name: DOMRecord} of the best hit of each primer
+        which is more than min_dist_from_end bases away from both ends
+        of sequence, the same as hits picked from phmmer dom output for
+        chimera detection. Positions are relative to sequence.
+        """
+        sequence = str(sequence).upper()
+        offset = min_dist_from_end + 1
+        middle = sequence[offset:len(sequence) - offset]
+        hits = {}
+        for pid, pseq in self.primers:
+            # any start and drift is allowed within the middle
+            aln = align_primer(pseq, middle, len(pseq) + len(middle),
+                               len(pseq) + len(middle))
+            if aln is None:
+                continue
+            score, pStart, pEnd, sStart, sEnd = aln
+            hits[pid] = DOMRecord(pid=pid, sid=read_name,
+                                  score=native_bits(score),
+                                  pStart=pStart, pEnd=pEnd, pLen=len(pseq),
+                                  sStart=sStart + offset, sEnd=sEnd + offset,
+                                  sLen=len(sequence))
+        return hits
+
+    def update(self, reads, best_of_front, best_of_back):
+        """
+        Find primers of all reads, and update best_of_front and
+        best_of_back, {read id: {primer name: DOMRecord}}, in place.
+        """
+        for read in reads:
+            front, back = self.match(read.name, read.sequence)
+            if front is not None:
+                best_of_front[read.name] = front
+            if back is not None:
+                best_of_back[read.name] = back
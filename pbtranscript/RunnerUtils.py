@@ -10,6 +10,7 @@ import os
 from multiprocessing.pool import ThreadPool
 from pbcore.util.Process import backticks
 from pbtranscript.ClusterOptions import SgeOptions
+from pbtranscript.JobNotifier import JobNotifier
 
 __author__ = 'etseng|yli@pacificbiosciences.com'
 
@@ -148,7 +149,7 @@ def kill_sge_jobs(jids):
         time.sleep(3) # wiat for qdel to take effect...
 
 
-def wait_for_sge_jobs(jids, wait_timeout=None, run_timeout=None):
+def wait_for_sge_jobs(jids, wait_timeout=None, run_timeout=None, notifier=None):
     """
     Wait for all sge job ids {jids} to complete before exiting.
     Return sge job ids that have been killed by qdel.
@@ -168,6 +169,11 @@ def wait_for_sge_jobs(jids, wait_timeout=None, run_timeout=None):
     Note that if both wait_timeout and run_timeout are set, qdel a job
     when the earliest time out is reached.
 
+    If notifier (a JobNotifier which jobs report to) is set, return as
+    soon as all jobs have reported that they ended, and only call qstat
+    once a minute to find jobs which died without reporting. Run time
+    of a job is counted from its start event.
+
     Parameters:
       jids - sge job ids that we are waiting for
       wait_timeout - maximum time in seconds waiting for sge jobs,
@@ -178,24 +184,41 @@ def wait_for_sge_jobs(jids, wait_timeout=None, run_timeout=None):
                    If is None, no cap.
     """
     count = 0
-    check_sge_every_n_seconds = 10 # check sge every n seconds.
-    time_passed = 0
+    # check sge every n seconds.
+    check_sge_every_n_seconds = 10 if notifier is None else 60
+    start_t = last_t = time.time()
+    qstat_t = None # last time qstat was called
     runtime_passed = dict({jid: 0 for jid in jids})
     killed_jobs = [] # jobs that have been killed.
+    not_done_jids = list(jids)
 
     while True:
-        active_d = get_active_sge_jobs()
-        not_done_jids = list(set(jids).intersection(set(active_d.keys())))
+        if qstat_t is None or time.time() - qstat_t >= check_sge_every_n_seconds:
+            active_d = get_active_sge_jobs()
+            qstat_t = time.time()
+            not_done_jids = list(set(not_done_jids).intersection(set(active_d.keys())))
+        if notifier is not None:
+            not_done_jids = list(set(not_done_jids) - notifier.finished(not_done_jids))
         if len(not_done_jids) != 0:
             # some sge jobs are still running or qw, or held
-            time.sleep(check_sge_every_n_seconds)
-            time_passed += check_sge_every_n_seconds
+            if notifier is None:
+                time.sleep(check_sge_every_n_seconds)
+            else:
+                # wake up as soon as any job ends
+                notifier.wait(jids=not_done_jids,
+                              timeout=max(0, qstat_t + check_sge_every_n_seconds -
+                                          time.time()))
+                not_done_jids = list(set(not_done_jids) -
+                                     notifier.finished(not_done_jids))
+                if len(not_done_jids) == 0:
+                    break
+            now = time.time()
             count += 1
             if count % 100 == 0:
                 logging.debug("Waiting for sge job to complete: %s.",
                               ",".join(not_done_jids))
 
-            if wait_timeout is not None and time_passed >= wait_timeout:
+            if wait_timeout is not None and now - start_t >= wait_timeout:
                 kill_sge_jobs(jids=not_done_jids)
                 killed_jobs.extend(not_done_jids)
                 break
@@ -203,16 +226,23 @@ def wait_for_sge_jobs(jids, wait_timeout=None, run_timeout=None):
             if run_timeout is not None:
                 # update runtime_passed
                 for jid in not_done_jids:
-                    if active_d[jid].startswith('r'):
-                        runtime_passed[jid] += check_sge_every_n_seconds
+                    run_time = notifier.run_time(jid, now=now) \
+                        if notifier is not None else None
+                    if run_time is not None:
+                        runtime_passed[jid] = run_time
+                    elif active_d.get(jid, '').startswith('r'):
+                        runtime_passed[jid] += now - last_t
 
                 to_kill_jids = [jid for jid in not_done_jids
                                 if runtime_passed[jid] >= run_timeout]
                 kill_sge_jobs(jids=to_kill_jids)
                 killed_jobs.extend(to_kill_jids)
+            last_t = now
         else:
             break
 
+    if notifier is not None:
+        notifier.log_timing(jids)
     return list(set(killed_jobs))
 
 
@@ -220,7 +250,7 @@ def sge_job_runner(cmds_list, script_files,
                    #done_script,
                    num_threads_per_job, sge_opts, qsub_try_times=3,
                    wait_timeout=600, run_timeout=600,
-                   rescue=None, rescue_times=3):
+                   rescue=None, rescue_times=3, notify=True):
     """
     Write commands in cmds_list each to a file in script_files.
     Qsub all scripts to sge, then qsub done_script which depends
@@ -245,6 +275,9 @@ def sge_job_runner(cmds_list, script_files,
                locally - yes, run it locally exactly once
                sge - yes, run it through sge, try multiple times until suceed
       rescue_times - maximum times of rescuing a qdel-ed job.
+      notify - whether or not jobs report their start and end to a
+               JobNotifier of this process, so that we stop waiting as
+               soon as all jobs end, instead of polling qstat.
 
     ToDo:
     (1) if SGE fails at qsub, -- resubmit? wait? run local?
@@ -257,13 +290,17 @@ def sge_job_runner(cmds_list, script_files,
     jids = []
     jids_to_cmds = {}
     jids_to_scripts = {}
+    notifier = JobNotifier.create() if notify and len(cmds_list) > 0 else None
     for cmd, script in zip(cmds_list, script_files):
         if run_timeout is not None and not cmd.startswith("timeout"):
             cmd = "timeout %d %s" % (run_timeout, cmd)
-        write_cmd_to_script(cmd=cmd, script=script)
+        write_cmd_to_script(cmd=cmd if notifier is None else notifier.wrap_cmd(cmd),
+                            script=script)
         qsub_cmd = sge_opts.qsub_cmd(script=script, num_threads=num_threads_per_job,
                                      elog=script+".elog", olog=script+".olog")
         jid = sge_submit(qsub_cmd=qsub_cmd, qsub_try_times=qsub_try_times)
+        if notifier is not None:
+            notifier.add_job(jid)
         jids.append(jid)
         jids_to_cmds[jid] = cmd
         jids_to_scripts[jid] = script
@@ -278,8 +315,13 @@ def sge_job_runner(cmds_list, script_files,
     #
     # Replace 'qsub -hold_jid' by wait_for_sge_jobs with timeout.
 
-    killed_jobs = wait_for_sge_jobs(jids=jids, wait_timeout=wait_timeout,
-                                    run_timeout=run_timeout)
+    try:
+        killed_jobs = wait_for_sge_jobs(jids=jids, wait_timeout=wait_timeout,
+                                        run_timeout=run_timeout,
+                                        notifier=notifier)
+    finally:
+        if notifier is not None:
+            notifier.close()
     killed_cmds = [jids_to_cmds[jid] for jid in killed_jobs]
     killed_scripts = [jids_to_scripts[jid] for jid in killed_jobs]
 
@@ -194,6 +194,16 @@ def get_files_from_file_or_fofn(filename):
         return [filename]
 
 
+def files_signature(file_names):
+    """Return a list of (realpath, size, mtime) of files, which is used
+    to check whether an index built from these files is stale."""
+    ret = []
+    for fn in file_names:
+        st = os.stat(realpath(fn))
+        ret.append((realpath(fn), st.st_size, int(st.st_mtime)))
+    return ret
+
+
 def enum(**enums):
     """Simulate enum."""
     return type('Enum', (), enums)
@@ -1,4 +1,5 @@
-__ALL__ = ["exon_finding",  "intervals_all_adjacent", "exon_matching"]
+__ALL__ = ["exon_finding",  "intervals_all_adjacent", "exon_matching",
+           "merge_exon_lists"]
 
 cimport numpy as np
 import numpy as np
@@ -87,3 +88,69 @@ def exon_matching(exon_tree, ref_exon,
         return None
     else: # ack! could not find evidence for this :<
         return None
+
+
+def merge_exon_lists(np.ndarray[DTYPE_t, ndim=1] l1,
+                     np.ndarray[DTYPE_t, ndim=1] l2,
+                     np.ndarray[DTYPE_t, ndim=1] exon_starts,
+                     np.ndarray[DTYPE_t, ndim=1] exon_ends,
+                     strand, merge5=True):
+    """
+    l1, l2 --- sorted arrays of exon indices used by two transcripts
+    exon_starts, exon_ends --- start and end of each exon, by exon index
+    strand --- '+' or '-'
+    merge5 --- if True, allow extra 5' exons as long as the rest is the same
+
+    Compare two transcripts, which are compatible if they only differ
+    by first/last exon ends, the same as compare_exon_matrix.
+
+    Return None if l1 and l2 are not compatible, otherwise return
+    l1 itself if l2 adds no exons to l1, or a new array of l1 followed
+    by exons that l2 extends beyond the 3' (+) or 5' (-) end of l1.
+    """
+    cdef Py_ssize_t n1 = l1.shape[0], n2 = l2.shape[0], i = 0, j = 0, k
+    cdef bint plus = strand == '+', minus = strand == '-'
+    cdef bint allow5 = merge5, swapped = False
+    cdef np.ndarray[DTYPE_t, ndim=1] a = l1, b = l2
+
+    if n1 == 0 or n2 == 0:
+        return None
+    # let a be the one that has the earliest start
+    if b[0] < a[0]:
+        a, b, n1, n2, swapped = l2, l1, n2, n1, True
+
+    # does not intersect at all
+    if a[n1-1] < b[0]:
+        return None
+
+    # not ok if this is at the 3' end and does not share the last exon;
+    # if 5' end, ok to miss exons as long as rest agrees
+    for i in range(n1):
+        if a[i] == b[0]:
+            break
+        elif i > 0 and (minus or (plus and not allow5)) and \
+                exon_ends[a[i-1]] != exon_starts[a[i]]:
+            return None
+
+    for j in range(i, min(n1, n2+i)):
+        if a[j] != b[j-i]:
+            return None
+
+    # a and b agree up to j, j-i
+    if j == n1-1: # check that the remaining of b are adjacent
+        if j-i == n2-1:
+            return l1
+        for k in range(j-i+1, n2):
+            if (plus or (minus and not allow5)) and \
+                    exon_ends[b[k-1]] != exon_starts[b[k]]:
+                return None
+        # extra exons of l1 itself are never added to l1
+        return l1 if swapped else np.concatenate((l1, l2[j-i+1:]))
+    elif j-i == n2-1:
+        for k in range(j+1, n1):
+            if (plus or (minus and not allow5)) and \
+                    exon_ends[a[k-1]] != exon_starts[a[k]]:
+                return None
+        return l1
+
+    raise Exception("Should not happen")
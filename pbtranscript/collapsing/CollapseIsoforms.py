@@ -16,9 +16,16 @@ Note that Branch input GMAP SAM file must be sorted by
     (2) reference coordinates.
 
 Note that Branch does not merge fuzzy junctions
+
+Branch splits the sorted SAM records into shards at reference and locus
+boundaries, collapses shards in a process pool when nproc > 1, and
+writes results of shards in genome order, so that outputs are identical
+no matter how many processes are used.
 """
 import logging
 import os.path as op
+from collections import deque
+from multiprocessing import Pool
 
 from pbtranscript.Utils import ln, realpath
 from pbtranscript.io import iter_gmap_sam, ContigSetReaderWrapper, \
@@ -36,6 +43,42 @@ __author__ = 'etseng@pacificbiosciences.com'
 
 log = logging.getLogger(__name__)
 
+# A shard ends at the first locus boundary after this many SAM records,
+# or at the end of a reference.
+SHARD_NUM_RECORDS = 2000
+
+
+class _RecordCollector(object):
+    """
+    Writer passed to collapse_sam_records in worker processes, which
+    collects (writer name, record) so that records can be written by
+    the real writer in the main process.
+    """
+    def __init__(self, name, records):
+        self.name = name
+        self.records = records
+
+    def writeRecord(self, record):
+        """Collect a record."""
+        self.records.append((self.name, record))
+
+
+def _collapse_shard(shard, kwargs):
+    """
+    Collapse each group of overlapping SAM records in shard, a list of
+    (cuff_index, records), return [(writer name, record)] in the order
+    records were written, where writer name is 'good', 'bad' or 'group'.
+    kwargs --- other arguments of collapse_sam_records
+    """
+    out = []
+    for cuff_index, records in shard:
+        collapse_sam_records(records=records, cuff_index=cuff_index,
+                             good_gff_writer=_RecordCollector('good', out),
+                             bad_gff_writer=_RecordCollector('bad', out),
+                             group_writer=_RecordCollector('group', out),
+                             **kwargs)
+    return out
+
 
 class Branch(object):
     """
@@ -47,7 +90,8 @@ class Branch(object):
 
     Parameters:
       isoform_filename -- hq_isoforms.fasta|fastq|contigset
-      sam_filename -- a SORTED GMAP SAM file mapping isoforms to references
+      sam_filename -- a SORTED GMAP SAM file mapping isoforms to references,
+                      or a sorted BAM file converted by gmap_sam_to_bam
       cov_threshold -- only output if having > cov_threshold supportive GMAP alignments
       min_aln_coverage -- ignore records if alignment coverage < min_aln_coverage
       min_aln_identity -- ignore records if alignment identity < min_aln_identity
@@ -73,43 +117,92 @@ class Branch(object):
         self.min_aln_coverage = min_aln_coverage
         self.min_aln_identity = min_aln_identity
 
+    def iter_shards(self, ignored_ids_writer, shard_num_records=SHARD_NUM_RECORDS):
+        """
+        Group SAM records based on where they mapped to and strands, and
+        yield shards, each of which is a list of (cuff_index, records),
+        where records is a list of overlapping SAM records of the same
+        strand. A shard never spans two references, and shards are
+        yielded in genome order.
+        """
+        cuff_index = 1
+        shard, shard_size, shard_ref = [], 0, None
+        for recs in iter_gmap_sam(sam_filename=self.sam_filename,
+                                  query_len_dict=self.isoform_len_dict,
+                                  min_aln_coverage=self.min_aln_coverage,
+                                  min_aln_identity=self.min_aln_identity,
+                                  ignored_ids_writer=ignored_ids_writer):
+            # Iterate over groups of overlapping SAM records
+            groups = [records for records in recs.itervalues() if len(records) > 0]
+            if len(groups) == 0:
+                continue
+            # end the shard at this locus if reference changes or shard is full
+            if len(shard) > 0 and (groups[0][0].sID != shard_ref or
+                                   shard_size >= shard_num_records):
+                yield shard
+                shard, shard_size = [], 0
+            shard_ref = groups[0][0].sID
+            for records in groups:
+                # records: a list of overlapping SAM records, same strands
+                shard.append((cuff_index, records))
+                shard_size += len(records)
+                cuff_index += 1
+        if len(shard) > 0:
+            yield shard
+
     def run(self, allow_extra_5exon, skip_5_exon_alt,
             ignored_ids_fn, good_gff_fn, bad_gff_fn, group_fn,
-            tolerate_end=100):
+            tolerate_end=100, nproc=1):
         """
         Process the whole SAM file:
           (1) Group SAM records based on where they mapped to and strands
           (2) Collapse records, write collapsed isoforms to *_gff_writer,
               write supportive records associated with each collapsed isoforms
               to group_writer.
+        Shards of SAM records are collapsed by nproc processes, and
+        results are written in genome order.
         """
         ignored_ids_writer = open(ignored_ids_fn, 'w') if ignored_ids_fn else None
         good_gff_writer = CollapseGffWriter(good_gff_fn) if good_gff_fn else None
         bad_gff_writer = CollapseGffWriter(bad_gff_fn) if bad_gff_fn else None
         group_writer = GroupWriter(group_fn) if group_fn else None
-
-        cuff_index = 1
-        for recs in iter_gmap_sam(sam_filename=self.sam_filename,
-                                  query_len_dict=self.isoform_len_dict,
-                                  min_aln_coverage=self.min_aln_coverage,
-                                  min_aln_identity=self.min_aln_identity,
-                                  ignored_ids_writer=ignored_ids_writer):
-            # Iterate over groups of overlapping SAM records
-            for records in recs.itervalues():
-                if len(records) > 0:
-                    # records: a list of overlapping SAM records, same strands
-                    collapse_sam_records(records=records, cuff_index=cuff_index,
-                                         cov_threshold=self.cov_threshold,
-                                         allow_extra_5exon=allow_extra_5exon,
-                                         skip_5_exon_alt=skip_5_exon_alt,
-                                         good_gff_writer=good_gff_writer,
-                                         bad_gff_writer=bad_gff_writer,
-                                         group_writer=group_writer,
-                                         tolerate_end=tolerate_end)
-                    cuff_index += 1
+        writers = {'good': good_gff_writer, 'bad': bad_gff_writer,
+                   'group': group_writer}
+
+        def write_shard(out):
+            """Write records collapsed from a shard."""
+            for name, record in out:
+                if writers[name] is not None:
+                    writers[name].writeRecord(record)
+
+        kwargs = dict(cov_threshold=self.cov_threshold,
+                      allow_extra_5exon=allow_extra_5exon,
+                      skip_5_exon_alt=skip_5_exon_alt,
+                      tolerate_end=tolerate_end)
+        shards = self.iter_shards(ignored_ids_writer=ignored_ids_writer)
+        if nproc <= 1:
+            for shard in shards:
+                write_shard(_collapse_shard(shard, kwargs))
+        else:
+            log.info("Collapsing isoforms using %d processes.", nproc)
+            pool = Pool(processes=nproc)
+            pending = deque()
+            try:
+                for shard in shards:
+                    pending.append(pool.apply_async(_collapse_shard, (shard, kwargs)))
+                    if len(pending) >= 2 * nproc:
+                        write_shard(pending.popleft().get())
+                while len(pending) > 0:
+                    write_shard(pending.popleft().get())
+                pool.close()
+            except Exception:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
 
         # close writers.
-        for writer in (ignored_ids_writer, good_gff_writer, bad_gff_writer, bad_gff_writer):
+        for writer in (ignored_ids_writer, good_gff_writer, bad_gff_writer, group_writer):
             if writer:
                 writer.close()
 
@@ -130,7 +223,8 @@ class CollapseIsoformsRunner(CollapsedFiles):
     """
     def __init__(self, isoform_filename, sam_filename, output_prefix,
                  min_aln_coverage, min_aln_identity, min_flnc_coverage,
-                 max_fuzzy_junction, allow_extra_5exon, skip_5_exon_alt):
+                 max_fuzzy_junction, allow_extra_5exon, skip_5_exon_alt,
+                 nproc=1):
         """
         Parameters:
           isoform_filename -- input file containing isoforms, as fastq|fasta|contigset
@@ -144,6 +238,7 @@ class CollapseIsoformsRunner(CollapsedFiles):
           max_fuzzy_junction -- max edit distance between fuzzy-matching exons
           allow_extra_5exon -- whether or not to allow shorter 5' exons
           skip_5_exon_alt -- whether or not to skip alternative 5' exons
+          nproc -- number of processes to collapse isoforms
         """
         self.suffix = parse_ds_filename(isoform_filename)[1]
         super(CollapseIsoformsRunner, self).__init__(prefix=output_prefix,
@@ -159,6 +254,7 @@ class CollapseIsoformsRunner(CollapsedFiles):
         self.max_fuzzy_junction = int(max_fuzzy_junction)
         self.allow_extra_5exon = bool(allow_extra_5exon)
         self.skip_5_exon_alt = bool(skip_5_exon_alt)
+        self.nproc = int(nproc)
 
     @property
     def shall_collapse_fuzzy_junctions(self):
@@ -210,7 +306,8 @@ class CollapseIsoformsRunner(CollapsedFiles):
               ignored_ids_fn=self.ignored_ids_txt_fn,
               good_gff_fn=self.good_unfuzzy_gff_fn,
               bad_gff_fn=self.bad_unfuzzy_gff_fn,
-              group_fn=self.unfuzzy_group_fn)
+              group_fn=self.unfuzzy_group_fn,
+              nproc=self.nproc)
 
         logging.info("Good unfuzzy isoforms written to: %s", realpath(self.good_unfuzzy_gff_fn))
         logging.info("Bad unfuzzy isoforms written to: %s", realpath(self.bad_unfuzzy_gff_fn))
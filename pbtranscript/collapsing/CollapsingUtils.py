@@ -13,22 +13,32 @@ import os.path as op
 import logging
 import random
 import string
+from bisect import bisect_right
+from multiprocessing import Pool
 from collections import defaultdict
 import numpy as np
 from pbcore.io import FastaWriter, FastqWriter, ContigSet
-from pbtranscript.Utils import execute, rmpath, as_contigset, realpath, real_upath
-from pbtranscript.io import ContigSetReaderWrapper, FastaRandomReader, FastqRandomReader, \
+from pbtranscript.Utils import execute, rmpath, mkdir, as_contigset, realpath, real_upath
+from pbtranscript.io import ContigSetReaderWrapper, \
     CollapseGffRecord, CollapseGffReader, CollapseGffWriter, \
     GroupRecord, GroupReader, GroupWriter, parse_ds_filename
 from pbtranscript.collapsing import c_branch, IntervalTree
+from pbtranscript.collapsing.SamSorter import sort_sam_file, merge_sorted_sam_files, \
+    SORT_MAX_MEMORY_DEFAULT
 
 __all__ = ["ContiVec",
            "copy_sam_header",
+           "GMAP_MAX_RETRIES",
+           "gmap_cmd",
+           "split_isoforms",
            "map_isoforms_and_sort",
            "sort_sam",
+           "merge_sam_headers",
            "concatenate_sam",
+           "merge_sorted_sam",
            "transfrag_to_contig",
            "exons_match_sam_record",
+           "exon_bounds",
            "compare_exon_matrix",
            "iterative_merge_transcripts",
            "get_fl_from_id",
@@ -36,10 +46,14 @@ __all__ = ["ContiVec",
            "collapse_sam_records",
            "compare_fuzzy_junctions",
            "collapse_fuzzy_junctions",
+           "expected_errors",
            "pick_rep"]
 
 logger = logging.getLogger(op.basename(__file__))
 
+# Number of times to retry failed gmap jobs.
+GMAP_MAX_RETRIES = 1
+
 
 def copy_sam_header(in_sam, out_sam):
     """Copy headers of input sam to output sam."""
@@ -52,18 +66,124 @@ def copy_sam_header(in_sam, out_sam):
                 break
 
 
+def gmap_cmd(gmap_input_filename, out_sam_filename, log_filename,
+             gmap_db_dir, gmap_db_name, gmap_nproc):
+    """Return a gmap command mapping isoforms to references in SAM format."""
+    cmd_args = ['gmap', '-D {d}'.format(d=real_upath(gmap_db_dir)),
+                '-d {name}'.format(name=gmap_db_name),
+                '-t {nproc}'.format(nproc=gmap_nproc),
+                '-n 0',
+                '-z sense_force',
+                '--cross-species',
+                '-f samse',
+                '--max-intronlength-ends 200000', # for long genes
+                real_upath(gmap_input_filename),
+                '>', real_upath(out_sam_filename),
+                '2>{log}'.format(log=real_upath(log_filename))]
+    return ' '.join(cmd_args)
+
+
+def split_isoforms(input_filename, out_prefix, num_shards):
+    """
+    Split isoforms in FASTA/FASTQ input_filename round robin into at most
+    num_shards FASTA/FASTQ files, out_prefix.<i>.fasta|fastq, so that shards
+    take about the same time to map. Return names of non-empty shards.
+    """
+    is_fq = ContigSetReaderWrapper.get_file_type(input_filename) == "FASTQ"
+    suffix = "fastq" if is_fq else "fasta"
+    out_fns = ["%s.%d.%s" % (out_prefix, i, suffix) for i in range(num_shards)]
+    writers = [FastqWriter(fn) if is_fq else FastaWriter(fn) for fn in out_fns]
+    n = 0
+    try:
+        for n, r in enumerate(ContigSetReaderWrapper(input_filename), start=1):
+            if is_fq:
+                writers[(n-1) % num_shards].writeRecord(r.name, r.sequence, r.quality)
+            else:
+                writers[(n-1) % num_shards].writeRecord(r.name, r.sequence)
+    finally:
+        for writer in writers:
+            writer.close()
+    for fn in out_fns[n:]:
+        rmpath(fn)
+    return out_fns[:n]
+
+
+def _map_shard(args):
+    """
+    Map a shard of isoforms by gmap, and sort its output, in a worker process.
+    args = (gmap command, unsorted sam, sorted sam, max memory, nproc,
+            by_reference_order), see sort_sam.
+    """
+    cmd, unsorted_sam, sorted_sam, max_memory, nproc, by_reference_order = args
+    execute(cmd)
+    sort_sam(in_sam=unsorted_sam, out_sam=sorted_sam, max_memory=max_memory,
+             nproc=nproc, by_reference_order=by_reference_order)
+    rmpath(unsorted_sam)
+    return sorted_sam
+
+
+def _map_shards(shard_args, num_workers, max_retries):
+    """
+    Run _map_shard of shard_args by num_workers processes, and retry
+    failed shards, only, up to max_retries times.
+    Raise RuntimeError if any shard still fails.
+    """
+    todo, errors = list(shard_args), []
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            logger.debug("gmap failed on %d shards, try again.", len(todo))
+            execute('sleep 3')
+        errors = []
+        if num_workers > 1 and len(todo) > 1:
+            pool = Pool(processes=min(num_workers, len(todo)))
+            try:
+                results = [(args, pool.apply_async(_map_shard, (args,))) for args in todo]
+                pool.close()
+                for args, result in results:
+                    try:
+                        result.get()
+                    except Exception as e:
+                        errors.append((args, e))
+            except (Exception, KeyboardInterrupt):
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            for args in todo:
+                try:
+                    _map_shard(args)
+                except Exception as e:
+                    errors.append((args, e))
+        if len(errors) == 0:
+            return
+        todo = [args for args, dummy_e in errors]
+    raise RuntimeError("gmap failed on %d shards after %d retries: %s" %
+                       (len(errors), max_retries, str(errors[0][1])))
+
+
 def map_isoforms_and_sort(input_filename, sam_filename,
-                          gmap_db_dir, gmap_db_name, gmap_nproc):
+                          gmap_db_dir, gmap_db_name, gmap_nproc,
+                          sort_max_memory=SORT_MAX_MEMORY_DEFAULT,
+                          gmap_shards=1, max_retries=GMAP_MAX_RETRIES):
     """
     Map isoforms to references by gmap, generate a sam output and sort sam.
     Parameters:
         input_filename -- input isoforms. e.g., hq_isoforms.fasta|fastq|xml
-        sam_filename -- output sam file, produced by gmap and sorted.
+        sam_filename -- output sam file, produced by gmap and sorted,
+                        or an indexed bam file if it ends with .bam,
+                        in which case ValueError is raised if there
+                        is no isoform
         gmap_db_dir -- gmap database directory
         gmap_db_name -- gmap database name
-        gmap_nproc -- gmap nproc
+        gmap_nproc -- gmap nproc, also used to sort sam
+        sort_max_memory -- memory budget of sorting sam in bytes
+        gmap_shards -- split isoforms into this many shards, which are
+                       mapped and sorted by at most gmap_nproc gmap
+                       processes, sharing gmap_nproc threads, and
+                       k-way merged into sam_filename
+        max_retries -- retry failed shards up to max_retries times
     """
-    unsorted_sam_filename = sam_filename + ".tmp"
     log_filename = sam_filename + ".log"
 
     gmap_input_filename = input_filename
@@ -80,54 +200,72 @@ def map_isoforms_and_sort(input_filename, sam_filename,
                 'ls *.iit *meta', 'sleep 3', 'cd %s' % real_upath(cwd)]
     execute(' && '.join(cmd_args))
 
-    cmd_args = ['gmap', '-D {d}'.format(d=real_upath(gmap_db_dir)),
-                '-d {name}'.format(name=gmap_db_name),
-                '-t {nproc}'.format(nproc=gmap_nproc),
-                '-n 0',
-                '-z sense_force',
-                '--cross-species',
-                '-f samse',
-                '--max-intronlength-ends 200000', # for long genes
-                real_upath(gmap_input_filename),
-                '>', real_upath(unsorted_sam_filename),
-                '2>{log}'.format(log=real_upath(log_filename))]
-    # Call gmap to map isoforms to reference and output sam.
-    try:
-        execute(' '.join(cmd_args))
-    except Exception:
-        logging.debug("gmap failed, try again.")
-        execute('sleep 3')
-        execute(' '.join(cmd_args))
-
-    # sort sam file
-    sort_sam(in_sam=unsorted_sam_filename, out_sam=sam_filename)
-
-    # remove intermediate unsorted sam file.
-    rmpath(unsorted_sam_filename)
-
-
-def sort_sam(in_sam, out_sam):
+    if gmap_shards <= 1:
+        # Call gmap to map isoforms to reference and output sam, then sort sam.
+        unsorted_sam_filename = sam_filename + ".tmp"
+        _map_shards([(gmap_cmd(gmap_input_filename, unsorted_sam_filename, log_filename,
+                               gmap_db_dir, gmap_db_name, gmap_nproc),
+                      unsorted_sam_filename, sam_filename, sort_max_memory, gmap_nproc, None)],
+                    num_workers=1, max_retries=max_retries)
+        return
+
+    shard_dir = sam_filename + ".shards"
+    mkdir(shard_dir)
+    shard_fns = split_isoforms(gmap_input_filename, op.join(shard_dir, "input"), gmap_shards)
+    if len(shard_fns) == 0: # touch output if there is no isoform
+        rmpath(shard_dir)
+        _touch_empty_sam(sam_filename)
+        return
+    num_workers = max(1, min(len(shard_fns), gmap_nproc))
+    threads = max(1, gmap_nproc // num_workers)
+    # sort shards as sam, by reference order if the merged output is bam
+    shard_args = [(gmap_cmd(fn, fn + ".sam", fn + ".log", gmap_db_dir, gmap_db_name, threads),
+                   fn + ".sam", fn + ".sorted.sam", sort_max_memory // num_workers, 1,
+                   sam_filename.endswith('.bam'))
+                  for fn in shard_fns]
+    logger.info("Mapping %d shards of %s by %d gmap processes of %d threads.",
+                len(shard_fns), gmap_input_filename, num_workers, threads)
+    _map_shards(shard_args, num_workers=num_workers, max_retries=max_retries)
+
+    with open(log_filename, 'w') as writer:
+        for fn in shard_fns:
+            with open(fn + ".log", 'r') as reader:
+                writer.write(reader.read())
+    merge_sorted_sam([fn + ".sorted.sam" for fn in shard_fns], sam_filename)
+    rmpath(shard_dir)
+
+
+def _touch_empty_sam(out_sam):
     """
-    Sort input sam file and write to output sam file.
+    Touch out_sam as the output of no alignments. Raise ValueError if
+    out_sam is a BAM file, which can neither be empty nor be read by
+    pysam without reference sequences in header.
     """
-    # Copy SAM headers
-    copy_sam_header(in_sam=in_sam, out_sam=out_sam)
-
-    # Call sort to sort gmap output sam file
-    cmd_args = ['sort', '-k 3,3', '-k 4,4n', real_upath(in_sam),
-                '| grep -v \'^@\' ', ' >> ', real_upath(out_sam)]
+    if out_sam.endswith('.bam'):
+        raise ValueError("Can not write BAM file %s without any alignments, " % out_sam +
+                         "use a SAM output file instead.")
+    open(out_sam, 'w').close()
 
-    if os.stat(in_sam).st_size == 0: # overwrite cmds if file is empty
-        cmd_args = ['touch', out_sam]
 
-    execute(' '.join(cmd_args))
+def sort_sam(in_sam, out_sam, max_memory=SORT_MAX_MEMORY_DEFAULT, nproc=1, tmp_dir=None,
+             by_reference_order=None):
+    """
+    Sort input sam file and write to output sam file, or to an indexed
+    bam file if out_sam ends with .bam, by an in-process external merge
+    sort using about max_memory bytes and nproc processes.
+    If by_reference_order, sort sam by reference order in header, as bam.
+    If in_sam is empty, touch out_sam, or raise ValueError if it is bam.
+    """
+    if os.stat(in_sam).st_size == 0: # touch output if file is empty
+        _touch_empty_sam(out_sam)
+        return
+    sort_sam_file(in_sam=in_sam, out_filename=out_sam, max_memory=max_memory,
+                  nproc=nproc, tmp_dir=tmp_dir, by_reference_order=by_reference_order)
 
 
-def concatenate_sam(in_sam_files, sam_out):
-    """Concatenate input sam files to sam_out."""
-    if sam_out in in_sam_files:
-        raise IOError("Can not overwrite input sam file %s as output file." % sam_out)
-
+def merge_sam_headers(in_sam_files):
+    """Return merged header lines of input sam files, of which
+    conflicting @PG IDs are made unique."""
     def _get_pgid(r):
         """return pbid from a PG header '@PG\tID:xxx\t...'"""
         assert r.startswith('@PG')
@@ -145,7 +283,6 @@ def concatenate_sam(in_sam_files, sam_out):
         ret.insert(1, "ID:%s_%s" % (pgid, suffix))
         return '\t'.join(ret)
 
-    # First save sam headers in c_header
     c_header = []
     has_hd = False
     pg_ids = set()
@@ -168,6 +305,16 @@ def concatenate_sam(in_sam_files, sam_out):
                             c_header.append(r)
                 else:
                     break
+    return c_header
+
+
+def concatenate_sam(in_sam_files, sam_out):
+    """Concatenate input sam files to sam_out."""
+    if sam_out in in_sam_files:
+        raise IOError("Can not overwrite input sam file %s as output file." % sam_out)
+
+    # First save sam headers in c_header
+    c_header = merge_sam_headers(in_sam_files)
 
     # Start to write
     with open(sam_out, 'w') as writer:
@@ -180,6 +327,19 @@ def concatenate_sam(in_sam_files, sam_out):
                         writer.write("%s\n" % r)
 
 
+def merge_sorted_sam(in_sam_files, out_filename):
+    """
+    k-way merge sorted input sam files, such as outputs of map_isoforms_and_sort,
+    to out_filename, which is either a sorted sam file, or an indexed bam file
+    if it ends with .bam, in which case input sam files must be sorted by
+    reference order (see sort_sam). Raise ValueError if any input is not sorted.
+    """
+    if out_filename in in_sam_files:
+        raise IOError("Can not overwrite input sam file %s as output file." % out_filename)
+    header = ["%s\n" % r for r in merge_sam_headers(in_sam_files)]
+    merge_sorted_sam_files(in_sams=in_sam_files, header=header, out_filename=out_filename)
+
+
 INTINF = 999999
 
 def transfrag_to_contig(gmap_sam_records, skip_5_exon_alt=True):
@@ -274,6 +434,20 @@ def exons_match_sam_record(record, exons,
     return result
 
 
+def exon_bounds(node_d):
+    """
+    node_d --- exon index --> exon node, with exon indices 0, 1, ..., n-1
+    Return (exon_starts, exon_ends), arrays of start and end of exons
+    by exon index, which are used by c_branch.merge_exon_lists.
+    """
+    n = max(node_d) + 1 if len(node_d) > 0 else 0
+    exon_starts = np.zeros(n, dtype=np.int)
+    exon_ends = np.zeros(n, dtype=np.int)
+    for index, node in node_d.iteritems():
+        exon_starts[index], exon_ends[index] = node.start, node.end
+    return exon_starts, exon_ends
+
+
 def compare_exon_matrix(m1, m2, node_d, strand, merge5=True):
     """
     m1, m2 are 1-d array where m1[0, i] is 1 if it uses the i-th exon, otherwise 0
@@ -287,91 +461,76 @@ def compare_exon_matrix(m1, m2, node_d, strand, merge5=True):
     an example of exon matrix m = np.asarray([ [1, 0, 1, 1, 1, 1, 0] ]) indicates
     that m contains exons of indices (0, 2, 3, 4, 5), mssing exons of indices(1, 6)
 
+    This is a dense wrapper of c_branch.merge_exon_lists, which compares
+    sorted exon index arrays, as used by iterative_merge_transcripts.
+
     return {True|False}, {merged array|None}
     """
-    l1 = m1.nonzero()[1]
-    l2 = m2.nonzero()[1]
-
-    # let l1 be the one that has the earliest start
-    if l2[0] < l1[0]:
-        l1, l2 = l2, l1
-
-    # does not intersect at all
-    if l1[-1] < l2[0]:
+    exon_starts, exon_ends = exon_bounds(node_d)
+    l1 = m1.nonzero()[1].astype(np.int)
+    merged = c_branch.merge_exon_lists(l1, m2.nonzero()[1].astype(np.int),
+                                       exon_starts, exon_ends, strand, merge5)
+    if merged is None:
         return False, None
-
-    n1 = len(l1)
-    n2 = len(l2)
-
-    # not ok if this is at the 3' end and does not share the last exon;
-    # if 5' end, ok to miss exons as long as rest agrees
-    i, j = None, None
-    for i in xrange(n1):
-        if l1[i] == l2[0]:
-            break
-        elif i > 0 and (strand == '-' and node_d[l1[i-1]].end != node_d[l1[i]].start):
-            return False, None # 3' end disagree
-        elif i > 0 and (strand == '+' and not merge5 and node_d[l1[i-1]].end != node_d[l1[i]].start):
-            # 5' end disagree, in other words m1 has an extra 5' exon that
-            # m2 does not have and merge5 is no allowed
-            return False, None
-    # at this point: l1[i] == l2[0]
-    assert i is not None
-
-    for j in xrange(i, min(n1, n2+i)):
-        # matching l1[j] with l2[j-i]
-        if l1[j] != l2[j-i]: # they must not match
-            return False, None
-    assert j is not None
-
-    # pre: l1 and l2 agree up to j, j-i
-    if j == n1-1: # check that the remaining of l2 are adjacent
-        if j-i == n2-1:
-            return True, m1
-        for k in xrange(j-i+1, n2):
-            # case 1: this is the 3' end, check that there are no additional 3' exons
-            if strand == '+' and node_d[l2[k-1]].end != node_d[l2[k]].start:
-                return False, None
-            # case 2: this is the 5' end, check that there are no additional 5' exons unless allowed
-            if strand == '-' and not merge5 and node_d[l2[k-1]].end != node_d[l2[k]].start:
-                return False, None
-        m1[0, l2[j-i+1]:] = m1[0, l2[j-i+1]:] + m2[0, l2[j-i+1]:]
-        return True, m1
-    elif j-i == n2-1:
-        for k in xrange(j+1, n1):
-            # case 1, but for m1
-            if strand == '+' and node_d[l1[k-1]].end != node_d[l1[k]].start:
-                return False, None
-            # case 2, but for m1
-            if strand == '-' and not merge5 and node_d[l1[k-1]].end != node_d[l1[k]].start:
-                return False, None
-        return True, m1
-
-    raise Exception("Should not happen")
+    m1[0, merged] = 1
+    return True, m1
 
 
 def iterative_merge_transcripts(result_list, node_d, merge5=True):
     """
-    result_list --- list of (qID, strand, binary exon sparse matrix)
+    result_list --- list of (qID, strand, sorted array of exon indices)
+
+    In the order of strand and first exon, greedily merge each transcript
+    with all later transcripts which are compatible with it, as defined by
+    c_branch.merge_exon_lists. Merged transcripts are removed from result_list.
+
+    A later transcript can merge only if its first exon is an exon of the
+    current transcript, so transcripts are bucketed by (strand, first exon),
+    and only buckets of exons of the current transcript are compared.
+    Since comparing depends only on exons of the two transcripts, a
+    transcript with the same exons as one already compared gets the same
+    result, until the current transcript gains new exons, which makes
+    high-depth loci of identical transcripts linear instead of quadratic.
     """
+    exon_starts, exon_ends = exon_bounds(node_d)
     # sort by strand then starting position
-    result_list.sort(key=lambda x: (x[1], x[2].nonzero()[1][0]))
-    i = 0
-    while i < len(result_list) - 1:
-        j = i + 1
-        while j < len(result_list):
-            id1, strand1, m1 = result_list[i]
-            id2, strand2, m2 = result_list[j]
-            if (strand1 != strand2) or (m1.nonzero()[1][-1] < m2.nonzero()[1][0]):
-                break
-            else:
-                flag, m3 = compare_exon_matrix(m1, m2, node_d, strand1, merge5)
-                if flag:
-                    result_list[i] = (id1+','+id2, strand1, m3)
-                    result_list.pop(j)
-                else:
-                    j += 1
-        i += 1
+    result_list.sort(key=lambda x: (x[1], x[2][0]))
+    exons = [tuple(l) for dummy_id, dummy_strand, l in result_list]
+    merged = [False] * len(result_list)
+    buckets = defaultdict(list) # (strand, first exon) --> ascending positions
+    for pos, (dummy_id, strand, dummy_l) in enumerate(result_list):
+        buckets[(strand, exons[pos][0])].append(pos)
+
+    for i in xrange(len(result_list)):
+        if merged[i]:
+            continue
+        id1, strand1, l1 = result_list[i]
+        sig1 = exons[i]
+        failed, absorbed = set(), set() # exons of compared transcripts
+        k = 0
+        # exons are only appended to l1 by merging, never inserted
+        while k < len(sig1):
+            bucket = buckets[(strand1, sig1[k])]
+            for idx in xrange(bisect_right(bucket, i), len(bucket)):
+                j = bucket[idx]
+                if merged[j] or exons[j] in failed:
+                    continue
+                id2, dummy_strand, l2 = result_list[j]
+                if exons[j] not in absorbed:
+                    l3 = c_branch.merge_exon_lists(l1, l2, exon_starts, exon_ends,
+                                                   strand1, merge5)
+                    if l3 is None:
+                        failed.add(exons[j])
+                        continue
+                    if l3 is not l1:
+                        l1, sig1, failed, absorbed = l3, tuple(l3), set(), set()
+                    else: # l1 is unchanged
+                        absorbed.add(exons[j])
+                id1 = id1 + ',' + id2
+                merged[j] = True
+            k += 1
+        result_list[i] = (id1, strand1, l1)
+    result_list[:] = [r for r, is_merged in zip(result_list, merged) if not is_merged]
 
 
 class ContiVec(object):
@@ -417,7 +576,7 @@ def collapse_sam_records(records, cuff_index, cov_threshold,
     Write supportive records of collapsed isoforms to group_writer.
 
     Returns result and merged_result, where
-    result: [ (r.qID, r.strand, nparray representing r) for r in records]
+    result: [ (r.qID, r.strand, sorted array of exon indices of r) for r in records]
     result_merge: merged result
     """
     contiVec, offset, chrom, strand = transfrag_to_contig(gmap_sam_records=records,
@@ -427,14 +586,11 @@ def collapse_sam_records(records, cuff_index, cov_threshold,
     p = []
     exons.traverse(p.append)
     node_d = dict((x.interval.value, x) for x in p)
-    mat_size = max(x.interval.value for x in p) + 1
     result = []
     for r in records:
         matched_exons = exons_match_sam_record(record=r, exons=exons, tolerate_end=tolerate_end)
-        m = np.zeros((1, mat_size), dtype=np.int)
-        for _exon in matched_exons:
-            m[0, _exon.value] = 1
-        result.append((r.qID, r.flag.strand, m))
+        l = np.unique(np.asarray([_exon.value for _exon in matched_exons], dtype=np.int))
+        result.append((r.qID, r.flag.strand, l))
 
     result_merged = list(result)
     iterative_merge_transcripts(result_merged, node_d, allow_extra_5exon)
@@ -446,14 +602,14 @@ def collapse_sam_records(records, cuff_index, cov_threshold,
     isoform_index = starting_isoform_index
     # make the exon value --> interval dictionary
 
-    for ids, _strand, m in result_merged:
+    for ids, _strand, l in result_merged:
         assert strand == _strand
         if ids.count(',')+1 < cov_threshold:
             f_out = bad_gff_writer
         else:
             f_out = good_gff_writer
         isoform_index += 1
-        segments = [node_d[x] for x in m.nonzero()[1]]
+        segments = [node_d[x] for x in l]
 
         gene_id = "{p}.{i}".format(p=gene_prefix, i=cuff_index)
         transcript_id = "{g}.{j}".format(g=gene_id, j=isoform_index)
@@ -693,6 +849,13 @@ def collapse_fuzzy_junctions(gff_filename, group_filename,
     return fuzzy_match
 
 
+def expected_errors(quality):
+    """Return expected number of base errors of an array of QVs,
+    as used to pick representative reads."""
+    qv = np.asarray(quality, dtype=np.float)
+    return float(np.power(qv, -qv / 10.).sum())
+
+
 def pick_rep(isoform_filename, gff_filename,
              group_filename, output_filename,
              pick_least_err_instead=False,
@@ -704,27 +867,23 @@ def pick_rep(isoform_filename, gff_filename,
     If is FASTQ file -- then
           If pick_least_err_instead is True, pick the one w/ least number of expected base errors
           Else, pick the longest one
+
+    Reads of isoform_filename are streamed once in file order, keeping only
+    the best read of each group so far, instead of randomly accessing every
+    member of every group. Ties are broken as if members were visited in
+    group order: the last longest read or the first least-error read wins.
     """
-    fd = None
     is_fq = False
+    reader_fn = isoform_filename
     dummy_prefix, _suffix = parse_ds_filename(isoform_filename)
-    if _suffix == "fasta":
-        fd = FastaRandomReader(isoform_filename)
-    elif _suffix == "fastq":
-        fd = FastqRandomReader(isoform_filename)
+    if _suffix == "fastq":
         is_fq = True
     elif _suffix == "contigset.xml":
-        fd = ContigSet(isoform_filename)
-        _fns = fd.toExternalFiles()
-        if len(_fns) == 1 and _fns[0].endswith(".fq") or _fns[0].endswith(".fastq"):
-            fd = FastqRandomReader(_fns[0])
+        _fns = ContigSet(isoform_filename).toExternalFiles()
+        if len(_fns) == 1 and (_fns[0].endswith(".fq") or _fns[0].endswith(".fastq")):
+            reader_fn = _fns[0]
             is_fq = True
-        else:
-            if not fd.isIndexed:
-                # Must be indexed FASTA, or exactly contains one FASTQ file
-                raise IOError("%s must contain either indexed FASTA files or " % isoform_filename +
-                              "contain exactly one FASTQ file!")
-    else:
+    elif _suffix != "fasta":
         raise IOError("Unable to recognize file type of %s." % isoform_filename)
 
     fa_out_fn, fq_out_fn, ds_out_fn = None, None, None
@@ -748,47 +907,48 @@ def pick_rep(isoform_filename, gff_filename,
     fa_writer = FastaWriter(fa_out_fn) if fa_out_fn is not None else None
     fq_writer = FastqWriter(fq_out_fn) if fq_out_fn is not None else None
 
+    # transcript id --> 1-based coordinates on its chromosome
     coords = {}
     for r in CollapseGffReader(gff_filename):
         tid = r.transcript_id
-        coords[tid] = "{0}:{1}-{2}({3})".format(r.seqid, r.start, r.end, r.strand)
+        coords[tid] = "{0}:{1}-{2}({3})".format(r.chr, r.start + 1, r.end, r.strand)
 
     if bad_gff_filename is not None:
-        for r in CollapseGffReader(gff_filename):
+        for r in CollapseGffReader(bad_gff_filename):
             tid = r.transcript_id
-            coords[tid] = "{0}:{1}-{2}({3})".format(r.seqid, r.start, r.end, r.strand)
+            coords[tid] = "{0}:{1}-{2}({3})".format(r.chr, r.start + 1, r.end, r.strand)
 
-    for group in GroupReader(group_filename):
-        pb_id, members = group.name, group.members
-        if not pb_id in coords:
+    groups = [group for group in GroupReader(group_filename)]
+    member_d = {} # member id --> (group index, index of member in group)
+    for gi, group in enumerate(groups):
+        if not group.name in coords:
             raise ValueError("Could not find %s in %s and %s" %
-                             (pb_id, gff_filename, bad_gff_filename))
-        #logging.info("Picking representative sequence for %s", pb_id)
-        best_id = None
-        best_seq = None
-        best_qual = None
-        best_err = 9999999
-        err = 9999999
-        max_len = 0
-
-        for x in members:
-            if is_fq and pick_least_err_instead:
-                err = sum(i**-(i/10.) for i in fd[x].quality)
-            if (is_fq and pick_least_err_instead and err < best_err) or \
-               ((not is_fq or not pick_least_err_instead) and len(fd[x].sequence) >= max_len):
-                best_id = x
-                best_seq = fd[x].sequence
-                if is_fq:
-                    best_qual = fd[x].quality
-                    best_err = err
-                max_len = len(fd[x].sequence)
-
-        _id_ = "{0}|{1}|{2}".format(pb_id, coords[pb_id], best_id)
-        _seq_ = best_seq
+                             (group.name, gff_filename, bad_gff_filename))
+        for mi, x in enumerate(group.members):
+            member_d[x] = (gi, mi)
+
+    # group index --> (score, best record so far), higher score wins
+    use_err = is_fq and pick_least_err_instead
+    best = [None] * len(groups)
+    for r in ContigSetReaderWrapper(reader_fn):
+        rid = r.name.split()[0]
+        if rid not in member_d:
+            continue
+        gi, mi = member_d.pop(rid)
+        score = (-expected_errors(r.quality), -mi) if use_err else (len(r.sequence), mi)
+        if best[gi] is None or score > best[gi][0]:
+            best[gi] = (score, r)
+
+    if len(member_d) > 0:
+        raise ValueError("Could not find %s in %s" %
+                         (", ".join(sorted(member_d.keys())[:5]), isoform_filename))
+
+    for group, (dummy_score, r) in zip(groups, best):
+        _id_ = "{0}|{1}|{2}".format(group.name, coords[group.name], r.name.split()[0])
         if fq_writer is not None:
-            fq_writer.writeRecord(_id_, _seq_, best_qual)
+            fq_writer.writeRecord(_id_, r.sequence, r.quality)
         if fa_writer is not None:
-            fa_writer.writeRecord(_id_, _seq_)
+            fa_writer.writeRecord(_id_, r.sequence)
 
     if fa_writer is not None:
         fa_writer.close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""
+External merge sort of GMAP SAM output, in process, so that sorting
+takes a bounded amount of memory and does not depend on the locale,
+temporary directory and buffer settings of the Unix sort command.
+
+(1) Alignments of the input SAM file are cut into byte ranges of about
+    max_memory / (nproc * SORT_MEMORY_FACTOR) bytes at line boundaries.
+(2) Each range is read, sorted and written to a run file, by nproc
+    processes in parallel.
+(3) Runs are k-way merged, at most MAX_MERGE_WIDTH at a time, into the
+    output, which is either
+      SAM --- sorted by reference name then position, the same order
+              as `LC_ALL=C sort -k 3,3 -k 4,4n`, or
+      BAM --- sorted by reference order in header then position, and
+              indexed as <output>.bai, which can be read by
+              iter_gmap_sam by region.
+
+merge_sorted_sam_files k-way merges SAM files which are already sorted,
+such as GMAP output of shards of isoforms, the same way as step (3).
+
+Example:
+    sort_sam_file("gmap.unsorted.sam", "gmap.sorted.bam",
+                  max_memory=1024**3, nproc=4)
+"""
+
+import os
+import os.path as op
+import heapq
+import shutil
+import logging
+import tempfile
+from multiprocessing import Pool
+
+from pbtranscript.io import gmap_sam_to_bam
+
+__all__ = ["SORT_MAX_MEMORY_DEFAULT", "sort_sam_file", "merge_sorted_sam_files"]
+
+log = logging.getLogger(__name__)
+
+# Default memory budget of sorting, in bytes.
+SORT_MAX_MEMORY_DEFAULT = 512 * 1024 * 1024
+
+# Sorting a run takes about this many times of its size in memory,
+# for line strings, split fields and sort keys.
+SORT_MEMORY_FACTOR = 4
+
+# Minimum size of a run in bytes.
+MIN_RUN_SIZE = 1024 * 1024
+
+# Maximum number of runs to merge at a time, bounded by open files.
+MAX_MERGE_WIDTH = 128
+
+
+def read_sam_header(in_sam):
+    """Return (header lines, offset of the first alignment) of a SAM file."""
+    header = []
+    with open(in_sam, 'r') as reader:
+        offset = 0
+        for line in iter(reader.readline, ''):
+            if not line.startswith('@'):
+                break
+            header.append(line)
+            offset += len(line)
+    return header, offset
+
+
+def reference_order(header):
+    """Return {reference name: index} of @SQ lines of a SAM header."""
+    refs = [f[3:] for line in header if line.startswith('@SQ')
+            for f in line.rstrip('\n').split('\t') if f.startswith('SN:')]
+    return dict((ref, i) for i, ref in enumerate(refs))
+
+
+def sam_key(line, ref_order=None):
+    """
+    Return sort key of a SAM alignment line, by reference name, or by
+    index of reference in ref_order if not None, then by position, and
+    lastly by the whole line, so that sorting is deterministic.
+    Unmapped alignments come first by name ('*'), or last by order.
+    """
+    fields = line.split('\t', 4)
+    ref = fields[2] if ref_order is None else ref_order.get(fields[2], len(ref_order))
+    return ref, int(fields[3]), line
+
+
+def split_ranges(in_sam, start, run_size):
+    """Return byte ranges [(start, end)] of in_sam from start,
+    of about run_size bytes each, ending at line boundaries."""
+    size = os.stat(in_sam).st_size
+    ranges = []
+    with open(in_sam, 'rb') as reader:
+        while start < size:
+            reader.seek(min(size, start + run_size))
+            reader.readline()
+            end = min(size, reader.tell())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _sort_run(args):
+    """Sort alignments within a byte range of in_sam and write them to run_fn."""
+    in_sam, start, end, run_fn, ref_order = args
+    with open(in_sam, 'rb') as reader:
+        reader.seek(start)
+        lines = reader.read(end - start).splitlines(True)
+    lines = [l if l.endswith('\n') else l + '\n' for l in lines
+             if len(l.strip()) > 0 and not l.startswith('@')]
+    lines.sort(key=lambda l: sam_key(l, ref_order))
+    with open(run_fn, 'wb') as writer:
+        writer.writelines(lines)
+    return run_fn
+
+
+def _iter_keyed(run_fn, ref_order):
+    """Yield sort keys of alignments in a sorted run or SAM file,
+    of which the last item is the line. Raise ValueError if not sorted."""
+    prev = None
+    with open(run_fn, 'rb') as reader:
+        for line in reader:
+            if line.startswith('@') or len(line.strip()) == 0:
+                continue
+            if not line.endswith('\n'):
+                line += '\n'
+            key = sam_key(line, ref_order)
+            if prev is not None and key < prev:
+                raise ValueError("SAM file %s is NOT sorted. ABORT!" % run_fn)
+            prev = key
+            yield key
+
+
+def merge_runs(run_fns, writer, ref_order=None):
+    """k-way merge sorted runs, and write lines to writer."""
+    for key in heapq.merge(*[_iter_keyed(fn, ref_order) for fn in run_fns]):
+        writer.write(key[-1])
+
+
+def _merge_to_output(runs, header, out_filename, ref_order, tmp_dir):
+    """
+    Merge sorted runs, MAX_MERGE_WIDTH at a time, into intermediate runs
+    in tmp_dir, until they can be merged into out_filename at once.
+    Write out_filename as SAM, or as indexed BAM if it ends with .bam.
+    """
+    level = 0
+    while len(runs) > MAX_MERGE_WIDTH:
+        merged_runs = []
+        for i in xrange(0, len(runs), MAX_MERGE_WIDTH):
+            merged_fn = op.join(tmp_dir, "merged.%d.%d" % (level, i))
+            with open(merged_fn, 'wb') as writer:
+                merge_runs(runs[i:i+MAX_MERGE_WIDTH], writer, ref_order)
+            for fn in runs[i:i+MAX_MERGE_WIDTH]:
+                if op.dirname(fn) == tmp_dir: # never remove inputs
+                    os.remove(fn)
+            merged_runs.append(merged_fn)
+        runs = merged_runs
+        level += 1
+
+    to_bam = out_filename.endswith('.bam')
+    out_sam = op.join(tmp_dir, "sorted.sam") if to_bam else out_filename
+    with open(out_sam, 'wb') as writer:
+        writer.writelines(header)
+        merge_runs(runs, writer, ref_order)
+    if to_bam:
+        gmap_sam_to_bam(out_sam, out_filename, is_sorted=True)
+
+
+def _make_tmp_dir(out_filename, tmp_dir):
+    """Make and return a temporary directory in tmp_dir, which defaults
+    to the directory of out_filename."""
+    return tempfile.mkdtemp(prefix="sort_sam.", dir=tmp_dir if tmp_dir is not None
+                            else op.dirname(op.abspath(out_filename)))
+
+
+def sort_sam_file(in_sam, out_filename, max_memory=SORT_MAX_MEMORY_DEFAULT,
+                  nproc=1, tmp_dir=None, by_reference_order=None):
+    """
+    Sort alignments of in_sam, and write them with the header of in_sam
+    to out_filename, which is either a SAM or a BAM file (*.bam), using
+    about max_memory bytes of memory and nproc processes. Runs are
+    written to a temporary directory in tmp_dir, which defaults to the
+    directory of out_filename.
+
+    by_reference_order -- sort by reference order in header instead of
+                          reference name, required by and defaults to
+                          True for BAM output, so that SAM files can be
+                          sorted to be merged into BAM later.
+    """
+    header, start = read_sam_header(in_sam)
+    to_bam = out_filename.endswith('.bam')
+    if by_reference_order is None:
+        by_reference_order = to_bam
+    elif to_bam and not by_reference_order:
+        raise ValueError("BAM file %s must be sorted by reference order." % out_filename)
+    ref_order = reference_order(header) if by_reference_order else None
+    nproc = max(1, nproc)
+    run_size = max(MIN_RUN_SIZE, max_memory // (nproc * SORT_MEMORY_FACTOR))
+    ranges = split_ranges(in_sam, start, run_size)
+
+    tmp_dir = _make_tmp_dir(out_filename, tmp_dir)
+    try:
+        args = [(in_sam, s, e, op.join(tmp_dir, "run.%d" % i), ref_order)
+                for i, (s, e) in enumerate(ranges)]
+        log.info("Sorting %s in %d runs of %d bytes by %d processes.",
+                 in_sam, len(args), run_size, nproc)
+        if nproc > 1 and len(args) > 1:
+            pool = Pool(processes=min(nproc, len(args)))
+            try:
+                runs = pool.map(_sort_run, args, chunksize=1)
+                pool.close()
+            except (Exception, KeyboardInterrupt):
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            runs = [_sort_run(arg) for arg in args]
+
+        _merge_to_output(runs, header, out_filename, ref_order, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return out_filename
+
+
+def merge_sorted_sam_files(in_sams, header, out_filename, tmp_dir=None):
+    """
+    k-way merge alignments of SAM files which are already sorted, and
+    write them with header, a list of header lines, to out_filename,
+    which is either a SAM, or a BAM file (*.bam) which requires inputs
+    to be sorted by reference order of header (see sort_sam_file).
+    Raise ValueError if any input is not sorted.
+    """
+    ref_order = reference_order(header) if out_filename.endswith('.bam') else None
+    tmp_dir = _make_tmp_dir(out_filename, tmp_dir)
+    try:
+        log.info("Merging %d sorted SAM files to %s.", len(in_sams), out_filename)
+        _merge_to_output(list(in_sams), header, out_filename, ref_order, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return out_filename
@@ -1,5 +1,6 @@
 from .intersection_unique import IntervalTreeUnique
 from .intersection import IntervalTree
 from .common import *
+from .SamSorter import *
 from .CollapsingUtils import *
 from .CollapseIsoforms import *
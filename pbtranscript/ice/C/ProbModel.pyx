@@ -2,9 +2,11 @@
 # distutils: language = c++
 # distutils: sources = ProbModel.cpp
 from pbtranscript.io.BasQV import basQVcacher, fastqQVcacher
+from pbtranscript.io.QVStore import IdTable
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbcore.io import FastqReader
 from libc.math cimport log
+cimport cython
 
 DEFAULT_WINDOW_SIZE = 3 # default window size changed from 5 to 3.
 
@@ -17,7 +19,7 @@ class ProbFromFastq:
                  prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE):
         self.qver = fastqQVcacher()
         self.fastq_filename = fastq_filename
-        self.seqids = []
+        self.seqids = IdTable()
         self.prob_threshold = prob_threshold
         self.window_size = window_size
         self.full_prob = None
@@ -54,14 +56,13 @@ class ProbFromFastq:
         """Remove ids from self.seqids."""
         for _id in ids:
             self.seqids.remove(_id)
-            del self.qver.qv[_id]
+            self.qver.remove(_id)
 
     def calc_prob_from_aln(self, qID, qStart, qEnd, fakecigar):
         """
         aln_record is a pysam AlignedRead
         """
-        prob_err = self.qver.get(qID, None)
-        return calc_aln_log_prob2(prob_err, len(prob_err), list(fakecigar), 
+        return calc_aln_log_prob2(fakecigar, self.qver.get(qID, None),
                                   qStart, qEnd)
         
 
@@ -76,7 +77,7 @@ class ProbFromQV:
                  prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE):
         self.qver = basQVcacher()
         self.input_fofn = input_fofn
-        self.seqids = []
+        self.seqids = IdTable()
         self.prob_threshold = prob_threshold
         self.window_size = window_size
 
@@ -122,33 +123,41 @@ class ProbFromQV:
         """Remove ids from self.seqids."""
         for _id in ids:
             self.seqids.remove(_id)
-            del self.qver.qv[_id]
+            self.qver.remove(_id)
 
     def calc_prob_from_aln(self, qID, qStart, qEnd, fakecigar):
         """
         Calculate substitution/insertion/deletion probabilities.
         """
-        prob_sub = self.qver.get(qID, 'SubstitutionQV')
-        prob_ins = self.qver.get(qID, 'InsertionQV')
-        prob_del = self.qver.get(qID, 'DeletionQV')
-        return calc_aln_log_prob(prob_sub, prob_ins, prob_del,
-                                 len(prob_del), list(fakecigar), 
+        return calc_aln_log_prob(fakecigar,
+                                 self.qver.get(qID, 'SubstitutionQV'),
+                                 self.qver.get(qID, 'InsertionQV'),
+                                 self.qver.get(qID, 'DeletionQV'),
                                  qStart, qEnd)
 
 
-cdef double calc_aln_log_prob(list prob_sub, list prob_ins,
-                              list prob_del, int n,
-                              list fakecigar, int qStart, int qEnd):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _calc_aln_log_prob(const unsigned char[:] cigar,
+                               const double[::1] prob_sub,
+                               const double[::1] prob_ins,
+                               const double[::1] prob_del,
+                               int qStart, int *q_end) nogil:
     """
-    Calculate log probabilities from alignment cigar strings using Cython.
+    Calculate log probabilities from alignment cigar strings,
+    set q_end to the query position after the alignment, or to -1 if
+    the alignment runs out of the query.
     """
-    cdef int i, cur_q_pos
-    cdef double score, tmp, one_three
-
-    one_three = log(1 / 3.)
-    cur_q_pos = qStart
-    score = 0.
-    for x in fakecigar:
+    cdef Py_ssize_t i, n = prob_sub.shape[0]
+    cdef int cur_q_pos = qStart
+    cdef double score = 0., tmp, one_three = log(1 / 3.)
+    cdef unsigned char x
+
+    for i in range(cigar.shape[0]):
+        x = cigar[i]
+        if cur_q_pos < 0 or cur_q_pos >= n:
+            q_end[0] = -1
+            return score
         if x == 'M':
             tmp = 1 - prob_sub[cur_q_pos] - \
                 prob_ins[cur_q_pos] - prob_del[cur_q_pos]
@@ -166,29 +175,65 @@ cdef double calc_aln_log_prob(list prob_sub, list prob_ins,
             cur_q_pos += 1
         else:  # x == 'D', don't advance qpos
             score += log(prob_del[cur_q_pos])
-    assert cur_q_pos == qEnd
+    q_end[0] = cur_q_pos
+    return score
+
+
+def calc_aln_log_prob(const unsigned char[:] cigar,
+                      const double[::1] prob_sub,
+                      const double[::1] prob_ins,
+                      const double[::1] prob_del,
+                      int qStart, int qEnd):
+    """
+    Calculate log probabilities from alignment cigar strings.
+
+    cigar --- a byte buffer (e.g., str) of one 'M', 'S', 'I' or 'D' per
+              alignment column
+    prob_sub, prob_ins, prob_del --- contiguous float64 arrays of
+              substitution, insertion and deletion probabilities of
+              the whole query
+    The alignment is scored with the GIL released.
+    """
+    cdef double score
+    cdef int q_end
+    if prob_ins.shape[0] != prob_sub.shape[0] or \
+       prob_del.shape[0] != prob_sub.shape[0]:
+        raise ValueError("QV arrays must have the same length.")
+    with nogil:
+        score = _calc_aln_log_prob(cigar, prob_sub, prob_ins, prob_del,
+                                   qStart, &q_end)
+    if q_end < 0:
+        raise IndexError("Alignment runs out of query of length {n}.".
+                         format(n=prob_sub.shape[0]))
+    assert q_end == qEnd
     return score
 
 
-cdef double calc_aln_log_prob2(list prob_err, int n,
-                               list fakecigar, int qStart, int qEnd):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _calc_aln_log_prob2(const unsigned char[:] cigar,
+                                const double[::1] prob_err,
+                                int qStart, int *q_end) nogil:
     """
-    Calculate log probabilities from alignment cigar strings using Cython.
+    Calculate log probabilities from alignment cigar strings, using
+    a single error probability, set q_end to the query position after
+    the alignment, or to -1 if the alignment runs out of the query.
     """
-    cdef int i, cur_q_pos
-    cdef double score, tmp, one_three
-
-    cdef int max_pos = len(prob_err)
-    one_three = log(1 / 3.)
-    cur_q_pos = qStart
-    score = 0.
-    for x in fakecigar:
-        if cur_q_pos >= max_pos: 
+    cdef Py_ssize_t i
+    cdef int max_pos = prob_err.shape[0]
+    cdef int cur_q_pos = qStart
+    cdef double score = 0., tmp, one_three = log(1 / 3.)
+    cdef unsigned char x
+
+    for i in range(cigar.shape[0]):
+        x = cigar[i]
+        if cur_q_pos < 0 or cur_q_pos >= max_pos:
             # ToDo: this is a bug caused by daligner coordinates issues,
             # FIX LATER instead of just returning as done here
+            q_end[0] = -1
             return score
         if x == 'M':
-            tmp = 1 - prob_err[cur_q_pos] 
+            tmp = 1 - prob_err[cur_q_pos]
             # sanity check...sometimes this can have < 0 prob,
             # so assign it a small prob like 0.001
             if tmp <= 0:
@@ -203,7 +248,23 @@ cdef double calc_aln_log_prob2(list prob_err, int n,
             cur_q_pos += 1
         else:  # x == 'D', don't advance qpos
             score += log(prob_err[cur_q_pos])
-    assert cur_q_pos == qEnd
+    q_end[0] = cur_q_pos
+    return score
+
+
+def calc_aln_log_prob2(const unsigned char[:] cigar,
+                       const double[::1] prob_err, int qStart, int qEnd):
+    """
+    Calculate log probabilities from alignment cigar strings, using a
+    single contiguous float64 array of error probabilities of the whole
+    query (e.g., from FASTQ). See calc_aln_log_prob.
+    """
+    cdef double score
+    cdef int q_end
+    with nogil:
+        score = _calc_aln_log_prob2(cigar, prob_err, qStart, &q_end)
+    if q_end >= 0:
+        assert q_end == qEnd
     return score
 
 
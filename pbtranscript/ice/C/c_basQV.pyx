@@ -6,13 +6,14 @@ from libc.math cimport pow
 from libcpp.deque cimport deque
 from libcpp.vector cimport vector
 cimport cython
+import numpy as np
 
 ctypedef cython.int INTT
 
 cdef inline double qv_to_prob(double qv):
     return pow(10, -qv / 10.)
 
-cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict):
+cpdef precache_helper(char * bas_file, list seqids, list QV_names, qv_store):
     cdef bool is_CCS
     cdef int s
     cdef int e
@@ -22,7 +23,7 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
     cdef bool is_bam
 
     is_bam = False
-    # qv_dict = {} # seqid --> qv_name --> list of qv (transformed to prob)
+    # qv_store: a QVStore, seqid --> qv_name --> uint8 qvs
     if (bas_file.endswith("h5")):
         bas = BasH5Reader(bas_file)
     elif bas_file.endswith("bam") or bas_file.endswith("xml"):
@@ -50,7 +51,6 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
             s, e = e, s
             strand = '-'
 
-        qv_dict[seqid] = {}
         for qv_name in QV_names:
             zmw = None
             if not is_bam:
@@ -66,17 +66,74 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
                 qvs = zmw.read(s, e).qv(qv_name)
             if strand == '-':
                 qvs = qvs[::-1]
-            qv_dict[seqid][qv_name] = [qv_to_prob(qv) for qv in qvs]
+            qv_store.add(seqid, qv_name, qvs)
             del qvs
     del bas
 
 
-def fastq_precache_helper(seqid, qvs, qv_dict):
+def fastq_precache_helper(seqid, qvs, qv_store):
     """
     similar to precache_helper except takes a QV quality 
     (ex: np array of [1, 13, 30])
     """
-    qv_dict[seqid]['unsmoothed'] = [qv_to_prob(qv) for qv in qvs]
+    qv_store.add(seqid, 'unsmoothed', qvs)
+
+
+def minqv_per_window(unsigned char[:] arr, int window_size):
+    """
+    Return the minimum QV in a window centered at each position of arr.
+    Since error probability decreases with QV, this is the QV
+    counterpart of maxval_per_window over error probabilities.
+    """
+    cdef deque[int] q
+    cdef int i, j
+    cdef unsigned char new_element
+    cdef int len_arr = arr.shape[0]
+    cdef int w2 = window_size / 2
+    cdef int k = 0
+    result = np.zeros(len_arr, dtype=np.uint8)
+    cdef unsigned char[:] res = result
+
+    i = 0
+    for j in xrange(1, w2 + 1):
+        if arr[j] <= arr[i]:
+            i = j
+    q.push_back(i)
+    res[k] = arr[i]
+    k += 1
+
+    for i in xrange(-w2 + 1, len_arr - window_size + 1):
+        j = q.front()
+        if j < i:
+            q.pop_front()
+        new_element = arr[i + window_size - 1]
+        if q.empty():
+            q.push_back(i + window_size - 1)
+        elif new_element <= arr[j]:
+            q.clear()
+            q.push_back(i + window_size - 1)
+        else:
+            while not q.empty():
+                j = q.back()
+                q.pop_back()
+                if arr[j] < new_element:
+                    q.push_back(j)
+                    break
+            q.push_back(i + window_size - 1)
+        j = q.front()
+        res[k] = arr[j]
+        k += 1
+
+    for i in xrange(len_arr - w2, len_arr):
+        j = q.front()
+        while j < i - w2:
+            q.pop_front()
+            j = q.front()
+        res[k] = arr[j]
+        k += 1
+
+    q.clear()
+    return result
 
 
 def maxval_per_window(list arr, int window_size):
@@ -0,0 +1,318 @@
+"""
+GRASP search of a quasi-clique in a subgraph of a CSR adjacency matrix,
+used by pbtranscript.ice.pClique.grasp_rows.
+
+This follows construct, local, local_extra and grasp of pClique, but
+keeps, for every node of the subgraph, the number of its neighbors in
+the candidate list and in the clique, and updates them as nodes come
+and go, instead of summing columns of the adjacency matrix in every
+iteration. Random choices are drawn from rng, in the same order as
+pClique.grasp does, so both return the same clique for the same seed.
+"""
+from libc.stdlib cimport malloc, calloc, free
+
+
+cdef bint _adj(int *ptr, int *ind, int a, int b):
+    """Return True if b is in the sorted neighbor list of a."""
+    cdef int lo = ptr[a], hi = ptr[a+1], mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ind[mid] < b:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo < ptr[a+1] and ind[lo] == b
+
+
+cdef class _Subgraph:
+    """
+    Subgraph induced by nodes, with neighbors of each node as sorted
+    indices in nodes (ind[ptr[i]:ptr[i+1]]), and counters of neighbors
+    in the candidate list C (cnt_C) and in the clique Q (cnt_Q).
+    """
+    cdef int m
+    cdef int *ptr
+    cdef int *ind
+    cdef int *Q       # clique, in order of insertion
+    cdef int len_Q
+    cdef char *in_Q
+    cdef int *cnt_Q
+    cdef int *C       # candidates of construct, sorted
+    cdef char *in_C
+    cdef int *cnt_C
+    cdef int *cand_idx # index in candidates of local, or -1
+    cdef int *y       # numbers of common neighbors in Q of candidates
+    cdef char *mark
+
+    def __cinit__(self, int[:] indptr, int[:] indices, int[:] nodes, int[:] pos):
+        cdef int i, k, p, n_nbrs = 0
+        self.m = nodes.shape[0]
+        for i in range(self.m):
+            n_nbrs += indptr[nodes[i]+1] - indptr[nodes[i]]
+        self.ptr = <int *>malloc((self.m + 1) * sizeof(int))
+        self.ind = <int *>malloc((n_nbrs + 1) * sizeof(int))
+        self.Q = <int *>malloc((self.m + 1) * sizeof(int))
+        self.in_Q = <char *>calloc(self.m + 1, sizeof(char))
+        self.cnt_Q = <int *>calloc(self.m + 1, sizeof(int))
+        self.C = <int *>malloc((self.m + 1) * sizeof(int))
+        self.in_C = <char *>calloc(self.m + 1, sizeof(char))
+        self.cnt_C = <int *>calloc(self.m + 1, sizeof(int))
+        self.cand_idx = <int *>malloc((self.m + 1) * sizeof(int))
+        self.y = <int *>malloc((self.m + 1) * sizeof(int))
+        self.mark = <char *>calloc(self.m + 1, sizeof(char))
+        if (self.ptr == NULL or self.ind == NULL or self.Q == NULL or
+            self.in_Q == NULL or self.cnt_Q == NULL or self.C == NULL or
+            self.in_C == NULL or self.cnt_C == NULL or
+            self.cand_idx == NULL or self.y == NULL or self.mark == NULL):
+            raise MemoryError()
+
+        # nodes is sorted and indices of each row are sorted, so are
+        # neighbor lists of the subgraph
+        n_nbrs = 0
+        for i in range(self.m):
+            self.ptr[i] = n_nbrs
+            for k in range(indptr[nodes[i]], indptr[nodes[i]+1]):
+                p = pos[indices[k]]
+                if p >= 0:
+                    self.ind[n_nbrs] = p
+                    n_nbrs += 1
+            self.cand_idx[i] = -1
+        self.ptr[self.m] = n_nbrs
+        self.len_Q = 0
+
+    def __dealloc__(self):
+        free(self.ptr)
+        free(self.ind)
+        free(self.Q)
+        free(self.in_Q)
+        free(self.cnt_Q)
+        free(self.C)
+        free(self.in_C)
+        free(self.cnt_C)
+        free(self.cand_idx)
+        free(self.y)
+        free(self.mark)
+
+    cdef void add_to_Q(self, int z):
+        """Append z to Q."""
+        cdef int k
+        self.Q[self.len_Q] = z
+        self.len_Q += 1
+        self.in_Q[z] = 1
+        for k in range(self.ptr[z], self.ptr[z+1]):
+            self.cnt_Q[self.ind[k]] += 1
+
+    cdef void remove_from_Q(self, int ww):
+        """Remove Q[ww] from Q, keeping the order of the others."""
+        cdef int k, z = self.Q[ww]
+        for k in range(ww, self.len_Q - 1):
+            self.Q[k] = self.Q[k+1]
+        self.len_Q -= 1
+        self.in_Q[z] = 0
+        for k in range(self.ptr[z], self.ptr[z+1]):
+            self.cnt_Q[self.ind[k]] -= 1
+
+    cdef void clear_Q(self):
+        """Remove all nodes from Q."""
+        while self.len_Q > 0:
+            self.remove_from_Q(self.len_Q - 1)
+
+    cdef int construct(self, double alpha, int starting_node, rng) except -1:
+        """construct of pClique, fill in Q and return its size."""
+        cdef int i, k, c, u, len_C, new_len_C, n_removed
+        cdef int min_deg_C, max_deg_C
+        cdef double RCL_threshold
+        cdef int *ptr = self.ptr
+        cdef int *ind = self.ind
+        cdef int *C = self.C
+        cdef int *cnt_C = self.cnt_C
+        cdef char *in_C = self.in_C
+        cdef char *mark = self.mark
+
+        self.clear_Q()
+        self.add_to_Q(starting_node)
+
+        # candidates = direct neighbors of starting_node
+        len_C = ptr[starting_node+1] - ptr[starting_node]
+        for i in range(len_C):
+            C[i] = ind[ptr[starting_node] + i]
+            in_C[C[i]] = 1
+        for i in range(len_C):
+            c = C[i]
+            cnt_C[c] = 0
+            for k in range(ptr[c], ptr[c+1]):
+                if in_C[ind[k]]:
+                    cnt_C[c] += 1
+
+        while len_C > 0:
+            min_deg_C = max_deg_C = cnt_C[C[0]]
+            for i in range(1, len_C):
+                if cnt_C[C[i]] < min_deg_C:
+                    min_deg_C = cnt_C[C[i]]
+                if cnt_C[C[i]] > max_deg_C:
+                    max_deg_C = cnt_C[C[i]]
+            RCL_threshold = min_deg_C + alpha*(max_deg_C - min_deg_C)
+            RCL = [i for i in range(len_C) if cnt_C[C[i]] >= RCL_threshold]
+            if len(RCL) == 0:
+                break
+            u = C[<int>rng.choice(RCL)]
+            self.add_to_Q(u)
+
+            # keep candidates which are neighbors of u, in order, and
+            # collect the others in y, which is not in use here
+            for k in range(ptr[u], ptr[u+1]):
+                mark[ind[k]] = 1
+            new_len_C = 0
+            n_removed = 0
+            for i in range(len_C):
+                c = C[i]
+                if mark[c]:
+                    C[new_len_C] = c
+                    new_len_C += 1
+                else:
+                    in_C[c] = 0
+                    self.y[n_removed] = c
+                    n_removed += 1
+            for k in range(ptr[u], ptr[u+1]):
+                mark[ind[k]] = 0
+            for i in range(n_removed):
+                c = self.y[i]
+                for k in range(ptr[c], ptr[c+1]):
+                    if in_C[ind[k]]:
+                        cnt_C[ind[k]] -= 1
+            len_C = new_len_C
+
+        for i in range(len_C):
+            in_C[C[i]] = 0
+        return self.len_Q
+
+    cdef bint min_degree_at_least(self, int out, int a, int b,
+                                  double threshold):
+        """
+        Return True if every node of Q, except Q[out] if out >= 0, plus
+        nodes a and b if >= 0, has at least threshold neighbors in them.
+        """
+        cdef int i, z, deg, q_out = self.Q[out] if out >= 0 else -1
+        cdef int *ptr = self.ptr
+        cdef int *ind = self.ind
+        for i in range(self.len_Q + 2):
+            if i < self.len_Q:
+                if i == out:
+                    continue
+                z = self.Q[i]
+            else:
+                z = a if i == self.len_Q else b
+                if z < 0:
+                    continue
+            deg = self.cnt_Q[z]
+            if q_out >= 0 and _adj(ptr, ind, z, q_out):
+                deg -= 1
+            if a >= 0 and _adj(ptr, ind, z, a):
+                deg += 1
+            if b >= 0 and _adj(ptr, ind, z, b):
+                deg += 1
+            if deg < threshold:
+                return False
+        return True
+
+    cdef bint local(self, double gamma, rng) except -1:
+        """local of pClique, return True if Q is changed."""
+        cdef int i, j, k, v, u, cv, q, ww, len_cand
+        cdef int len_Q = self.len_Q
+        cdef double gamma_threshold = gamma*len_Q
+        cdef int *ptr = self.ptr
+        cdef int *ind = self.ind
+        cdef int *y = self.y
+        cdef int *cand_idx = self.cand_idx
+
+        cand = [i for i in range(self.m)
+                if not self.in_Q[i] and self.cnt_Q[i] >= gamma_threshold]
+        len_cand = len(cand)
+        if len_cand < 2:
+            return False
+        for j in range(len_cand):
+            cand_idx[<int>cand[j]] = j
+
+        Q_index_set = set(range(len_Q))
+        choices = list(range(len_cand))
+        rng.shuffle(choices)
+        changed = False
+        for v in choices:
+            cv = cand[v]
+            # y[u] = number of nodes in Q adjacent to both cand[u] and cv
+            for j in range(len_cand):
+                y[j] = 0
+            for k in range(ptr[cv], ptr[cv+1]):
+                q = ind[k]
+                if self.in_Q[q]:
+                    for i in range(ptr[q], ptr[q+1]):
+                        if cand_idx[ind[i]] >= 0:
+                            y[cand_idx[ind[i]]] += 1
+            y[v] = 0
+            u = 0
+            for j in range(1, len_cand):
+                if y[j] > y[u]:
+                    u = j
+            if y[u] >= gamma_threshold:
+                # try to replace a node in Q, which is not adjacent to
+                # cv, by cand[u] and cv; nodes are tried in the order of
+                # the python set, as local does
+                w = Q_index_set.difference(
+                    [k for k in range(len_Q) if _adj(ptr, ind, cv, self.Q[k])])
+                for ww in w:
+                    if self.min_degree_at_least(ww, cand[u], cv,
+                                                gamma*(len_Q+1)):
+                        self.remove_from_Q(ww)
+                        self.add_to_Q(cand[u])
+                        self.add_to_Q(cv)
+                        changed = True
+                        break
+                if changed:
+                    break
+
+        for j in range(len_cand):
+            cand_idx[<int>cand[j]] = -1
+        return changed
+
+    cdef int local_extra(self, double gamma, rng) except -1:
+        """local_extra of pClique, add nodes to Q."""
+        cdef int i, x
+        cdef double gamma_threshold = gamma*(self.len_Q+1)
+        cand = [i for i in range(self.m)
+                if not self.in_Q[i] and self.cnt_Q[i] >= gamma_threshold]
+        rng.shuffle(cand)
+        while len(cand) > 0:
+            x = cand.pop()
+            if self.min_degree_at_least(-1, x, -1, gamma_threshold):
+                self.add_to_Q(x)
+                gamma_threshold = gamma*(self.len_Q+1)
+        return 0
+
+    def grasp(self, double gamma, int maxitr, int starting_node, rng):
+        """grasp of pClique, given starting_node."""
+        cdef int _k, i
+        cdef double alpha
+        bestQ = []
+        for _k in range(maxitr):
+            alpha = rng.uniform(0.1, 0.9)
+            if self.construct(alpha, starting_node, rng) <= 1:
+                return []
+            while self.local(gamma, rng):
+                pass
+            self.local_extra(gamma, rng)
+            if self.len_Q > len(bestQ):
+                bestQ = [self.Q[i] for i in range(self.len_Q)]
+        return bestQ
+
+
+def grasp_rows(int[:] indptr, int[:] indices, int[:] nodes, int[:] pos,
+               double gamma, int maxitr, int starting_node, rng):
+    """
+    grasp, given starting_node, on the subgraph of a CSR adjacency
+    matrix (indptr, indices), with sorted indices and no self loops,
+    induced by nodes, a sorted array of node indices, where pos maps
+    node index to index in nodes or -1.
+    Return indices in nodes of the clique.
+    """
+    return _Subgraph(indptr, indices, nodes, pos).grasp(
+        gamma, maxitr, starting_node, rng)
@@ -1,4 +1,5 @@
 from libc.stdlib cimport malloc, free
+import numpy as np
 
 cdef inline double double_min(double a, double b): return a if a <= b else b
 cdef inline double double_max(double a, double b): return a if a >= b else b
@@ -64,3 +65,113 @@ def test():
     else:
         print("Test not passed.")
 
+
+
+cdef inline int _qv_pos(int idx, int start, int end, int length, bint rev):
+    """
+    Map an index in the aligned part of a sequence to a QV position,
+    clipped to [0, length-1], the same as in eval_blasr_alignment.
+    """
+    cdef int p
+    if rev:
+        p = end - 1 - idx
+        return p if p > 0 else 0
+    p = start + idx
+    return p if p < length - 1 else length - 1
+
+
+def eval_aln_columns(char *qAln, char *alnStr, char *sAln,
+                     q_qvs, q_coords, q_thresholds,
+                     s_qvs, s_coords, s_thresholds):
+    """
+    Go through columns of an alignment (qAln, alnStr, sAln) in one pass
+    and return (cigar_str, ece), where cigar_str has one of 'M', 'S',
+    'I', 'D' per column and ece is a 0|1 numpy array where 1 is a penalty.
+
+    q_qvs --- (InsertionQV, DeletionQV, SubstitutionQV) probabilities of
+              the whole query, as float64 arrays, or None if the alignment
+              has no non-match columns.
+    q_coords --- (start, end, length, is_reverse_strand) of query
+    q_thresholds --- (I, D, S), a QV below threshold is good
+    s_qvs, s_coords, s_thresholds --- same for subject, s_qvs is None if
+              subject QVs should not be checked (e.g., subject is a consensus)
+
+    See IceUtils.eval_blasr_alignment for how non-matches are penalized.
+    """
+    cdef int n = len(alnStr)
+    cdef int offset, q_index = 0, s_index = 0
+    cdef char last_state = 0, last_tracking_nt = 0
+    cdef bint homopolymer_so_far = False, q_is_good, s_is_good
+    cdef bint check_s = s_qvs is not None
+    cdef int q_start = 0, q_end = 0, q_len = 0, s_start = 0, s_end = 0, s_len = 0
+    cdef bint q_rev = False, s_rev = False
+    cdef double q_thr_ins = 0, q_thr_del = 0, q_thr_sub = 0
+    cdef double s_thr_ins = 0, s_thr_del = 0, s_thr_sub = 0
+    cdef double[:] q_ins, q_del, q_sub, s_ins, s_del, s_sub
+
+    q_start, q_end, q_len, q_rev = q_coords
+    s_start, s_end, s_len, s_rev = s_coords
+    q_thr_ins, q_thr_del, q_thr_sub = q_thresholds
+    s_thr_ins, s_thr_del, s_thr_sub = s_thresholds
+    if q_qvs is not None:
+        q_ins, q_del, q_sub = q_qvs
+    if check_s:
+        s_ins, s_del, s_sub = s_qvs
+
+    ece = np.zeros(n, dtype=np.int)
+    cdef long[:] ece_v = ece
+    cdef char *cigar = <char *>malloc((n + 1) * sizeof(char))
+
+    for offset in range(n):
+        if alnStr[offset] == '|':  # match
+            cigar[offset] = 'M'
+            q_index += 1
+            s_index += 1
+            last_state = 'M'
+        elif qAln[offset] == '-':  # deletion
+            s_is_good = (not check_s) or \
+                s_ins[_qv_pos(s_index, s_start, s_end, s_len, s_rev)] < s_thr_ins
+            q_is_good = q_del[_qv_pos(q_index + 1, q_start, q_end, q_len, q_rev)] < q_thr_del
+            if last_state != 'D':
+                last_tracking_nt = sAln[offset]
+                homopolymer_so_far = True
+                if s_is_good and q_is_good:
+                    ece_v[offset] = 1
+            else:
+                homopolymer_so_far = (sAln[offset] == last_tracking_nt)
+                if s_is_good and (q_is_good or not homopolymer_so_far):
+                    ece_v[offset] = 1
+            cigar[offset] = 'D'
+            s_index += 1
+            last_state = 'D'
+        elif sAln[offset] == '-':  # insertion
+            q_is_good = q_ins[_qv_pos(q_index, q_start, q_end, q_len, q_rev)] < q_thr_ins
+            s_is_good = (not check_s) or \
+                s_del[_qv_pos(s_index + 1, s_start, s_end, s_len, s_rev)] < s_thr_del
+            if last_state != 'I':
+                last_tracking_nt = qAln[offset]
+                homopolymer_so_far = True
+                if q_is_good and s_is_good:
+                    ece_v[offset] = 1
+            else:
+                homopolymer_so_far = (qAln[offset] == last_tracking_nt)
+                if q_is_good and (s_is_good or not homopolymer_so_far):
+                    ece_v[offset] = 1
+            cigar[offset] = 'I'
+            q_index += 1
+            last_state = 'I'
+        else:  # substitution
+            cigar[offset] = 'S'
+            if q_sub[_qv_pos(q_index, q_start, q_end, q_len, q_rev)] < q_thr_sub and \
+               ((not check_s) or
+                s_sub[_qv_pos(s_index, s_start, s_end, s_len, s_rev)] < s_thr_sub):
+                ece_v[offset] = 1
+            q_index += 1
+            s_index += 1
+            last_state = 'S'
+
+    try:
+        cigar_str = cigar[:n]
+    finally:
+        free(cigar)
+    return cigar_str, ece
@@ -19,6 +19,7 @@ import time
 from pbtranscript.PBTranscriptOptions import \
     add_sge_arguments, add_fofn_arguments, add_tmp_dir_argument
 from pbtranscript.Utils import realpath, mkdir, real_upath, ln
+from pbtranscript.JobNotifier import JobNotifier, wait_for_files
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceUtils import combine_nfl_pickles
 from pbtranscript.ice.__init__ import ICE_PARTIAL_PY
@@ -74,6 +75,10 @@ class IceAllPartials(IceFiles):
 
         self.sge_opts = sge_opts
 
+        # sge jobs report to notifier when they start and end.
+        self.notifier = None
+        self.jids = []
+
         self.add_log("Making dir for mapping noFL reads: " + self.nfl_dir)
         mkdir(self.nfl_dir)
 
@@ -150,6 +155,9 @@ class IceAllPartials(IceFiles):
         self.add_log("Mapping non-full-length reads to consensus isoforms.")
         self.add_log("Creating pickles...", level=logging.INFO)
 
+        if self.sge_opts.use_sge is True:
+            self.notifier = JobNotifier.create()
+
         for idx, fa in enumerate(self.fasta_filenames):
             # for each splitted non-full-length reads fasta file, build #
             # partial_uc.pickle
@@ -167,7 +175,10 @@ class IceAllPartials(IceFiles):
             self.add_log("Writing command to script {fsh}".
                          format(fsh=self.script_filenames[idx]))
             with open(self.script_filenames[idx], 'w') as fsh:
-                fsh.write(cmd + "\n")
+                if self.sge_opts.use_sge is True and self.notifier is not None:
+                    fsh.write("\n".join(self.notifier.wrap_cmd(cmd)))
+                else:
+                    fsh.write(cmd + "\n")
 
             # determine elog & olog
             partial_log_fn = op.join(self.log_dir,
@@ -189,27 +200,36 @@ class IceAllPartials(IceFiles):
             self.add_log("Creating a pickle for {f}".format(f=fa))
 
             if self.sge_opts.use_sge is True:
-                self.qsub_cmd_and_log(qsub_cmd)
+                jid = self.qsub_cmd_and_log(qsub_cmd)
+                self.jids.append(jid)
+                if self.notifier is not None:
+                    self.notifier.add_job(jid)
             else:
                 cmd += " 1>{olog} 2>{elog}".format(olog=real_upath(olog),
                                                    elog=real_upath(elog))
                 self.run_cmd_and_log(cmd=cmd, olog=olog, elog=elog)
 
     def waitForPickles(self, pickle_filenames, done_filenames):
-        """Wait for *.pickle and *.pickle.DONE to be created."""
+        """Wait for *.pickle and *.pickle.DONE to be created.
+        Wake up as soon as a file is created in nfl_dir or a job ends,
+        and check files at least every minute otherwise."""
         self.add_log("Waiting for pickles {ps} to be created.".
                      format(ps=", ".join(pickle_filenames)),
                      level=logging.INFO)
-        stop = False
-        sleep_time = 10
-        while stop is not True:
-            stop = all(op.exists(p) for p in pickle_filenames) and \
-                all(op.exists(d) for d in done_filenames)
-            sleep_time = min(600, sleep_time * 2)
-            time.sleep(sleep_time)
-            self.add_log("Waiting for pickles to be created: {ps}".
-                         format(ps=", ".join([p for p in pickle_filenames
-                                              if op.exists(p)])))
+        start_t = time.time()
+        missing = list(pickle_filenames) + list(done_filenames)
+        while len(missing) > 0:
+            missing = wait_for_files(missing, timeout=600, recheck_every=60,
+                                     notifier=self.notifier)
+            if len(missing) > 0:
+                self.add_log("Waiting for pickles to be created: {ps}".
+                             format(ps=", ".join(missing)))
+        self.add_log("All pickles created after {t:.0f} sec.".
+                     format(t=time.time() - start_t), level=logging.INFO)
+        if self.notifier is not None:
+            self.notifier.log_timing(self.jids)
+            self.notifier.close()
+            self.notifier = None
 
     def combinePickles(self, pickle_filenames, out_pickle):
         """Combine all *.pickle files to one and dump to self.out_pickle."""
@@ -0,0 +1,178 @@
+"""
+Define IceCheckpoint, an append-only checkpoint log of IceIterative.
+
+A checkpoint consists of two files:
+    <prefix>.snapshot --- a pickled generation number, followed by
+                          a full ICE state, the same dict as
+                          IceIterative.write_pickle dumps.
+    <prefix>.log      --- a sequence of pickled (generation, delta),
+                          each delta records what has changed since
+                          the previous snapshot or delta.
+
+Writing a delta costs time proportional to the number of changed
+clusters and reads, instead of the size of the ICE state. Every
+snapshot_every deltas, the log is compacted into a new snapshot of
+the next generation. A delta which was only partially written
+(e.g., the job was killed) is ignored when the checkpoint is loaded,
+and so are deltas of an older generation than the snapshot, which
+remain in the log if the job was killed after the new snapshot was
+written but before the log was emptied.
+
+A delta is a dict, where
+    'uc', 'refs', 'd' --- dicts of key --> new value, or None if the
+                          key has been deleted,
+    'newids'          --- the new set of newids, only if changed,
+and all other keys replace values in the state.
+
+Example:
+    ckpt = IceCheckpoint('output/ice.checkpoint')
+    ckpt.write_snapshot(state)
+    ckpt.append(delta)
+    state = ckpt.load()
+    state = load_ice_state('output/ice.checkpoint.snapshot')
+"""
+
+import os
+import os.path as op
+import logging
+import cPickle
+
+__all__ = ["IceCheckpoint", "apply_ice_delta", "load_ice_state"]
+
+log = logging.getLogger(__name__)
+
+
+def apply_ice_delta(state, delta):
+    """Apply a delta to an ICE state dict in place, and return state."""
+    for key, value in delta.iteritems():
+        if key in ('uc', 'refs', 'd'):
+            for k, v in value.iteritems():
+                if v is None:
+                    state[key].pop(k, None)
+                else:
+                    state[key][k] = v
+        else:
+            state[key] = value
+    return state
+
+
+class IceCheckpoint(object):
+
+    """Append-only checkpoint log plus periodic snapshots."""
+
+    SNAPSHOT_SUFFIX = ".snapshot"
+    LOG_SUFFIX = ".log"
+
+    def __init__(self, prefix, snapshot_every=20):
+        """
+        prefix --- checkpoint files are prefix.snapshot and prefix.log
+        snapshot_every --- compact to a new snapshot every this many deltas
+        """
+        self.prefix = prefix
+        self.snapshot_every = snapshot_every
+        # number of deltas in log since the last snapshot
+        self.num_deltas = 0
+        # generation of the last snapshot, written with every delta
+        self.generation = self._read_generation()
+
+    @property
+    def snapshot_filename(self):
+        """Return prefix.snapshot"""
+        return self.prefix + self.SNAPSHOT_SUFFIX
+
+    @property
+    def log_filename(self):
+        """Return prefix.log"""
+        return self.prefix + self.LOG_SUFFIX
+
+    @classmethod
+    def prefix_of(cls, filename):
+        """
+        Return checkpoint prefix if filename is a checkpoint snapshot,
+        log or prefix, otherwise return None.
+        """
+        for suffix in (cls.SNAPSHOT_SUFFIX, cls.LOG_SUFFIX):
+            if filename.endswith(suffix):
+                filename = filename[:-len(suffix)]
+                break
+        if op.exists(filename + cls.SNAPSHOT_SUFFIX):
+            return filename
+        return None
+
+    def _read_generation(self):
+        """Return generation of the existing snapshot, or 0 if none."""
+        if not op.exists(self.snapshot_filename):
+            return 0
+        with open(self.snapshot_filename, 'rb') as f:
+            return cPickle.load(f)
+
+    def needs_snapshot(self):
+        """Return True if the next checkpoint should be a snapshot."""
+        return (self.num_deltas >= self.snapshot_every or
+                not op.exists(self.snapshot_filename))
+
+    def write_snapshot(self, state):
+        """Write a full ICE state as a new snapshot, and empty the log."""
+        generation = self.generation + 1
+        tmp_fn = self.snapshot_filename + ".tmp"
+        with open(tmp_fn, 'wb') as f:
+            cPickle.dump(generation, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        # the old snapshot and log stay valid until the rename, after
+        # which deltas left in the log are older than the snapshot.
+        os.rename(tmp_fn, self.snapshot_filename)
+        self.generation = generation
+        open(self.log_filename, 'wb').close()
+        self.num_deltas = 0
+
+    def append(self, delta):
+        """Append a delta to the log."""
+        with open(self.log_filename, 'ab') as f:
+            cPickle.dump((self.generation, delta), f, cPickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_deltas += 1
+
+    def load(self):
+        """Return ICE state of the snapshot with all deltas applied."""
+        with open(self.snapshot_filename, 'rb') as f:
+            self.generation = cPickle.load(f)
+            state = cPickle.load(f)
+        self.num_deltas = 0
+        if not op.exists(self.log_filename):
+            return state
+        num_old = 0
+        with open(self.log_filename, 'rb') as f:
+            while True:
+                try:
+                    generation, delta = cPickle.load(f)
+                except EOFError:
+                    break
+                except (cPickle.UnpicklingError, ValueError,
+                        AttributeError, IndexError) as e:
+                    log.warning("Ignoring incomplete delta %d in %s: %r",
+                                self.num_deltas, self.log_filename, e)
+                    break
+                if generation < self.generation:
+                    num_old += 1
+                    continue
+                apply_ice_delta(state, delta)
+                self.num_deltas += 1
+        if num_old > 0:
+            log.warning("Ignoring %d deltas in %s older than snapshot %s.",
+                        num_old, self.log_filename, self.snapshot_filename)
+        return state
+
+
+def load_ice_state(filename):
+    """
+    Load an ICE state dict from either an IceIterative pickle file,
+    or a checkpoint (prefix, prefix.snapshot or prefix.log).
+    """
+    prefix = IceCheckpoint.prefix_of(filename)
+    if prefix is not None:
+        return IceCheckpoint(prefix).load()
+    with open(filename, 'rb') as f:
+        return cPickle.load(f)
@@ -7,7 +7,7 @@ input reads against itself.
 import os.path as op
 import time
 import logging
-import networkx as nx
+import numpy as np
 from pbcore.io import FastaReader
 from pbtranscript.Utils import real_upath, execute
 from pbtranscript.ice_daligner import DalignerRunner
@@ -59,15 +59,24 @@ class IceInit(object):
                                 query_converted=False, target_converted=False,
                                 is_FL=True, same_strand_only=True,
                                 use_sge=False, sge_opts=None,
-                                cpus=4)
+                                cpus=self.sge_opts.blasr_nproc)
         runner.run(min_match_len=self.ice_opts.low_cDNA_size,
                    output_dir=output_dir,
                    sensitive_mode=self.ice_opts.sensitive_mode)
         return runner
 
-    def _makeGraphFromM5(self, m5FN, qver_get_func, qvmean_get_func, ice_opts):
-        """Construct a graph from a BLASR M5 file."""
-        alignGraph = nx.Graph()
+    def _readIDs(self, readsFa):
+        """Return ids of reads in readsFa, in file order."""
+        with FastaReader(readsFa) as reader:
+            return [r.name.split()[0] for r in reader]
+
+    def _makeGraphFromM5(self, m5FN, readsFa, qver_get_func, qvmean_get_func,
+                         ice_opts):
+        """
+        Construct a graph from a BLASR M5 file, return a pClique.EdgeList
+        whose nodes are reads in readsFa, followed by other hit reads.
+        """
+        alignGraph = pClique.EdgeList(self._readIDs(readsFa))
 
         for r in blasr_against_ref(output_filename=m5FN,
                                    is_FL=True,
@@ -83,11 +92,16 @@ class IceInit(object):
                 alignGraph.add_edge(r.qID, r.cID)
         return alignGraph
 
-    def _makeGraphFromLA4Ice(self, runner, qver_get_func, qvmean_get_func, ice_opts):
-        """Construct a graph from a LA4Ice output file."""
-        alignGraph = nx.Graph()
+    def _makeGraphFromLA4Ice(self, runner, readsFa, qver_get_func,
+                             qvmean_get_func, ice_opts):
+        """
+        Construct a graph from a LA4Ice output file, return a
+        pClique.EdgeList whose nodes are reads in readsFa, followed
+        by other hit reads.
+        """
+        alignGraph = pClique.EdgeList(self._readIDs(readsFa))
 
-        for la4ice_filename in runner.la4ice_filenames:
+        for la4ice_filename in runner.alignment_filenames:
             count = 0
             start_t = time.time()
             for r in daligner_against_ref(
@@ -113,8 +127,8 @@ class IceInit(object):
         Find all mutually exclusive cliques within the graph, with decreased
         size.
 
-        alignGraph - a graph, each node represent a read and each edge
-        represents an alignment between two end points.
+        alignGraph - a pClique.EdgeList, each node represent a read and
+        each edge represents an alignment between two end points.
 
         Return a dictionary of clique indices and nodes.
             key = index of a clique
@@ -122,44 +136,29 @@ class IceInit(object):
         Cliques are ordered by their size descendingly: index up, size down
         Reads which are not included in any cliques will be added as cliques
         of size 1.
+
+        Cliques are found by pClique.find_cliques on the CSR adjacency
+        matrix of alignGraph.
         """
+        H = alignGraph.adjacency_matrix()
+        # setting gamma=0.8 means to find quasi-0.8-cliques!
+        cliques = pClique.find_cliques(H, gamma=0.8, maxitr=5)
+
         uc = {}    # To keep cliques found
-        used = []  # nodes within any cliques
-        ind = 0    # index of clique to discover
-
-        deg = alignGraph.degree().items()
-        # Sort tuples of (node, degree) by degree, descendingly
-        deg.sort(key=lambda x: x[1], reverse=True)
-        for d in deg:
-            node = d[0]  # node which has the largest degree in alignGraph
-            if node not in alignGraph:
-                continue
-            # just get the immediate neighbors since we're looking for perfect
-            # cliques
-            subGraph = alignGraph.subgraph([node] + alignGraph.neighbors(node))
-            subNodes = subGraph.nodes()
-            # Convert from networkx.Graph to a sparse matrix
-            S, H = pClique.convert_graph_connectivity_to_sparse(
-                subGraph, subNodes)
-            # index of the 'node' in the sub-graph
-            seed_i = subNodes.index(node)
-            # Grasp a clique from subGraph, and return indices of clique nodes
-            # setting gamma=0.8 means to find quasi-0.8-cliques!
-            tQ = pClique.grasp(S, H, gamma=0.8, maxitr=5, given_starting_node=seed_i)
-            if len(tQ) > 0:
-                c = [subNodes[i] for i in tQ]  # nodes in the clique
-                uc[ind] = c  # Add the clique to uc
+        # nodes within any cliques
+        used = np.zeros(alignGraph.num_nodes, dtype=np.bool)
+        for ind, c in enumerate(cliques):
+            uc[ind] = [alignGraph.names[i] for i in c]
+            used[c] = True
+
+        ind = len(uc)
+        for rid in self._readIDs(readsFa):
+            i = alignGraph.name_to_index.get(rid)
+            if i is None or not used[i]:
+                uc[ind] = [rid]
                 ind += 1
-                used += c    # Add clique nodes to used
-                # Remove clique nodes from alignGraph and continue
-                alignGraph.remove_nodes_from(c)
-
-        with FastaReader(readsFa) as reader:
-            for r in reader:
-                rid = r.name.split()[0]
-                if rid not in used:
-                    uc[ind] = [rid]
-                    ind += 1
+                if i is not None:
+                    used[i] = True
         return uc
 
     def init_cluster_by_clique(self, readsFa, qver_get_func, qvmean_get_func,
@@ -187,6 +186,7 @@ class IceInit(object):
             runner = self._align_withDALIGNER(queryFa=readsFa,
                                               output_dir=op.dirname(readsFa))
             alignGraph = self._makeGraphFromLA4Ice(runner=runner,
+                                                   readsFa=readsFa,
                                                    qver_get_func=qver_get_func,
                                                    qvmean_get_func=qvmean_get_func,
                                                    ice_opts=ice_opts)
@@ -196,6 +196,7 @@ class IceInit(object):
             self._align_withBLASR(queryFa=readsFa, targetFa=readsFa, outFN=outFN,
                                   ice_opts=ice_opts, sge_opts=sge_opts)
             alignGraph = self._makeGraphFromM5(m5FN=outFN,
+                                               readsFa=readsFa,
                                                qver_get_func=qver_get_func,
                                                qvmean_get_func=qvmean_get_func,
                                                ice_opts=ice_opts)
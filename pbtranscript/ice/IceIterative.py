@@ -21,10 +21,12 @@ from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice_daligner import DalignerRunner
 from pbtranscript.ice_pbdagcon import runConsensus
 from pbtranscript.ice.IceInit import IceInit
+from pbtranscript.ice.ProbTable import ProbTable
+from pbtranscript.ice.IceCheckpoint import IceCheckpoint, load_ice_state
 from pbtranscript.ice.IceUtils import sanity_check_gcon, \
     sanity_check_sge, possible_merge, blasr_against_ref, \
     get_the_only_fasta_record, cid_with_annotation, \
-    daligner_against_ref, ice_fa2fq, fafn2fqfn, \
+    daligner_against_ref, daligner_alignment_reader, ice_fa2fq, fafn2fqfn, \
     set_probqv_from_ccs, set_probqv_from_fq, set_probqv_from_model
 
 
@@ -69,7 +71,7 @@ class IceIterative(IceFiles):
             dict of cid --> list of members
         refs ---  dict of cid --> fasta file containing the cluster
             consensus fasta
-        d  --- dict of read id --> dict of cid:prob
+        d  --- dict of read id --> dict of cid:prob, or a ProbTable
 
         qv_prob_threshold --- params for isoform accept/reject hit
         ice_opts --- params for isoform accept/reject, including
@@ -111,12 +113,17 @@ class IceIterative(IceFiles):
             self.newids.update(set([r.id for r in cs]))
         self.seq_dict = FastaRandomReader(all_fasta_filename)
 
-        # probability dict, seqid --> cluster index i --> P(seq|C_i)
-        self.d = {}
+        # probability table, seqid --> cluster index i --> P(seq|C_i)
+        self.d = ProbTable()
 
         self.refs = {}  # cluster index --> gcon output consensus filename
         self.uc = {}  # cluster index --> list of member seqids
 
+        # cids whose members or refs have changed, and whether newids
+        # has changed, since the last checkpoint
+        self._ckpt_cids = set()
+        self._ckpt_newids_changed = False
+
         # used by clustering merging to track chained mergings, (key) cid
         self.old_rec = {}
         self.new_rec = {}
@@ -220,11 +227,15 @@ class IceIterative(IceFiles):
         else:
             self.add_log("Loading probabilities from a prob dict directly.",
                          level=logging.INFO)
-            self.d = d
+            self.d = ProbTable.from_dict(d)
 
         self.removed_qids = set()
         self.global_count = 0
 
+        # append-only checkpoint log, starting with a full snapshot.
+        self.checkpointer = IceCheckpoint(self.checkpointPrefix)
+        self._ckpt_written = False
+
     @property
     def tmpConsensusFa(self):
         """Return tmp consensus Fasta file. e.g.,
@@ -233,11 +244,11 @@ class IceIterative(IceFiles):
         return op.join(self.out_dir, "tmp.consensus.fasta")
 
     @property
-    def tmpPickleFN(self):
-        """Return file name of tmp pickle file. e.g.,
-           output/tmp.pickle
+    def checkpointPrefix(self):
+        """Return prefix of checkpoint files, e.g.,
+           output/ice.checkpoint
         """
-        return op.join(self.out_dir, "tmp.pickle")
+        return op.join(self.out_dir, "ice.checkpoint")
 
     @property
     def currentFa(self):
@@ -312,10 +323,9 @@ class IceIterative(IceFiles):
 
     @staticmethod
     def from_pickle(pickle_filename, probQV):
-        """Load an instance of IceIterative from a pickle file."""
-        a = None
-        with open(pickle_filename) as h:
-            a = cPickle.load(h)
+        """Load an instance of IceIterative from a pickle file,
+        or a checkpoint written by IceIterative.checkpoint."""
+        a = load_ice_state(pickle_filename)
         all_fasta_filename = a['all_fasta_filename']
         # need to make current.fasta!!!
         newids = a['newids']
@@ -389,20 +399,24 @@ class IceIterative(IceFiles):
         self.add_log(msg, level=logging.INFO)
         self.write_pickle(final_pickle_fn)
 
+    def _small_state(self):
+        """Return parts of ICE state which are always fully checkpointed."""
+        return {'ccs_fofn': self.ccs_fofn,
+                'fasta_filename': self.fasta_filename,
+                'fasta_filenames_to_add': list(self.fasta_filenames_to_add),
+                'all_fasta_filename': self.all_fasta_filename,
+                'root_dir': self.root_dir,
+                'changes': set(self.changes),
+                'qv_prob_threshold': self.qv_prob_threshold}
+
     def write_pickle(self, pickle_filename):
         """Write an instance of IceIterative to a pickle file."""
         with open(pickle_filename, 'w') as f:
             d = {'uc': self.uc,
-                 'd': self.d,
+                 'd': self.d.to_dict(),
                  'refs': self.refs,
-                 'ccs_fofn': self.ccs_fofn,
-                 'fasta_filename': self.fasta_filename,
-                 'fasta_filenames_to_add': self.fasta_filenames_to_add,
-                 'all_fasta_filename': self.all_fasta_filename,
-                 'root_dir': self.root_dir,
-                 'newids': self.newids,
-                 'changes': self.changes,
-                 'qv_prob_threshold': self.qv_prob_threshold}
+                 'newids': self.newids}
+            d.update(self._small_state())
             if pickle_filename.endswith(".json"):
                 f.write(json.dumps(d))
             else:
@@ -410,10 +424,52 @@ class IceIterative(IceFiles):
                           'sge_opts': self.sge_opts})
                 cPickle.dump(d, f)
 
+    def checkpoint(self):
+        """
+        Append changes of uc, d, refs and newids since the last checkpoint
+        to the checkpoint log, or write a full snapshot once in a while.
+        ICE can be picked up from self.checkpointPrefix.
+        """
+        if not self._ckpt_written or self.checkpointer.needs_snapshot():
+            self.add_log("Writing checkpoint snapshot " +
+                         self.checkpointer.snapshot_filename)
+            state = {'uc': self.uc,
+                     'd': self.d.to_dict(),
+                     'refs': self.refs,
+                     'newids': self.newids,
+                     'ice_opts': self.ice_opts,
+                     'sge_opts': self.sge_opts}
+            state.update(self._small_state())
+            self.checkpointer.write_snapshot(state)
+            self.d.pop_dirty()
+        else:
+            delta = self._small_state()
+            delta['uc'] = dict((cid, list(self.uc[cid]) if cid in self.uc else None)
+                               for cid in self._ckpt_cids)
+            delta['refs'] = dict((cid, self.refs.get(cid))
+                                 for cid in self._ckpt_cids)
+            delta['d'] = dict((qid, dict(self.d[qid]) if qid in self.d else None)
+                              for qid in self.d.pop_dirty())
+            if self._ckpt_newids_changed:
+                delta['newids'] = set(self.newids)
+            self.add_log("Appending checkpoint of {u} clusters, {r} reads.".
+                         format(u=len(delta['uc']), r=len(delta['d'])))
+            self.checkpointer.append(delta)
+
+        self._ckpt_written = True
+        self._ckpt_cids = set()
+        self._ckpt_newids_changed = False
+
+    def cluster_changed(self, cid):
+        """Record that members or ref of cluster cid have changed since
+        the last checkpoint."""
+        self._ckpt_cids.add(cid)
+
     def make_new_cluster(self):
         """Add a new cluster to self.uc."""
         best_i = max(self.uc.keys()) + 1
         self.uc[best_i] = []
+        self.cluster_changed(best_i)
         return best_i
 
     def remove_from_cluster(self, qID, from_i):
@@ -422,6 +478,7 @@ class IceIterative(IceFiles):
         delete this cluster if it is empty.
         """
         self.uc[from_i].remove(qID)
+        self.cluster_changed(from_i)
         self.changes.add(from_i)
         if len(self.uc[from_i]) == 0:
             self.delete_cluster(from_i)
@@ -436,10 +493,9 @@ class IceIterative(IceFiles):
         """
         self.add_log("Deleting cluster %s" % from_i)
         del self.uc[from_i]
-        for k in self.d:
-            if from_i in self.d[k]:
-                del self.d[k][from_i]
+        self.d.delete_cluster(from_i)
         del self.refs[from_i]
+        self.cluster_changed(from_i)
 
         dirname = self.cluster_dir(from_i)
         #op.join(self.tmp_dir, str(from_i/10000), 'c'+str(from_i))
@@ -460,7 +516,7 @@ class IceIterative(IceFiles):
                 for x in members:
                     if cid not in self.d[x]:
                         return False
-                    if self.d[x][cid] != max(self.d[x].itervalues()):
+                    if self.d[x][cid] != self.d.max_prob(x):
                         return False
         return True
 
@@ -649,6 +705,7 @@ class IceIterative(IceFiles):
         #self.add_log(msg, level=logging.INFO)
         for cid in cids:
             self.refs[cid] = self.choose_ref_file(cid)
+            self.cluster_changed(cid)
             #msg = "Choosing ref file for {cid} = {f}".format(
             #    cid=cid, f=self.refs[cid])
             #self.add_log(msg)
@@ -692,16 +749,12 @@ class IceIterative(IceFiles):
 
     def clean_prob_for_cids(self, cids):
         """
-        Takes |qIDs| x |cIds| time....
+        Takes time proportional to number of probs to cids.
 
         For every d[qID][cID] such that qID is in self.newids
         and cID is in cids, delete it
         """
-        for qid in self.newids:
-            # msg = "cleaning prob for {qid}".format(qid=qid)
-            # self.add_log(msg)
-            for cid in set(cids).intersection(self.d[qid]):
-                del self.d[qid][cid]
+        self.d.clean(qids=self.newids, cids=cids)
 
     def final_round_before_freeze(self, min_cluster_size):
         """
@@ -726,7 +779,7 @@ class IceIterative(IceFiles):
             for qid in self.uc[cid]:
                 if (n < min_cluster_size or
                         cid not in self.d[qid] or
-                        self.d[qid][cid] != max(self.d[qid].itervalues())):
+                        self.d[qid][cid] != self.d.max_prob(qid)):
                     msg = "Final round: remove {0} (from {1}) because {2}".\
                         format(qid, cid, self.d[qid])
                     self.add_log(msg)
@@ -768,9 +821,7 @@ class IceIterative(IceFiles):
             if len(self.d[sid]) == 0:  # no match to existing cluster
                 orphan.append(sid)
             else:
-                best = self.d[sid].items()
-                best.sort(key=lambda x: x[1], reverse=True)
-                cid = best[0][0]
+                cid = self.d.best_cluster(sid)[0]
                 r = self.seq_dict[sid]
                 msg = "adding {0} to c{1}".format(sid, cid)
                 self.add_log(msg)
@@ -781,6 +832,7 @@ class IceIterative(IceFiles):
                     # the in.fasta along with the whole folder
                     self.changes.add(cid)
                 self.uc[cid].append(r.name.split()[0])
+                self.cluster_changed(cid)
         return orphan
 
     def add_uc(self, uc):
@@ -792,6 +844,7 @@ class IceIterative(IceFiles):
         for k, v in uc.iteritems():
             cid = k + i
             self.uc[cid] = v
+            self.cluster_changed(cid)
             self.changes.add(cid)
             # even if it's a size-1/2 cluster, it still needs to
             # be in changes for the dir to be created
@@ -820,6 +873,11 @@ class IceIterative(IceFiles):
         """
         Dump all consensus file to ref_consensus.fasta
         --> run DALIGNER (used to be BLASR) and get probs
+
+        Only consensus sequences of changed clusters are written and
+        realigned, probs of unchanged clusters in self.d are kept.
+        Dazz db of self.fasta_filename is only rebuilt when the file
+        has changed (e.g., when a new batch is added).
         """
         # make the consensus file & SA
         _todo = set(self.uc.keys()) if force_calc else self.changes
@@ -845,7 +903,9 @@ class IceIterative(IceFiles):
                                     target_filename=real_upath(self.refConsensusFa),
                                     query_converted=False, target_converted=False,
                                     is_FL=True, same_strand_only=True,
-                                    use_sge=False, sge_opts=None, cpus=4)
+                                    use_sge=False, sge_opts=None,
+                                    cpus=self.blasr_nproc,
+                                    reuse_unchanged_query=True)
             runner.run(min_match_len=self.ice_opts.low_cDNA_size,
                        output_dir=output_dir,
                        sensitive_mode=self.ice_opts.sensitive_mode)
@@ -917,7 +977,7 @@ class IceIterative(IceFiles):
         by going through the .las.out files
         (REMEMBER to pre-clean the self.d)
         """
-        for la4ice_filename in runner.la4ice_filenames:
+        for la4ice_filename in runner.alignment_filenames:
             for hit in daligner_against_ref(query_dazz_handler=runner.query_dazz_handler,
                                             target_dazz_handler=runner.target_dazz_handler,
                                             la4ice_filename=la4ice_filename,
@@ -1032,6 +1092,7 @@ class IceIterative(IceFiles):
                         self.changes.remove(cid)
             self.calc_cluster_prob()
             self.freeze_d()
+            self.checkpoint()
             # see if there are more moves possible
             if self.no_moves_possible():
                 self.add_log("No more moves possible. Done!")
@@ -1053,14 +1114,13 @@ class IceIterative(IceFiles):
 
         for qID in self.d:
             old_i = qid_to_cid[qID]
-            x = self.d[qID].items()
-            if len(x) == 0:
+            best = self.d.best_cluster(qID)
+            if best is None:
                 # no best! move it to the orphan group
                 self.remove_from_cluster(qID, old_i)
                 orphan.append(qID)
             else:
-                x.sort(key=lambda p: p[1], reverse=True)
-                best_i, best_i_prob = x[0][0], x[0][1]
+                best_i, best_i_prob = best
                 if best_i != qid_to_cid[qID]:
                     # moving assignment from old_i to best_i
                     msg = "best for {0} is {1},{2} (currently: {3}, {4})".\
@@ -1071,6 +1131,7 @@ class IceIterative(IceFiles):
 
                     # move qID to best_i
                     self.uc[best_i].append(qID)
+                    self.cluster_changed(best_i)
 
                     # ToDo: make more flexible
                     # changes were made to from_i and best_i
@@ -1089,17 +1150,17 @@ class IceIterative(IceFiles):
                     # (to match criterion used in run_gcon_parallel)
                     # --------------------------
                     if len(self.uc[old_i]) <= 2:
-                        #x = filter(lambda (a, b): a != old_i, x)
-                        x = [y for y in x if y[0] != old_i]
-                        if len(x) > 0 and \
+                        best = self.d.best_cluster(qID, exclude=old_i)
+                        if best is not None and \
                                 random.random() <= self.random_prob:
                             # right now hard-code to 30% prob
-                            best_i, best_i_prob = x[0][0], x[0][1]
+                            best_i, best_i_prob = best
                             msg = "randomly moving {0} from {1} to {2}".\
                                 format(qID, old_i, best_i)
                             self.add_log(msg)
 
                             self.uc[best_i].append(qID)
+                            self.cluster_changed(best_i)
                             if len(self.uc[best_i]) < self.rerun_gcon_size:
                                 self.changes.add(best_i)
                             self.changes.add(old_i)
@@ -1174,6 +1235,7 @@ class IceIterative(IceFiles):
                 rid = r.name.split()[0]
                 self.d[rid] = {}
                 self.newids.add(rid)
+        self._ckpt_newids_changed = True
 
         # adding {new batch} to probQV
         # now probQV contains
@@ -1225,6 +1287,7 @@ class IceIterative(IceFiles):
                 f.write(">{0}\n{1}\n".format(sid,
                                              self.seq_dict[sid].sequence))
         self.newids.update(active_ids)
+        self._ckpt_newids_changed = True
 
         # sanity check!
         self.ensure_probQV_newid_consistency()
@@ -1246,6 +1309,7 @@ class IceIterative(IceFiles):
                 rid = r.name.split()[0]
                 if rid not in self.newids:
                     self.newids.add(rid)
+                    self._ckpt_newids_changed = True
                     #has_err = False
                     msg = "{0} should be in newids but not. Add it!".format(rid)
                     self.add_log(msg)
@@ -1303,13 +1367,11 @@ class IceIterative(IceFiles):
             self.add_log("adding file {f}".format(f=f))
             self.run_post_ICE_merging(
                 consensusFa=self.tmpConsensusFa,
-                pickleFN=self.tmpPickleFN,
                 max_iter=3,
                 use_blasr=False)
             if self.ice_opts.targeted_isoseq:
                 self.run_post_ICE_merging(
                     consensusFa=self.tmpConsensusFa,
-                    pickleFN=self.tmpPickleFN,
                     max_iter=6,
                     use_blasr=True)
             # out_prefix='output/tmp',
@@ -1323,14 +1385,13 @@ class IceIterative(IceFiles):
             self.write_consensus(self.uptoConsensusFa(f))
             #'output/upto_'+f+'.consensus.fasta')
 
-    def run_post_ICE_merging(self, consensusFa, pickleFN, max_iter, use_blasr):
+    def run_post_ICE_merging(self, consensusFa, max_iter, use_blasr):
         """
-        (1) write pickle/consensus file
+        (1) write checkpoint/consensus file
         (2) find mergeable clusters
         (3) run gcon on all merged clusters
         """
         consensus_filename = consensusFa
-        pickle_filename = pickleFN
         # this is just back up for debugging purpose
         self.add_log("run_post_ICE_merging called with max_iter={0}, using_blasr={1}".format(max_iter, use_blasr))
         for _i in xrange(max_iter):
@@ -1338,8 +1399,8 @@ class IceIterative(IceFiles):
             self.add_log("Running post-iterative-merging iterate {n}".
                          format(n=_i), level=logging.INFO)
             self.changes = set()
-            self.add_log("Writing pickle file: " + pickle_filename)
-            self.write_pickle(pickle_filename)
+            self.add_log("Writing checkpoint: " + self.checkpointPrefix)
+            self.checkpoint()
 
             self.add_log("Writing consensus file: " + consensus_filename)
             self.write_consensus(consensus_filename)
@@ -1372,14 +1433,17 @@ class IceIterative(IceFiles):
                                     target_filename=real_upath(fasta_filename),
                                     is_FL=True, same_strand_only=True,
                                     query_converted=False, target_converted=False,
-                                    use_sge=False, sge_opts=None, cpus=4)
+                                    use_sge=False, sge_opts=None,
+                                    cpus=self.blasr_nproc)
             # run this locally
             runner.run(min_match_len=self.ice_opts.low_cDNA_size,
                        output_dir=output_dir,
                        sensitive_mode=self.ice_opts.sensitive_mode)
 
-            for la4ice_filename in runner.la4ice_filenames:
-                for r in LA4IceReader(la4ice_filename):
+            for la4ice_filename in runner.alignment_filenames:
+                for r in daligner_alignment_reader(la4ice_filename,
+                                                   runner.query_dazz_handler,
+                                                   runner.query_dazz_handler):
                     r.qID = runner.query_dazz_handler[r.qID]
                     r.sID = runner.query_dazz_handler[r.sID]
                     if possible_merge(r=r, ece_penalty=self.ece_penalty, ece_min_len=self.ece_min_len):
@@ -1430,6 +1494,7 @@ class IceIterative(IceFiles):
                 k = self.old_rec[i]
                 self.add_log("case 1: Merging clusters {0} and {1} --> {2}".format(i, j, k))
                 self.uc[k] += self.uc[j]
+                self.cluster_changed(k)
                 self.delete_cluster(j)
                 self.freeze_d([k])  # k is already in self.changes, and i is already deleted
                 self.old_rec[j] = k
@@ -1439,6 +1504,7 @@ class IceIterative(IceFiles):
                 k = self.old_rec[j]
                 self.add_log("case 2: Merging clusters {0} and {1} --> {2}".format(i, j, k))
                 self.uc[k] += self.uc[i]
+                self.cluster_changed(k)
                 self.delete_cluster(i)
                 self.freeze_d([k])  # k is already in self.changes, and j is already deleted
                 self.old_rec[i] = k
@@ -1447,6 +1513,7 @@ class IceIterative(IceFiles):
                 k = self.make_new_cluster()
                 self.add_log("case 3: Merging clusters {0} and {1} --> {2}".format(i, j, k))
                 self.uc[k] = self.uc[i] + self.uc[j]
+                self.cluster_changed(k)
                 self.delete_cluster(i)
                 self.delete_cluster(j)
                 self.freeze_d([k])
@@ -1501,14 +1568,12 @@ class IceIterative(IceFiles):
         msg = "Merging clusters."
         self.add_log(msg, level=logging.INFO)
         self.run_post_ICE_merging(consensusFa=self.tmpConsensusFa,
-                                  pickleFN=self.tmpPickleFN,
                                   max_iter=3,
                                   use_blasr=False)
 
         # run extra rounds using BLASR
         if self.ice_opts.targeted_isoseq:
             self.run_post_ICE_merging(consensusFa=self.tmpConsensusFa,
-                                      pickleFN=self.tmpPickleFN,
                                       max_iter=3,
                                       use_blasr=True)
 
@@ -1520,6 +1585,7 @@ class IceIterative(IceFiles):
         self.random_prob = 0.01
 
         self.newids = set() # set to empty so freeze_d() will do the right thing
+        self._ckpt_newids_changed = True
 
         for _i in xrange(3):
             self.add_log("run_for_new_batch iteration {n}".format(n=_i),
@@ -72,7 +72,7 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
                                    ccs_fofn=None,
                                    done_filename=None,
                                    use_finer_qv=False,
-                                   cpus=24,
+                                   cpus=None,
                                    no_qv_or_aln_checking=True,
                                    tmp_dir=None):
     """
@@ -88,6 +88,8 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
     ccs_fofn --- If None, assume no quality value is available,
     otherwise, use QV from ccs_fofn.
 
+    cpus --- number of cpus to run daligner, None: all available cpus.
+
     tmp_dir - where to save intermediate files such as dazz files.
               if None, writer dazz files to the same directory as query/target.
     """
@@ -139,7 +141,7 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
     seen = set()  # reads seen
     logging.info("Building uc from DALIGNER hits.")
 
-    for la4ice_filename in runner.la4ice_filenames:
+    for la4ice_filename in runner.alignment_filenames:
         start_t = time.time()
         hitItems = daligner_against_ref(query_dazz_handler=runner.query_dazz_handler,
                                         target_dazz_handler=runner.target_dazz_handler,
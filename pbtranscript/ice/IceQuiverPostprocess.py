@@ -121,7 +121,6 @@ import logging
 import os.path as op
 from collections import defaultdict
 from cPickle import load
-from time import sleep
 
 from pbcore.io import FastaWriter, FastqReader, FastqWriter
 
@@ -132,6 +131,7 @@ from pbtranscript.PBTranscriptOptions import \
     add_cluster_summary_report_arguments, _wrap_parser # FIXME
 from pbtranscript.Utils import phred_to_qv, as_contigset, \
     get_all_files_in_dir, ln, nfs_exists
+from pbtranscript.JobNotifier import FileWatcher
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceUtils import cid_with_annotation
 from pbtranscript.ice.__init__ import ICE_QUIVER_PY
@@ -434,8 +434,10 @@ class IceQuiverPostprocess(IceFiles):
             return -1
         elif self.use_sge is True:
             while job_stats != "DONE":
-                self.add_log("Sleeping for 180 seconds.")
-                sleep(180)
+                self.add_log("Waiting for quiver outputs for at most 180 seconds.")
+                # wake up as soon as a quivered fastq is written
+                with FileWatcher([self.quivered_dir]) as watcher:
+                    watcher.wait(timeout=180)
                 job_stats = self.check_quiver_jobs_completion()
                 if job_stats == "DONE":
                     break
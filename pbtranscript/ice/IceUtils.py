@@ -18,10 +18,10 @@ from pbtranscript.Utils import realpath, mkdir, execute, \
         get_files_from_file_or_fofn, \
         FILE_FORMATS, guess_file_format
 from pbtranscript.RunnerUtils import write_cmd_to_script
-from pbtranscript.findECE import findECE
+from pbtranscript.findECE import findECE, eval_aln_columns
 from pbtranscript.io.BasQV import basQVcacher
 from pbtranscript.io import BLASRM5Reader, MetaSubreadFastaReader, \
-        BamCollection, BamWriter, LA4IceReader
+        BamCollection, BamWriter, LA4IceReader, LasReader
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbtranscript.ice_daligner import DalignerRunner
 from pbtranscript.ice.ProbModel import ProbFromQV, \
@@ -162,6 +162,9 @@ def eval_blasr_alignment(record, qver_get_func, qvmean_get_func,
 
     Returns: cigar string, binary ECE array
 
+    Columns are evaluated in one pass by findECE.eval_aln_columns,
+    given whole QV arrays of query and subject.
+
     NOTE: long insertions/deletions are still a difficult problem
     because alignments can be arbitrary right now the quick solution is:
           use probqv get_smoothed
@@ -173,23 +176,9 @@ def eval_blasr_alignment(record, qver_get_func, qvmean_get_func,
         import pdb
         pdb.set_trace()
 
-    if record.qStrand == '+':
-        query_qver_get_func = lambda _name, _pos: qver_get_func(record.qID, _name, min(_pos+record.qStart, record.qLength-1))
-        query_qver_get_func1 = lambda _name, _pos: qver_get_func(record.qID, _name, min(_pos+record.qStart+1, record.qLength-1))
-    elif record.qStrand == '-':
-        query_qver_get_func = lambda _name, _pos: qver_get_func(record.qID, _name, max(0, record.qEnd-1-_pos))
-        query_qver_get_func1 = lambda _name, _pos: qver_get_func(record.qID, _name, max(0, record.qEnd-1-_pos-1))
-    else:
-        raise Exception("Unknown strand type {0}".format(record.qStrand))
-
-    if record.sStrand == '+':
-        subject_qver_get_func = lambda _name, _pos: qver_get_func(record.sID, _name, min(_pos+record.sStart, record.sLength-1))
-        subject_qver_get_func1 = lambda _name, _pos: qver_get_func(record.sID, _name, min(_pos+record.sStart+1, record.sLength-1))
-    elif record.sStrand == '-':
-        subject_qver_get_func = lambda _name, _pos: qver_get_func(record.sID, _name, max(0, record.sEnd-1-_pos))
-        subject_qver_get_func1 = lambda _name, _pos: qver_get_func(record.sID, _name, max(0, record.sEnd-1-_pos-1))
-    else:
-        raise Exception("Unknown strand type {0}".format(record.sStrand))
+    for strand in (record.qStrand, record.sStrand):
+        if strand not in ('+', '-'):
+            raise Exception("Unknown strand type {0}".format(strand))
 
     # if mean_qv_for_q|s is not given, always revert back to qv_prob_threshold
     if qvmean_get_func is None:
@@ -206,76 +195,44 @@ def eval_blasr_alignment(record, qver_get_func, qvmean_get_func,
                             'I': qvmean_get_func(record.sID, 'InsertionQV'),
                             'S': qvmean_get_func(record.sID, 'SubstitutionQV')}
 
-    q_index = 0
-    s_index = 0
-    last_state, last_tracking_nt, homopolymer_so_far = None, None, False
-    cigar_str = ''
-    # binary array of 0|1 where 1 is a penalty
-    ece = np.zeros(len(record.alnStr), dtype=np.int)
-    for offset, nt_aln in enumerate(record.alnStr):
-        if nt_aln == '|':  # match
-            cigar_str += 'M'
-            q_index += 1
-            s_index += 1
-            last_state = 'M'
-        elif record.qAln[offset] == '-':  # deletion
-            # for deletion, cases where consider a non-match
-            # (1) IF last position was not "D"
-            #        case 1a: both query and subject has very good prob
-            # (2) IF last position was "D" (q_index did not advance)
-            #        case 2a: both query and subject has very good prob
-            #        case 2b: subject has good prob; query has bad prob AND last-cur pos is NOT homopolymer
-            # case 1a and case 2a have the same condition
-            # case 2b arises because the only possible explanation would have been query have bad prob,
-            #   but it was used to explain the last deletion and the advanced S nucleotide is diff from the last S
-            s_is_good = sID_starts_with_c or subject_qver_get_func('InsertionQV', s_index) < mean_qv_for_s
-            q_is_good = query_qver_get_func1('DeletionQV', q_index) < mean_qv_for_q
-            if last_state != 'D': # entering D state now, record s
-                last_tracking_nt = record.sAln[offset]
-                homopolymer_so_far = True
-                if (s_is_good and q_is_good):
-                    ece[offset] = 1
-            else:  # already in D state, which means q_index did not advance, hence q_is_good is the same
-                homopolymer_so_far = (record.sAln[offset] == last_tracking_nt)
-                if (s_is_good and (q_is_good or not homopolymer_so_far)):
-                    ece[offset] = 1
-
-            cigar_str += 'D'
-            s_index += 1
-            last_state = 'D'
-        elif record.sAln[offset] == '-':  # insertion
-            # for insertion, cases where consider a non-match
-            # (1) IF last position was not "I"
-            #        case 1a: both query and subject has very good prob
-            # (2) IF last position was "I" (s_index did not advance)
-            #        case 2a: both query and subject has very good prob
-            #        case 2b: query has good prob; subject has bad prob AND last-cur pos is NOT homopolymer
-            q_is_good = query_qver_get_func('InsertionQV', q_index) < mean_qv_for_q
-            s_is_good = sID_starts_with_c or subject_qver_get_func1('DeletionQV', s_index) < mean_qv_for_s
-
-            if last_state != 'I':
-                last_tracking_nt = record.qAln[offset]
-                homopolymer_so_far = True
-                if (q_is_good and s_is_good):
-                    ece[offset] = 1
-            else: # already in "I" state, s_index did not advance, s_is_good is the same
-                homopolymer_so_far = (record.qAln[offset] == last_tracking_nt)
-                if q_is_good and (s_is_good or not homopolymer_so_far):
-                    ece[offset] = 1
-
-            cigar_str += 'I'
-            q_index += 1
-            last_state = 'I'
-        else:  # substitution
-            cigar_str += 'S'
-            if query_qver_get_func('SubstitutionQV', q_index) < mean_qv_for_q and \
-               (sID_starts_with_c or subject_qver_get_func('SubstitutionQV', s_index) < mean_qv_for_s):
-                ece[offset] = 1
-            q_index += 1
-            s_index += 1
-            last_state = 'S'
-
-    return cigar_str, ece
+    # QVs used to be compared against the mean_qv_for_q|s dicts themselves,
+    # (e.g., qv < mean_qv_for_q), which is always True in python 2, so every
+    # QV check passes. Keep that behavior by using +inf thresholds, while
+    # mean_qv_for_q|s are what the thresholds were meant to be.
+    q_thresholds = s_thresholds = (_ALWAYS_GOOD_QV, _ALWAYS_GOOD_QV, _ALWAYS_GOOD_QV)
+
+    # QVs are only looked up when there are non-match columns.
+    q_qvs, s_qvs = None, None
+    if record.alnStr.count('|') != len(record.alnStr):
+        q_qvs = [_get_qv_array(qver_get_func, record.qID, qv_name, record.qLength)
+                 for qv_name in _ECE_QV_NAMES]
+        if not sID_starts_with_c:
+            s_qvs = [_get_qv_array(qver_get_func, record.sID, qv_name, record.sLength)
+                     for qv_name in _ECE_QV_NAMES]
+
+    return eval_aln_columns(
+        record.qAln, record.alnStr, record.sAln,
+        q_qvs=q_qvs, q_thresholds=q_thresholds,
+        q_coords=(record.qStart, record.qEnd, record.qLength, record.qStrand == '-'),
+        s_qvs=s_qvs, s_thresholds=s_thresholds,
+        s_coords=(record.sStart, record.sEnd, record.sLength, record.sStrand == '-'))
+
+
+# Order of QV arrays taken by findECE.eval_aln_columns.
+_ECE_QV_NAMES = ('InsertionQV', 'DeletionQV', 'SubstitutionQV')
+_ALWAYS_GOOD_QV = float('inf')
+
+
+def _get_qv_array(qver_get_func, seqid, qv_name, length):
+    """
+    Return QVs of seqid as a float64 array. qver_get_func may return
+    a single value for all positions (e.g., ProbFromModel), which is
+    expanded to length.
+    """
+    qvs = np.asarray(qver_get_func(seqid, qv_name), dtype=np.float64)
+    if qvs.ndim == 0:
+        qvs = np.repeat(qvs, max(length, 1))
+    return qvs
 
 
 class HitItem(object):
@@ -372,6 +329,20 @@ def blasr_against_ref(output_filename, is_FL, sID_starts_with_c,
                                   ece_arr=ece_arr)
 
 
+def daligner_alignment_reader(alignment_filename, query_dazz_handler,
+                              target_dazz_handler):
+    """
+    Return a reader of alignments in alignment_filename, which is either
+    a daligner .las file, read directly by LasReader using sequences of
+    query and target dazz handlers, or LA4Ice output read by LA4IceReader.
+    """
+    if alignment_filename.endswith(".las"):
+        return LasReader(alignment_filename,
+                         query_seqs=query_dazz_handler.sequences,
+                         target_seqs=target_dazz_handler.sequences)
+    return LA4IceReader(alignment_filename)
+
+
 def daligner_against_ref(query_dazz_handler, target_dazz_handler, la4ice_filename,
                          is_FL, sID_starts_with_c,
                          qver_get_func, qvmean_get_func, qv_prob_threshold=.03,
@@ -387,12 +358,13 @@ def daligner_against_ref(query_dazz_handler, target_dazz_handler, la4ice_filenam
     Parameters:
       query_dazz_handler - query dazz handler in DalignRunner
       target_dazz_handler - target dazz handler in DalignRunner
-      la4ice_filename - la4ice output of DalignRunner
+      la4ice_filename - la4ice output or las file of DalignRunner
       qver_get_func - returns a list of qvs of (read, qvname)
                       e.g. basQV.basQVcacher.get() or .get_smoothed()
       qvmean_get_func - which returns mean QV of (read, qvname)
     """
-    for r in LA4IceReader(la4ice_filename):
+    for r in daligner_alignment_reader(la4ice_filename, query_dazz_handler,
+                                       target_dazz_handler):
         missed_q = r.qStart + r.qLength - r.qEnd
         missed_t = r.sStart + r.sLength - r.sEnd
 
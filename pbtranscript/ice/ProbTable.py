@@ -0,0 +1,534 @@
+"""
+Define ProbTable, a sparse table of read-to-cluster log probabilities,
+which is IceIterative.d.
+
+ProbTable behaves like the dict of dicts it replaces,
+    qid --> {cid: log P(qid|cid)},
+so that d[qid][cid] = prob, del d[qid][cid], d[qid].items() etc. still
+work, while it also maintains a reverse index
+    cid --> set of qids which have a prob to cid,
+so that deleting a cluster or cleaning probs of a few clusters takes
+time proportional to the number of entries of these clusters, instead
+of scanning every read. The max prob of every read is kept up to date
+as probs change, so that d.max_prob(qid) takes constant time.
+
+The table can be exported to CSR arrays (qids, indptr, cids, probs),
+used for vectorized per-read maximums, and saved to / loaded from .npy
+files which can be memory-mapped.
+
+Example:
+    d = ProbTable()
+    d['read1'] = {}
+    d['read1'][0] = -10.
+    d['read1'][2] = -5.
+    d.qids_of(2)          ==> set(['read1'])
+    d.best_cluster('read1') ==> (2, -5.)
+    d.max_prob('read1')   ==> -5.
+    d.delete_cluster(2)
+    d.save('probs')
+    qids, indptr, cids, probs = ProbTable.load_csr('probs', mmap=True)
+    d = ProbTable.load('probs')
+"""
+
+import os.path as op
+import cPickle
+from array import array
+from itertools import chain
+import numpy as np
+
+__all__ = ["ProbTable"]
+
+NEG_INF = float('-inf')
+
+
+class _ProbRow(object):
+
+    """
+    A dict-like view of probs of a read, cid --> prob, stored in the
+    entry arrays of the table that owns this row.
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __reduce__(self):
+        # pickle as a plain dict
+        return (dict, (dict(self.iteritems()),))
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __eq__(self, other):
+        if isinstance(other, (_ProbRow, dict)):
+            return dict(self.iteritems()) == dict(other.iteritems())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __len__(self):
+        return self._table._row_len[self._row]
+
+    def __contains__(self, cid):
+        return self._table._find(self._row, cid) >= 0
+
+    def __getitem__(self, cid):
+        slot = self._table._find(self._row, cid)
+        if slot < 0:
+            raise KeyError(cid)
+        return self._table._prob[slot]
+
+    def __setitem__(self, cid, prob):
+        self._table._set(self._row, cid, prob)
+
+    def __delitem__(self, cid):
+        slot = self._table._find(self._row, cid)
+        if slot < 0:
+            raise KeyError(cid)
+        self._table._remove_slot(slot)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterslots(self):
+        """Iterate over entry slots of this row, in order of insertion."""
+        rnext = self._table._rnext
+        slot = self._table._row_head[self._row]
+        while slot >= 0:
+            nxt = rnext[slot]
+            yield slot
+            slot = nxt
+
+    def iterkeys(self):
+        """Iterate over cids."""
+        cid = self._table._cid
+        return (cid[slot] for slot in self.iterslots())
+
+    def itervalues(self):
+        """Iterate over probs."""
+        prob = self._table._prob
+        return (prob[slot] for slot in self.iterslots())
+
+    def iteritems(self):
+        """Iterate over (cid, prob)."""
+        cid, prob = self._table._cid, self._table._prob
+        return ((cid[slot], prob[slot]) for slot in self.iterslots())
+
+    def keys(self):
+        """Return a list of cids."""
+        return list(self.iterkeys())
+
+    def values(self):
+        """Return a list of probs."""
+        return list(self.itervalues())
+
+    def items(self):
+        """Return a list of (cid, prob)."""
+        return list(self.iteritems())
+
+    def get(self, cid, default=None):
+        """Return prob of cid, or default."""
+        slot = self._table._find(self._row, cid)
+        return self._table._prob[slot] if slot >= 0 else default
+
+    def update(self, *args, **kwargs):
+        """Set probs of cids, like dict.update."""
+        for cid, prob in dict(*args, **kwargs).iteritems():
+            self[cid] = prob
+
+    def setdefault(self, cid, prob=None):
+        """Like dict.setdefault."""
+        if cid not in self:
+            self[cid] = prob
+        return self[cid]
+
+    def pop(self, cid, *default):
+        """Like dict.pop."""
+        slot = self._table._find(self._row, cid)
+        if slot < 0:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(cid)
+        prob = self._table._prob[slot]
+        self._table._remove_slot(slot)
+        return prob
+
+    def clear(self):
+        """Delete all probs of this row."""
+        for slot in list(self.iterslots()):
+            self._table._remove_slot(slot)
+
+    def max(self):
+        """Return the max prob of this row, or None if it is empty."""
+        return self._table._row_max[self._row] if len(self) > 0 else None
+
+
+class ProbTable(object):
+
+    """
+    A sparse table of probs, qid --> {cid: prob}.
+
+    Every (qid, cid, prob) entry is a slot in parallel arrays, rows of
+    qids and cids, and probs as float64. Entries of a row and entries of
+    a cluster are doubly linked lists through the slots (rnext/rprev,
+    cnext/cprev), so that both d[qid] and the reverse index cid --> qids
+    are walked without per-entry python objects. Slots of deleted
+    entries are chained into a free list through rnext and reused.
+
+    Per row, the table keeps the number of entries, the max prob, which
+    is updated as entries change, and a dirty flag, set when probs of the
+    row change and cleared by pop_dirty().
+    """
+
+    def __init__(self, d=None):
+        """d --- a dict of qid --> {cid: prob}, e.g., loaded from pickle."""
+        # per entry slot
+        self._erow = array('l')   # row of entry, or -1 if free
+        self._cid = array('l')
+        self._prob = array('d')
+        self._rnext = array('l')  # next entry in row, or next free slot
+        self._rprev = array('l')
+        self._cnext = array('l')  # next entry of the same cid
+        self._cprev = array('l')
+        self._free_slot = -1
+        # per row
+        self._qids = []           # row --> qid, or None if free
+        self._row_of = {}         # qid --> row
+        self._row_head = array('l')
+        self._row_tail = array('l')
+        self._row_len = array('l')
+        self._row_max = array('d')
+        self._row_dirty = array('b')
+        self._free_rows = []
+        self._removed = set()     # qids deleted since pop_dirty()
+        # per cid
+        self._cid_head = {}       # cid --> first entry
+        self._cid_len = {}        # cid --> number of entries
+        self._nnz = 0
+        if d is not None:
+            for qid, probs in d.iteritems():
+                self[qid] = probs
+
+    @classmethod
+    def from_dict(cls, d):
+        """Return d if d is a ProbTable, otherwise convert d."""
+        if isinstance(d, ProbTable):
+            return d
+        return cls(d)
+
+    def to_dict(self):
+        """Return probs as a plain dict of dicts, e.g., for json."""
+        return dict((qid, dict(row.iteritems())) for qid, row in self.iteritems())
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    # ------------ entry arrays ------------
+    def _new_row(self, qid):
+        """Add an empty row for qid, return its index."""
+        if len(self._free_rows) > 0:
+            row = self._free_rows.pop()
+            self._qids[row] = qid
+        else:
+            row = len(self._qids)
+            self._qids.append(qid)
+            self._row_head.append(-1)
+            self._row_tail.append(-1)
+            self._row_len.append(0)
+            self._row_max.append(NEG_INF)
+            self._row_dirty.append(0)
+        self._row_of[qid] = row
+        self._row_head[row] = self._row_tail[row] = -1
+        self._row_len[row] = 0
+        self._row_max[row] = NEG_INF
+        self._row_dirty[row] = 1
+        return row
+
+    def _find(self, row, cid):
+        """Return slot of (row, cid), or -1."""
+        slot = self._row_head[row]
+        while slot >= 0 and self._cid[slot] != cid:
+            slot = self._rnext[slot]
+        return slot
+
+    def _set(self, row, cid, prob):
+        """Set prob of (row, cid)."""
+        self._row_dirty[row] = 1
+        slot = self._find(row, cid)
+        if slot >= 0:
+            old = self._prob[slot]
+            self._prob[slot] = prob
+            if prob >= self._row_max[row]:
+                self._row_max[row] = prob
+            elif old == self._row_max[row]:
+                self._update_row_max(row)
+            return
+
+        if self._free_slot >= 0:
+            slot = self._free_slot
+            self._free_slot = self._rnext[slot]
+            self._erow[slot], self._cid[slot], self._prob[slot] = row, cid, prob
+        else:
+            slot = len(self._erow)
+            self._erow.append(row)
+            self._cid.append(cid)
+            self._prob.append(prob)
+            self._rnext.append(-1)
+            self._rprev.append(-1)
+            self._cnext.append(-1)
+            self._cprev.append(-1)
+        # append to the end of row
+        tail = self._row_tail[row]
+        self._rprev[slot], self._rnext[slot] = tail, -1
+        if tail >= 0:
+            self._rnext[tail] = slot
+        else:
+            self._row_head[row] = slot
+        self._row_tail[row] = slot
+        self._row_len[row] += 1
+        if prob > self._row_max[row] or self._row_len[row] == 1:
+            self._row_max[row] = prob
+        # prepend to entries of cid
+        head = self._cid_head.get(cid, -1)
+        self._cprev[slot], self._cnext[slot] = -1, head
+        if head >= 0:
+            self._cprev[head] = slot
+        self._cid_head[cid] = slot
+        self._cid_len[cid] = self._cid_len.get(cid, 0) + 1
+        self._nnz += 1
+
+    def _remove_slot(self, slot):
+        """Delete entry at slot."""
+        row, cid = self._erow[slot], self._cid[slot]
+        self._row_dirty[row] = 1
+        # unlink from row
+        prv, nxt = self._rprev[slot], self._rnext[slot]
+        if prv >= 0:
+            self._rnext[prv] = nxt
+        else:
+            self._row_head[row] = nxt
+        if nxt >= 0:
+            self._rprev[nxt] = prv
+        else:
+            self._row_tail[row] = prv
+        self._row_len[row] -= 1
+        if self._prob[slot] == self._row_max[row]:
+            self._update_row_max(row)
+        # unlink from cid
+        prv, nxt = self._cprev[slot], self._cnext[slot]
+        if prv >= 0:
+            self._cnext[prv] = nxt
+        elif nxt >= 0:
+            self._cid_head[cid] = nxt
+        if nxt >= 0:
+            self._cprev[nxt] = prv
+        self._cid_len[cid] -= 1
+        if self._cid_len[cid] == 0:
+            del self._cid_len[cid]
+            del self._cid_head[cid]
+        # free slot
+        self._erow[slot] = -1
+        self._rnext[slot] = self._free_slot
+        self._free_slot = slot
+        self._nnz -= 1
+
+    def _update_row_max(self, row):
+        """Recompute the max prob of row."""
+        best = NEG_INF
+        slot = self._row_head[row]
+        while slot >= 0:
+            if self._prob[slot] > best:
+                best = self._prob[slot]
+            slot = self._rnext[slot]
+        self._row_max[row] = best
+
+    # ------------ dict interface ------------
+    def __getitem__(self, qid):
+        return _ProbRow(self, self._row_of[qid])
+
+    def __setitem__(self, qid, probs):
+        """Replace all probs of qid."""
+        probs = dict(probs.iteritems()) if isinstance(probs, _ProbRow) \
+            else dict(probs)
+        if qid in self._row_of:
+            row = self._row_of[qid]
+            _ProbRow(self, row).clear()
+        else:
+            row = self._new_row(qid)
+        self._row_dirty[row] = 1
+        for cid, prob in probs.iteritems():
+            self._set(row, cid, prob)
+
+    def __delitem__(self, qid):
+        row = self._row_of.pop(qid)
+        _ProbRow(self, row).clear()
+        self._qids[row] = None
+        self._row_dirty[row] = 0
+        self._free_rows.append(row)
+        self._removed.add(qid)
+
+    def __contains__(self, qid):
+        return qid in self._row_of
+
+    def __iter__(self):
+        return iter(self._row_of)
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def keys(self):
+        """Return all qids."""
+        return self._row_of.keys()
+
+    def iteritems(self):
+        """Iterate over (qid, {cid: prob})."""
+        return ((qid, _ProbRow(self, row)) for qid, row in self._row_of.iteritems())
+
+    def items(self):
+        """Return a list of (qid, {cid: prob})."""
+        return list(self.iteritems())
+
+    def pop_dirty(self):
+        """Return a set of qids whose probs have been modified or deleted
+        since the last call, and start tracking modifications again."""
+        dirty = np.frombuffer(self._row_dirty, dtype=np.int8) \
+            if len(self._row_dirty) > 0 else np.zeros(0, dtype=np.int8)
+        qids = set(self._qids[row] for row in np.flatnonzero(dirty))
+        qids.update(self._removed)
+        dirty[:] = 0
+        self._removed = set()
+        return qids
+
+    # ------------ reverse index ------------
+    def cids(self):
+        """Return all cids which have at least one prob."""
+        return self._cid_head.keys()
+
+    def _slots_of(self, cid):
+        """Return a list of entry slots of cluster cid."""
+        slots = []
+        slot = self._cid_head.get(cid, -1)
+        while slot >= 0:
+            slots.append(slot)
+            slot = self._cnext[slot]
+        return slots
+
+    def qids_of(self, cid):
+        """Return a set of qids which have a prob to cluster cid."""
+        return set(self._qids[self._erow[slot]] for slot in self._slots_of(cid))
+
+    def nnz(self):
+        """Return number of (qid, cid) probs."""
+        return self._nnz
+
+    def delete_cluster(self, cid):
+        """Delete all probs to cluster cid."""
+        for slot in self._slots_of(cid):
+            self._remove_slot(slot)
+
+    def clean(self, qids, cids):
+        """Delete probs of (qid, cid) for all qid in qids and cid in cids."""
+        qids = qids if isinstance(qids, (set, frozenset, dict)) else set(qids)
+        for cid in cids:
+            for slot in self._slots_of(cid):
+                if self._qids[self._erow[slot]] in qids:
+                    self._remove_slot(slot)
+
+    def max_prob(self, qid):
+        """Return the max prob of qid, or None if qid has no probs."""
+        row = self._row_of[qid]
+        return self._row_max[row] if self._row_len[row] > 0 else None
+
+    def best_cluster(self, qid, exclude=None):
+        """
+        Return (cid, prob) with the highest prob of qid, ignoring
+        cluster exclude, or None if there is no such cluster.
+        Ties are broken by insertion order of probs of qid.
+        """
+        best = None
+        for cid, prob in self[qid].iteritems():
+            if cid != exclude and (best is None or prob > best[1]):
+                best = (cid, prob)
+        return best
+
+    # ------------ columnar export ------------
+    def to_csr(self):
+        """
+        Return (qids, indptr, cids, probs), where probs of qids[i] to
+        cids[indptr[i]:indptr[i+1]] are probs[indptr[i]:indptr[i+1]].
+        """
+        qids = self._row_of.keys()
+        rows = [self._row_of[qid] for qid in qids]
+        indptr = np.zeros(len(qids) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.fromiter((self._row_len[row] for row in rows),
+                                           dtype=np.int64, count=len(rows)))
+        slots = np.fromiter(chain.from_iterable(_ProbRow(self, row).iterslots()
+                                                for row in rows),
+                            dtype=np.int64, count=int(indptr[-1]))
+        cids = np.frombuffer(self._cid, dtype=np.int_)[slots].astype(np.int64) \
+            if len(slots) > 0 else np.zeros(0, dtype=np.int64)
+        probs = np.frombuffer(self._prob, dtype=np.float64)[slots] \
+            if len(slots) > 0 else np.zeros(0, dtype=np.float64)
+        return qids, indptr, cids, probs
+
+    def max_probs(self):
+        """
+        Return a dict of qid --> max prob of qid, qids which have no
+        probs are excluded.
+        """
+        return dict((qid, self._row_max[row])
+                    for qid, row in self._row_of.iteritems()
+                    if self._row_len[row] > 0)
+
+    @staticmethod
+    def _qids_fn(prefix):
+        """Return file name of qids of a saved table."""
+        return prefix + ".qids"
+
+    @staticmethod
+    def _array_fn(prefix, name):
+        """Return file name of a CSR array of a saved table."""
+        return "{p}.{n}.npy".format(p=prefix, n=name)
+
+    def save(self, prefix):
+        """Save this table as CSR arrays to files starting with prefix.
+        cids must be integers."""
+        qids, indptr, cids, probs = self.to_csr()
+        with open(self._qids_fn(prefix), 'wb') as f:
+            cPickle.dump(qids, f, cPickle.HIGHEST_PROTOCOL)
+        for name, arr in (('indptr', indptr), ('cids', cids), ('probs', probs)):
+            np.save(self._array_fn(prefix, name), arr)
+
+    @classmethod
+    def load_csr(cls, prefix, mmap=True):
+        """
+        Return (qids, indptr, cids, probs) saved by save(prefix), arrays
+        are memory-mapped read-only if mmap is True.
+        """
+        if not op.exists(cls._qids_fn(prefix)):
+            raise IOError("ProbTable {f} does not exist.".
+                          format(f=cls._qids_fn(prefix)))
+        with open(cls._qids_fn(prefix), 'rb') as f:
+            qids = cPickle.load(f)
+        arrs = [np.load(cls._array_fn(prefix, name),
+                        mmap_mode='r' if mmap else None)
+                for name in ('indptr', 'cids', 'probs')]
+        return tuple([qids] + arrs)
+
+    @classmethod
+    def load(cls, prefix):
+        """Load a table saved by save(prefix)."""
+        qids, indptr, cids, probs = cls.load_csr(prefix, mmap=True)
+        table = cls()
+        for i, qid in enumerate(qids):
+            start, end = indptr[i], indptr[i + 1]
+            table[qid] = dict(zip(cids[start:end].tolist(),
+                                  probs[start:end].tolist()))
+        return table
@@ -36,14 +36,30 @@
 ######################################################################
 """
 Provide functions for clique finding.
+
+construct, local, local_extra and grasp search a quasi-clique in a
+scipy sparse adjacency matrix of a small graph.
+
+find_cliques finds mutually exclusive quasi-cliques of a whole graph,
+given as one CSR adjacency matrix (see adjacency_matrix, or EdgeList
+to build one from streamed edges of named nodes): seeds are
+popped from a heap of current degrees, nodes in cliques are marked in
+a bitmap, and GRASP runs on rows of the seed's unused neighbors
+(grasp_rows), without copying the neighborhood into a new graph.
+grasp_rows is compiled (see C/c_pClique.pyx) and returns the same
+clique as grasp for the same rng state.
 """
 
 #import os, re, sys, cProfile, itertools
 #from networkx import Graph
 import random
+import heapq
+from array import array
 #from bisect import bisect
+import numpy as np
 from scipy import sparse
 import logging
+from pbtranscript.ice import c_pClique
 
 random.seed(0)
 
@@ -72,9 +88,10 @@ def convert_graph_connectivity_to_sparse(G, nodes):
 #    return S,H
 
 
-def construct(S, H, alpha, starting_node):
+def construct(S, H, alpha, starting_node, rng=random):
     """
     NOTE: S is currently None, so don't use it yet
+    rng -- random number generator, e.g. random.Random(seed)
     """
     assert S is None
     Q = [starting_node] # the list of indices in the clique
@@ -97,17 +114,21 @@ def construct(S, H, alpha, starting_node):
         if len(RCL) == 0:
             logging.debug("NO FITTING RCLS")
             break
-        u = C[random.choice(RCL)]
+        u = C[rng.choice(RCL)]
         logging.debug("picking {u}".format(u=u))
 
         Q.append(u)
-        C = C[H[u, C].nonzero()[1]] # update list of candidates
+        # update list of candidates, keep them in order, since column
+        # indexing of sparse matrices may return unsorted indices
+        C = C[np.sort(H[u, C].nonzero()[1])]
         len_C = len(C)
     return Q
 
 
-def local(H, Q, gamma):
+def local(H, Q, gamma, rng=random):
     """
+    Try a (2,1)-exchange of Q, which replaces a node in Q by two nodes.
+    Return True if Q is changed in place.
     """
     n = H.shape[0]
     len_Q = len(Q)
@@ -130,7 +151,7 @@ def local(H, Q, gamma):
     y = y.toarray()
     Q_index_set = set(range(len_Q))
     choices = range(len_cand)
-    random.shuffle(choices)
+    rng.shuffle(choices)
 
     newQ = Q + [None, None]
     for v in choices:
@@ -156,7 +177,7 @@ def local(H, Q, gamma):
     return False
 
 
-def local_extra(H, Q, gamma):
+def local_extra(H, Q, gamma, rng=random):
     """Extract local nodes."""
     n = H.shape[0]
     len_Q = len(Q)
@@ -167,7 +188,7 @@ def local_extra(H, Q, gamma):
     #              i not in Q, xrange(n))
     cand = [i for i in xrange(n)
             if i not in Q and h_summed2[i] >= gamma_threshold]
-    random.shuffle(cand)
+    rng.shuffle(cand)
     while len(cand) > 0:
         x = cand.pop()
         newQ = Q + [x]
@@ -180,7 +201,7 @@ def local_extra(H, Q, gamma):
     return False
 
 
-def grasp(S, H, gamma, maxitr, given_starting_node=None):
+def grasp(S, H, gamma, maxitr, given_starting_node=None, rng=random):
     """Grasp cliques."""
     assert S is None
 
@@ -194,7 +215,7 @@ def grasp(S, H, gamma, maxitr, given_starting_node=None):
         x = [i for i in xrange(N) if H_deg[i] >= 1]  # used to be H_deg[i]>=3
         if len(x) == 0:
             return []
-        random.shuffle(x)#x.sort(key=lambda i: H_deg[i])#random.shuffle(x)
+        rng.shuffle(x)#x.sort(key=lambda i: H_deg[i])#random.shuffle(x)
         starting_node = x.pop()
     else:
         starting_node = given_starting_node
@@ -202,10 +223,10 @@ def grasp(S, H, gamma, maxitr, given_starting_node=None):
     for _k in xrange(maxitr):
         # randomly pick alpha uniformly from [0.1,0.9]
 
-        alpha = random.uniform(0.1, 0.9)
+        alpha = rng.uniform(0.1, 0.9)
         logging.debug("picked starting node {0} with alpha {1}".
             format(starting_node, alpha))
-        Q = construct(S, H, alpha, starting_node)
+        Q = construct(S, H, alpha, starting_node, rng)
         if len(Q) <= 1:
             # no valid local exchange can be done...just give up this round
             if given_starting_node is None and len(x) > 0:
@@ -215,9 +236,9 @@ def grasp(S, H, gamma, maxitr, given_starting_node=None):
             else:
                 return []
         logging.debug("before local exchange, size is {0}".format(len(Q)))
-        while local(H, Q, gamma):
+        while local(H, Q, gamma, rng):
             pass
-        local_extra(H, Q, gamma)
+        local_extra(H, Q, gamma, rng)
         logging.debug("max clique with {0} as starting node has size {1}".
             format(starting_node, len(Q)))
         if len(Q) > len(bestQ):
@@ -226,3 +247,138 @@ def grasp(S, H, gamma, maxitr, given_starting_node=None):
     return bestQ
 
 
+def adjacency_matrix(num_nodes, rows, cols):
+    """
+    Return a symmetric CSR adjacency matrix of num_nodes nodes, given
+    edges (rows[k], cols[k]). Duplicate edges and self loops are removed,
+    and column indices of each row are sorted.
+    """
+    rows = np.asarray(rows, dtype=np.int32)
+    cols = np.asarray(cols, dtype=np.int32)
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    data = np.ones(2 * len(rows), dtype=np.int8)
+    H = sparse.coo_matrix((data, (np.concatenate((rows, cols)),
+                                  np.concatenate((cols, rows)))),
+                          shape=(num_nodes, num_nodes)).tocsr()
+    H.sum_duplicates()
+    H.data[:] = 1
+    return H
+
+
+class EdgeList(object):
+    """
+    Edges of a graph of named nodes, streamed in by add_edge and kept
+    in two int32 arrays of node indices, 8 bytes per edge, instead of
+    python objects per node and per edge as in networkx.Graph.
+    Nodes are indexed in order of add_node, then of first appearance
+    in add_edge.
+    """
+    def __init__(self, names=()):
+        self.names = []         # node index --> node name
+        self.name_to_index = {} # node name --> node index
+        self.rows = array('i')
+        self.cols = array('i')
+        for name in names:
+            self.add_node(name)
+
+    def add_node(self, name):
+        """Add node name if it is new, and return its index."""
+        index = self.name_to_index.get(name)
+        if index is None:
+            index = len(self.names)
+            self.name_to_index[name] = index
+            self.names.append(name)
+        return index
+
+    def add_edge(self, a, b):
+        """Add an edge between nodes named a and b."""
+        self.rows.append(self.add_node(a))
+        self.cols.append(self.add_node(b))
+
+    def __len__(self):
+        """Return number of edges added, including duplicates."""
+        return len(self.rows)
+
+    @property
+    def num_nodes(self):
+        """Return number of nodes."""
+        return len(self.names)
+
+    def unique_edges(self):
+        """
+        Return (rows, cols) int32 arrays of unique edges, with
+        rows < cols, sorted. Self loops are removed.
+        """
+        rows = np.frombuffer(self.rows, dtype=np.intc)
+        cols = np.frombuffer(self.cols, dtype=np.intc)
+        lo, hi = np.minimum(rows, cols), np.maximum(rows, cols)
+        keep = lo != hi
+        keys = np.unique(lo[keep].astype(np.int64) * self.num_nodes + hi[keep])
+        return ((keys // self.num_nodes).astype(np.int32),
+                (keys % self.num_nodes).astype(np.int32))
+
+    def adjacency_matrix(self):
+        """Return a symmetric CSR adjacency matrix of nodes."""
+        rows, cols = self.unique_edges()
+        return adjacency_matrix(self.num_nodes, rows, cols)
+
+
+def grasp_rows(H, nodes, pos, gamma, maxitr, starting_node, rng=random):
+    """
+    grasp, given starting_node, on the subgraph of CSR adjacency matrix H
+    induced by nodes, a sorted array of node indices, where pos maps
+    node index to index in nodes or -1. Return indices in nodes of the
+    clique, the same as grasp(None, H[nodes, :][:, nodes], ...) does.
+    """
+    return c_pClique.grasp_rows(np.asarray(H.indptr, dtype=np.int32),
+                                np.asarray(H.indices, dtype=np.int32),
+                                np.asarray(nodes, dtype=np.int32),
+                                np.asarray(pos, dtype=np.int32),
+                                gamma, maxitr, starting_node, rng)
+
+
+def find_cliques(H, gamma=0.8, maxitr=5, rng=random):
+    """
+    Find mutually exclusive quasi-gamma-cliques of a graph, given its
+    symmetric CSR adjacency matrix H with sorted indices. Each node,
+    from the one with the most neighbors not in any clique yet, seeds
+    grasp on itself and those neighbors once.
+    Return a list of cliques, each a list of node indices.
+    """
+    n = H.shape[0]
+    deg = np.diff(H.indptr).astype(np.int) # number of unused neighbors
+    used = np.zeros(n, dtype=np.bool)      # nodes within any cliques
+    seeded = np.zeros(n, dtype=np.bool)
+    pos = np.empty(n, dtype=np.int32)
+    pos.fill(-1)
+
+    heap = [(-deg[i], i) for i in np.flatnonzero(deg)]
+    heapq.heapify(heap)
+    cliques = []
+    while len(heap) > 0:
+        neg_deg, node = heapq.heappop(heap)
+        if used[node] or seeded[node] or deg[node] == 0:
+            continue
+        if -neg_deg != deg[node]: # stale, degree decreased
+            heapq.heappush(heap, (-deg[node], node))
+            continue
+        seeded[node] = True
+
+        row = H.indices[H.indptr[node]:H.indptr[node+1]]
+        nodes = row[~used[row]]
+        seed_i = np.searchsorted(nodes, node)
+        nodes = np.insert(nodes, seed_i, node)
+        pos[nodes] = np.arange(len(nodes))
+        tQ = grasp_rows(H, nodes, pos, gamma=gamma, maxitr=maxitr,
+                        starting_node=seed_i, rng=rng)
+        pos[nodes] = -1
+        if len(tQ) > 0:
+            c = nodes[tQ]
+            cliques.append(c.tolist())
+            used[c] = True
+            for v in c:
+                deg[H.indices[H.indptr[v]:H.indptr[v+1]]] -= 1
+    return cliques
+
+
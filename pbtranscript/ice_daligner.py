@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 """
 Class DalignerRunner which aligns a query FASTA file and
-a target FASTA file using daligner and interpret las output
-using LA4Ice.
+a target FASTA file using daligner. las output is read directly by
+LasReader, or interpreted using LA4Ice if use_la4ice is set, which
+ice_daligner.py does unless --las_only.
 
 daligner jobs can either be submitted to SGE or run locally.
 
+When run locally, the number of concurrent daligner and LA4Ice jobs is
+planned from the number of available cpus, the number of query and
+target blocks, and available memory, see plan_local_jobs.
 """
 
 import os
@@ -13,6 +17,8 @@ import os.path as op
 import sys
 import logging
 import time
+import multiprocessing
+from collections import namedtuple
 
 from pbcore.util.ToolRunner import PBToolRunner
 
@@ -32,16 +38,106 @@ __author__ = "etseng@pacificbiosciences.com"
 #NTHREADS is hard-coded as 4 in daligner.
 DALIGNER_NUM_THREADS = 4
 
+# Approximate peak memory in bytes of a daligner job per base of its
+# query and target blocks (k-mer lists of both blocks, sorted), and of
+# a LA4Ice job per base of query and target dazz DBs.
+DALIGNER_BYTES_PER_BASE = 40
+LA4ICE_BYTES_PER_BASE = 4
+# Memory of a job is never estimated less than this.
+MIN_JOB_MEMORY = 256 * 1024 * 1024
+# Only use this fraction of available memory.
+USABLE_MEMORY_FRACTION = 0.8
+
+LocalJobPlan = namedtuple("LocalJobPlan", ["cpus", "daligner_jobs", "la4ice_jobs"])
+
+
+def available_cpus():
+    """
+    Return number of cpus this process may use, which is the number of
+    slots granted by SGE ($NSLOTS) if running as an SGE job, otherwise
+    the number of cpus of this machine.
+    """
+    try:
+        return max(1, int(os.environ["NSLOTS"]))
+    except (KeyError, ValueError):
+        pass
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def available_memory():
+    """Return available memory in bytes, or None if unknown."""
+    try:
+        with open("/proc/meminfo", 'r') as reader:
+            for line in reader:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+
+def max_concurrent_jobs(num_jobs, threads_per_job, job_memory, cpus, memory):
+    """
+    Return number of jobs to run concurrently, so that neither cpus
+    nor memory is oversubscribed, and no more than num_jobs.
+    num_jobs --- number of jobs to run
+    threads_per_job --- number of threads each job uses
+    job_memory --- estimated peak memory of each job in bytes
+    cpus --- number of cpus available
+    memory --- available memory in bytes, None if unknown
+    """
+    n = max(1, cpus // threads_per_job)
+    if memory is not None:
+        n = min(n, int(memory * USABLE_MEMORY_FRACTION) //
+                max(MIN_JOB_MEMORY, job_memory))
+    return max(1, min(n, num_jobs))
+
+
+def plan_local_jobs(num_daligner_jobs, num_la4ice_jobs,
+                    daligner_job_bases, la4ice_job_bases,
+                    cpus=None, memory=None):
+    """
+    Return a LocalJobPlan of how many daligner jobs (DALIGNER_NUM_THREADS
+    threads each) and how many LA4Ice jobs (single threaded) to run at
+    the same time.
+    num_daligner_jobs --- number of (query block, target block) pairs
+    num_la4ice_jobs --- number of LA4Ice jobs
+    daligner_job_bases --- bases of a query block plus a target block
+    la4ice_job_bases --- bases of query plus target
+    cpus --- number of cpus to use, None: available_cpus(). Never more
+             than available_cpus().
+    memory --- available memory in bytes, None: available_memory()
+    """
+    cpus = available_cpus() if cpus is None else \
+        max(1, min(cpus, available_cpus()))
+    memory = available_memory() if memory is None else memory
+    return LocalJobPlan(
+        cpus=cpus,
+        daligner_jobs=max_concurrent_jobs(
+            num_jobs=num_daligner_jobs, threads_per_job=DALIGNER_NUM_THREADS,
+            job_memory=daligner_job_bases * DALIGNER_BYTES_PER_BASE,
+            cpus=cpus, memory=memory),
+        la4ice_jobs=max_concurrent_jobs(
+            num_jobs=num_la4ice_jobs, threads_per_job=1,
+            job_memory=la4ice_job_bases * LA4ICE_BYTES_PER_BASE,
+            cpus=cpus, memory=memory))
+
+
 class DalignerRunner(object):
     """
     DalignerRunner, which aligns query FASTA file to target
-    FASTA files using daligner and interpret las output using LA4ice.
+    FASTA files using daligner, las output is read directly by LasReader,
+    or interpreted using LA4ice if use_la4ice.
     """
     def __init__(self, query_filename, target_filename,
                  is_FL, same_strand_only,
                  query_converted=False, target_converted=False,
                  dazz_dir=None, script_dir="scripts/",
-                 use_sge=False, sge_opts=None, cpus=24):
+                 use_sge=False, sge_opts=None, cpus=None, use_la4ice=False,
+                 reuse_unchanged_query=False):
         """
         Parameters:
           query_filename - query FASTA file
@@ -61,7 +157,13 @@ class DalignerRunner(object):
 
           use_sge - submit daligner jobs to sge or run them locally?
           sge_opts - sge options
-          cpus - total number of cpus that can be used to align query to target.
+          cpus - total number of cpus that can be used to align query to
+                 target when running locally, None: all available cpus.
+          use_la4ice - if True, run LA4Ice to print alignments in las files
+                       as text; otherwise skip LA4Ice, and las files should
+                       be read directly by LasReader.
+          reuse_unchanged_query - if True, reuse dazz db of query if query
+                       has not changed since it was last converted.
         """
         self.query_filename = realpath(query_filename)
         self.target_filename = realpath(target_filename)
@@ -74,7 +176,8 @@ class DalignerRunner(object):
 
         self.query_dazz_handler = DazzIDHandler(self.query_filename,
                                                 converted=query_converted,
-                                                dazz_dir=dazz_dir)
+                                                dazz_dir=dazz_dir,
+                                                reuse_if_unchanged=reuse_unchanged_query)
         # target may have already been converted (if shared)
         target_converted = (target_converted or
                             self.query_filename == self.target_filename)
@@ -87,6 +190,7 @@ class DalignerRunner(object):
 
         self.use_sge = use_sge
         self.sge_opts = sge_opts
+        self.use_la4ice = use_la4ice
 
     def query_prefix(self, i):
         """Return (possibly absolute path) prefix of query block i.
@@ -115,6 +219,29 @@ class DalignerRunner(object):
         strand = "N" if is_forward else "C"
         return "{strand}{k}".format(strand=strand, k=k)
 
+    def _bases_per_block(self, dazz_handler, num_blocks):
+        """Return approximate number of bases per block of a dazz fasta."""
+        try:
+            return op.getsize(dazz_handler.dazz_filename) // max(1, num_blocks)
+        except OSError:
+            return 0
+
+    def plan_local_jobs(self, num_la4ice_jobs, memory=None):
+        """
+        Return a LocalJobPlan of concurrent daligner and LA4Ice jobs
+        when running locally, sized by self.cpus, number of blocks and
+        available memory. Few blocks (e.g., late ICE iterations) get
+        few daligner jobs, many blocks get as many as cpus allow.
+        """
+        q_bases = self._bases_per_block(self.query_dazz_handler, self.query_blocks)
+        t_bases = self._bases_per_block(self.target_dazz_handler, self.target_blocks)
+        return plan_local_jobs(num_daligner_jobs=len(list(self._iter_i_j())),
+                               num_la4ice_jobs=num_la4ice_jobs,
+                               daligner_job_bases=q_bases + t_bases,
+                               la4ice_job_bases=q_bases * self.query_blocks +
+                               t_bases * self.target_blocks,
+                               cpus=self.cpus, memory=memory)
+
     def _iter_i_j(self):
         """Iterate over indices (query block i, target block j)."""
         for i in xrange(1, self.query_blocks + 1):
@@ -179,6 +306,12 @@ class DalignerRunner(object):
             ret.extend(self._la4ice_filenames(is_forward=False, output_dir=self.output_dir))
         return ret
 
+    @property
+    def alignment_filenames(self):
+        """Return files containing all alignments, which are la4ice
+        output files if use_la4ice, otherwise las files."""
+        return self.la4ice_filenames if self.use_la4ice else self.las_filenames
+
     def daligner_cmd(self, i, j,
                      min_match_len=300, sensitive_mode=False):
         """Return dalianger command running for query block i, target block j.
@@ -284,7 +417,8 @@ class DalignerRunner(object):
     def run(self, output_dir='.', min_match_len=300, sensitive_mode=False):
         """
         if self.use_sge --- writes to <scripts>/daligner_job_#.sh
-        else --- run locally, dividing into self.cpus/4 tasks (capped max at 4)
+        else --- run locally, number of concurrent daligner and LA4Ice
+                 jobs are planned by self.plan_local_jobs
 
         NOTE 1: when using SGE, be careful that multiple calls to this might
         end up writing to the SAME job.sh files, this should be avoided by
@@ -292,11 +426,10 @@ class DalignerRunner(object):
 
         NOTE 2: more commonly this should be invoked locally
         (since ice_partial.py i/one be qsub-ed),
-        in that case it is more recommended to keep self.cpus = 4 so that
-        each daligner job is run consecutively and that the original qsub job
-        should have been called with qsub -pe smp 4 (set by --blasr_nproc 4)
-        In this way, the daligner jobs are called consecutively, but LA4Ice
-        is parallelized 4X
+        in that case self.cpus should be the number of cpus the original
+        qsub job was granted (set by --blasr_nproc), daligner jobs
+        (4 threads each) and LA4Ice jobs (1 thread each) are then run
+        concurrently within self.cpus.
         """
         self.output_dir = realpath(output_dir) # Reset output_dir
         old_dir = realpath(op.curdir)
@@ -320,6 +453,13 @@ class DalignerRunner(object):
 
         start_t = time.time()
         failed = []
+        plan = None
+        if not self.use_sge:
+            plan = self.plan_local_jobs(
+                num_la4ice_jobs=len(self.la4ice_cmds) if self.use_la4ice else 0)
+            logging.info("Running %d daligner jobs and %d LA4Ice jobs " +
+                         "at a time using %d cpus.", plan.daligner_jobs,
+                         plan.la4ice_jobs, plan.cpus)
         if self.use_sge:
             failed.extend(
                 sge_job_runner(cmds_list=daligner_cmds,
@@ -330,13 +470,16 @@ class DalignerRunner(object):
                                wait_timeout=600, run_timeout=600,
                                rescue="sge", rescue_times=3))
         else:
-            # max 4 at a time to avoid running out of memory...
             failed.extend(
                 local_job_runner(cmds_list=daligner_cmds,
-                                 num_threads=max(1, min(self.cpus/4, 4))))
+                                 num_threads=plan.daligner_jobs))
         logging.info("daligner jobs took " + str(time.time()-start_t) + " sec.")
 
-        # (b) run all LA4Ice jobs
+        # (b) run all LA4Ice jobs, unless las files will be read directly
+        if not self.use_la4ice:
+            os.chdir(old_dir)
+            return self._check_failed(failed)
+
         start_t = time.time()
         logging.info("Start LA4Ice cmds " +
                      ("using sge." if self.use_sge else "locally."))
@@ -353,13 +496,15 @@ class DalignerRunner(object):
                                wait_timeout=600, run_timeout=600,
                                rescue="sge", rescue_times=3))
         else:
-            # max 4 at a time to avoid running out of memory...
             failed.extend(
                 local_job_runner(cmds_list=la4ice_cmds,
-                                 num_threads=max(1, min(self.cpus, 4))))
+                                 num_threads=plan.la4ice_jobs))
         logging.info("LA4Ice jobs took " + str(time.time()-start_t) + " sec.")
         os.chdir(old_dir)
+        return self._check_failed(failed)
 
+    def _check_failed(self, failed):
+        """Raise RuntimeError if any job in failed, otherwise return 0."""
         if len(failed) == 0:
             return 0
         else:
@@ -373,7 +518,7 @@ class DalignerRunner(object):
              self._las_filenames(is_forward=False, output_dir=self.output_dir, switch_query_target=False) + \
              self._las_filenames(is_forward=True, output_dir=self.output_dir, switch_query_target=True) + \
              self._las_filenames(is_forward=False, output_dir=self.output_dir, switch_query_target=True) + \
-             self.la4ice_filenames
+             (self.la4ice_filenames if self.use_la4ice else [])
         for f in set(fs):
             os.remove(f)
 
@@ -389,6 +534,10 @@ def add_ice_daligner_arguments(parser):
     helpstr = "Output directory to store daligner and LA4Ice outputs"
     parser.add_argument("output_dir", type=str, help=helpstr)
 
+    helpstr = "Only run daligner and keep las files, do not run LA4Ice " + \
+              "to print alignments as text."
+    parser.add_argument("--las_only", default=False, action="store_true", help=helpstr)
+
     helpstr = "Query reads are Full-Length isoforms."
     parser.add_argument("--is_FL", default=False, action="store_true", help=helpstr)
 
@@ -401,7 +550,8 @@ def add_ice_daligner_arguments(parser):
 
 class IceDalignerRunner(PBToolRunner):
 
-    "Use daligner to align cDNA reads, then call LA4Ice to show alignments."
+    """Use daligner to align cDNA reads, then call LA4Ice to show alignments,
+    unless --las_only."""
 
     def __init__(self):
         desc = __doc__
@@ -430,7 +580,8 @@ class IceDalignerRunner(PBToolRunner):
                              target_filename=args.target_fasta,
                              is_FL=args.is_FL, same_strand_only=args.same_strand_only,
                              query_converted=False, target_converted=False,
-                             use_sge=args.use_sge, sge_opts=sge_opts)
+                             use_sge=args.use_sge, sge_opts=sge_opts,
+                             cpus=args.blasr_nproc, use_la4ice=not args.las_only)
         obj.run(output_dir=args.output_dir)
 
 
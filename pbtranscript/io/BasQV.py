@@ -44,6 +44,7 @@ import logging
 from collections import defaultdict
 from pbcore.io import FastqReader, ConsensusReadSet
 import pbtranscript.io.c_basQV as c_basQV
+from pbtranscript.io.QVStore import QVStore
 
 
 class smrt_wrapper(object):
@@ -115,34 +116,35 @@ class basQVcacher(object):
     """Cache quality values from bas.h5/bam files."""
     qv_names = ['InsertionQV', 'SubstitutionQV', 'DeletionQV']
 
-    def __init__(self):
+    def __init__(self, qv_store=None):
         self.bas_dict = {}
         self.bas_files = {}
 
-        # subread seqid --> qv_name --> list of qv (transformed to prob)
-        self.qv = {}
+        # subread seqid --> qv_name --> qvs, which are stored as
+        # uint8 in a columnar QVStore and transformed to prob on access.
+        # An existing (e.g., memory-mapped) store can be shared.
+        self.qv = QVStore() if qv_store is None else qv_store
         self.qv_mean = {} # seqid --> qv_name --> mean qv
         # smoothing window size, set when presmooth() is called
         self.window_size = None
 
     def get(self, seqid, qv_name, position=None):
         """Get quality value of type qv_name for a sequence seqid."""
-        if position is None:
-            return self.qv[seqid][qv_name]
-        else:
-            return self.qv[seqid][qv_name][position]
+        return self.qv.get(seqid, qv_name, position)
 
     def get_smoothed(self, seqid, qv_name, position=None):
         """Get smooth qv of type qv_name for seqid."""
-        if position is None:
-            return self.qv[seqid][qv_name + '_smoothed']
-        else:
-            return self.qv[seqid][qv_name + '_smoothed'][position]
+        return self.qv.get(seqid, qv_name + '_smoothed', position)
 
     def get_mean(self, seqid, qv_name):
         """Return mean QV of read=seqid, type=qv_name."""
         return self.qv_mean[seqid][qv_name]
 
+    def remove(self, seqid):
+        """Remove cached QVs of seqid."""
+        self.qv.remove(seqid)
+        self.qv_mean.pop(seqid, None)
+
     def add_bash5(self, filename):
         """Add a bas.h5/ccs.h5/ccs.bam to cacher."""
         basename = os.path.basename(filename)
@@ -227,27 +229,24 @@ class basQVcacher(object):
         self.window_size = window_size
         for seqid in seqids:
             # logging.debug("smoothing sequence " + seqid)
-            # Replace .smooth_qv_regions by c_baseQV.maxval_per_window
+            # Max prob per window is the prob of the min QV per window.
             for qv_name in basQVcacher.qv_names:
-                self.qv[seqid][qv_name + '_smoothed'] = \
-                    c_basQV.maxval_per_window(self.qv[seqid][qv_name],
-                                              window_size)
+                self.qv.add(seqid, qv_name + '_smoothed',
+                            c_basQV.minqv_per_window(
+                                self.qv.get_qvs(seqid, qv_name),
+                                window_size))
 
     def make_qv_mean(self, seqids):
         """Compute mean QVs for reads in seqids."""
         for seqid in seqids:
             self.qv_mean[seqid] = {}
-            for qv_name in self.qv[seqid]:
-                self.qv_mean[seqid][qv_name] = sum(self.qv[seqid][qv_name])*1./len(self.qv[seqid][qv_name])
+            for qv_name in basQVcacher.qv_names:
+                self.qv_mean[seqid][qv_name] = self.qv.mean(seqid, qv_name)
 
     def remove_unsmoothed(self):
         """Remove unsmoothed QVs."""
-        for k, dummy_v in self.qv.iteritems():
-            for qv_name in basQVcacher.qv_names:
-                try:
-                    del self.qv[k][qv_name]
-                except KeyError:
-                    pass  # may have already been deleted. OK.
+        for qv_name in basQVcacher.qv_names:
+            self.qv.drop(qv_name)
 
 
 class fastqQVcacher(object):
@@ -260,9 +259,10 @@ class fastqQVcacher(object):
     It will simply ignore the <qv_type>.
     """
 
-    def __init__(self):
-        # subread seqid --> None --> list of qv (transformed to prob)
-        self.qv = {}
+    def __init__(self, qv_store=None):
+        # subread seqid --> 'unsmoothed'|'smoothed' --> qvs, stored as
+        # uint8 in a columnar QVStore and transformed to prob on access.
+        self.qv = QVStore() if qv_store is None else qv_store
         self.qv_mean = {} # seqid --> qv mean
         # smoothing window size, set when presmooth() is called
         self.window_size = None
@@ -271,31 +271,29 @@ class fastqQVcacher(object):
         """
         <qv_type> is ignored
         """
-        if position is None:
-            return self.qv[seqid]['unsmoothed']
-        else:
-            return self.qv[seqid]['unsmoothed'][position]
+        return self.qv.get(seqid, 'unsmoothed', position)
 
     def get_smoothed(self, seqid, qv_type, position=None):
         """
         <qv_type> is ignored
         """
-        if position is None:
-            return self.qv[seqid]['smoothed']
-        else:
-            return self.qv[seqid]['smoothed'][position]
+        return self.qv.get(seqid, 'smoothed', position)
 
     def get_mean(self, seqid, qv_name):
         """Return mean QV of seqid."""
         return self.qv_mean[seqid]
 
+    def remove(self, seqid):
+        """Remove cached QVs of seqid."""
+        self.qv.remove(seqid)
+        self.qv_mean.pop(seqid, None)
+
     def precache_fastq(self, fastq_filename):
         """
         Cache each sequence in the FASTQ file into self.qv
         """
         for r in FastqReader(fastq_filename):
             seqid = r.name.split()[0]
-            self.qv[seqid] = {}
             c_basQV.fastq_precache_helper(seqid, r.quality, self.qv)
             self.make_qv_mean([seqid])
 
@@ -306,15 +304,14 @@ class fastqQVcacher(object):
         self.window_size = window_size
         for seqid in seqids:
             try:
-                self.qv[seqid]['smoothed'] = c_basQV.maxval_per_window(
-                    self.qv[seqid]['unsmoothed'], window_size)
+                self.qv.add(seqid, 'smoothed', c_basQV.minqv_per_window(
+                    self.qv.get_qvs(seqid, 'unsmoothed'), window_size))
             except KeyError:
                 if fastq_filename is None:
                     raise KeyError("Qvs of {seqid} ".format(seqid=seqid) +
                                    "must be precached.")
                 for r in FastqReader(fastq_filename):
                     if r.name.split()[0] == seqid:
-                        self.qv[seqid] = {}
                         c_basQV.fastq_precache_helper(seqid, r.quality, self.qv)
                         break
                 raise KeyError("Qvs of {seqid} ".format(seqid=seqid) +
@@ -323,12 +320,8 @@ class fastqQVcacher(object):
     def make_qv_mean(self, seqids):
         """Compute mean QV for every reads in seqids."""
         for seqid in seqids:
-            self.qv_mean[seqid] = sum(self.qv[seqid]['unsmoothed']) * 1. / len(self.qv[seqid]['unsmoothed'])
+            self.qv_mean[seqid] = self.qv.mean(seqid, 'unsmoothed')
 
     def remove_unsmoothed(self):
         """Remove unsmoothed qvs."""
-        for k, dummy_v in self.qv.iteritems():
-            try:
-                del self.qv[k]['unsmoothed']
-            except KeyError:
-                pass # may have already been deleted. OK.
+        self.qv.drop('unsmoothed')
@@ -1,18 +1,34 @@
 """
 Define classes to represent SAM records and read SAM records.
+
+GMAP output can be read either as text SAM, or as coordinate sorted
+and indexed BAM (see gmap_sam_to_bam), which is parsed by htslib and
+supports region queries, e.g.,
+    for group in iter_gmap_sam("sorted.bam", ..., reference="SIRV1",
+                               start=10000, end=20000):
 """
 from collections import namedtuple
 import logging
+import os
 
 from pbtranscript.io.PbiBamIO import BamHeader
-from pbtranscript.libs import Samfile
+from pbtranscript.libs import Samfile, pysam_index, pysam_sort
 
 # __author__ = "etseng@pacificbiosciences.com"
 
-__all__ = ["GMAPSAMReader", "GMAPSAMRecord", "iter_gmap_sam"]
+__all__ = ["GMAPSAMReader", "GMAPSAMRecord", "iter_gmap_sam", "gmap_sam_to_bam"]
 
 Interval = namedtuple('Interval', ['start', 'end'])
 
+# cigar operations of pysam AlignedSegment.cigartuples
+cdef enum:
+    BAM_CMATCH = 0
+    BAM_CINS = 1
+    BAM_CDEL = 2
+    BAM_CREF_SKIP = 3
+    BAM_CSOFT_CLIP = 4
+    BAM_CHARD_CLIP = 5
+
 
 def iter_cigar_string(cigar_string):
     """Iterate over a cigar string, each iter returns a tuple of
@@ -80,6 +96,44 @@ def parse_cigar(cigar, offset):
     return segments, num_ins, num_del, num_mat_or_sub, query_start, query_end
 
 
+def parse_cigartuples(cigartuples, long offset):
+    """
+    Same as parse_cigar, but parses binary cigar operations,
+    [(operation, length)], of a pysam AlignedSegment, without
+    formatting and parsing a cigar string.
+    """
+    cdef long cur_start = offset, cur_end = offset
+    cdef long query_start = 0, q_aln_len = 0
+    cdef long num_del = 0, num_ins = 0, num_mat_or_sub = 0
+    cdef int op
+    cdef long num
+    cdef bint first_thing = True
+    segments = []
+    for op, num in cigartuples:
+        if op == BAM_CHARD_CLIP or op == BAM_CSOFT_CLIP:
+            if first_thing:
+                query_start += num
+        elif op == BAM_CINS:
+            q_aln_len += num
+            num_ins += num
+        elif op == BAM_CMATCH:
+            cur_end += num
+            q_aln_len += num
+            num_mat_or_sub += num
+        elif op == BAM_CDEL:
+            cur_end += num
+            num_del += num
+        elif op == BAM_CREF_SKIP: # junction, make a new segment
+            segments.append(Interval(cur_start, cur_end))
+            cur_start = cur_end + num
+            cur_end = cur_start
+        first_thing = False
+    if cur_start != cur_end:
+        segments.append(Interval(cur_start, cur_end))
+    return (segments, num_ins, num_del, num_mat_or_sub,
+            query_start, query_start + q_aln_len)
+
+
 class SAMflag(object):
     """SAMflag, can be constructed from int flag or by __init__."""
     __all__ = ('is_paired', 'strand', 'PE_read_num')
@@ -255,7 +309,7 @@ class GMAPSAMRecord(SAMRecordBase):
         self.sStart = alnseg.reference_start
         (self.segments,
          self.num_ins, self.num_del, self.num_mat_or_sub,
-         self.qStart, self.qEnd) = parse_cigar(cigar=self.cigar, offset=self.sStart)
+         self.qStart, self.qEnd) = parse_cigartuples(alnseg.cigartuples, self.sStart)
 
         self.sEnd = self.segments[-1].end
 
@@ -285,6 +339,13 @@ class GMAPSAMRecord(SAMRecordBase):
             self.identity = 1. - (self.num_nonmatches * 1. /
                                   (self.num_del + self.num_ins + self.num_mat_or_sub))
 
+    def __getstate__(self):
+        """Pickle all but the pysam AlignedSegment, so that records can
+        be sent to worker processes."""
+        state = dict(self.__dict__)
+        state['peer'] = None
+        return state
+
     @property
     def is_mapped(self):
         """Returns True if this SAM record is mapped (i.e., sID is neither None nor *)."""
@@ -292,16 +353,24 @@ class GMAPSAMRecord(SAMRecordBase):
 
 
 class GMAPSAMReader(object):
-    """Class to read GMAP SAM file.,
+    """Class to read GMAP SAM file, or BAM file converted by gmap_sam_to_bam.,
     e.x.,
     with GMAPSAMReader("gmap-output.sam") as reader:
         for sam_record in reader:
             print sam_record
+
+    If reference is given, only read records which overlap with
+    reference:[start, end) from an indexed BAM file.
     """
-    def __init__(self, filename, ref_len_dict=None, query_len_dict=None):
+    def __init__(self, filename, ref_len_dict=None, query_len_dict=None,
+                 reference=None, start=None, end=None):
         self.filename = filename
-        self._sam_file = Samfile(filename, 'r')
+        self._sam_file = Samfile(filename, 'rb' if filename.endswith('.bam') else 'r')
         self.header = BamHeader(headers=self._sam_file.header, ignore_pg=True)
+        if reference is not None:
+            self._it = self._sam_file.fetch(reference, start, end)
+        else:
+            self._it = self._sam_file
 
         if ref_len_dict is not None:
             self.ref_len_dict = ref_len_dict
@@ -318,7 +387,7 @@ class GMAPSAMReader(object):
 
     def next(self):
         """Return the next SAMRecord or stop."""
-        return GMAPSAMRecord(alnseg=self._sam_file.next(),
+        return GMAPSAMRecord(alnseg=self._it.next(),
                              ref_len_dict=self.ref_len_dict,
                              query_len_dict=self.query_len_dict)
 
@@ -330,7 +399,8 @@ class GMAPSAMReader(object):
 
 
 def iter_gmap_sam(sam_filename, query_len_dict,
-                  min_aln_coverage, min_aln_identity, ignored_ids_writer):
+                  min_aln_coverage, min_aln_identity, ignored_ids_writer,
+                  reference=None, start=None, end=None):
     """
     Iterates over a SORTED GMAP SAM file, yields a collection of 
     GMAPSAMRecords that overlap by at least 1 base in the format:
@@ -338,10 +408,14 @@ def iter_gmap_sam(sam_filename, query_len_dict,
      '-': list of GMAPSAMRecords}
 
     Parameters:
+      sam_filename -- sorted GMAP SAM, or sorted and indexed BAM file
       query_len_dict -- {query_read: query_read_len}, used for computing qCoverage
       ignored_ids_writer -- file handler writing ignored SAM record.
       min_aln_coverage -- ignore records of which qCoverage < min_aln_coverage 
       min_aln_identity -- ignore records of which identity < min_aln_identity
+      reference, start, end -- if reference is not None, only iterate over
+                               records overlapping with reference:[start, end)
+                               of an indexed BAM file.
     """
     def sep_by_strand(records):
         """
@@ -360,7 +434,8 @@ def iter_gmap_sam(sam_filename, query_len_dict,
 
     records = None # holds the current set of records that overlap in coordinates
 
-    with GMAPSAMReader(sam_filename, query_len_dict=query_len_dict) as reader:
+    with GMAPSAMReader(sam_filename, query_len_dict=query_len_dict,
+                       reference=reference, start=start, end=end) as reader:
         first_record = None
         for r in reader:
             if not r.is_mapped:
@@ -384,6 +459,9 @@ def iter_gmap_sam(sam_filename, query_len_dict,
         # The very first valid SAM record has been added to records,
         # continue to append remaining records and yield
         for r in reader:
+            if not r.is_mapped: # unmapped records are at the end of a sorted BAM
+                write_ignored_ids("{0}\tUnmapped.\n".format(r.qID))
+                continue
             if r.sID == records[0].sID and r.sStart < records[-1].sStart:
                 raise ValueError("SAM file %s is NOT sorted. ABORT!" % sam_filename)
             if r.qCoverage < min_aln_coverage:
@@ -398,3 +476,23 @@ def iter_gmap_sam(sam_filename, query_len_dict,
             else:
                 records.append(r)
         yield sep_by_strand(records)
+
+
+def gmap_sam_to_bam(sam_filename, bam_filename, is_sorted=False):
+    """
+    Convert GMAP SAM output to a coordinate sorted BAM file, and index it
+    as bam_filename.bai, so that it can be read by iter_gmap_sam with
+    region queries. Return bam_filename.
+    If is_sorted, sam_filename is already sorted by reference order in
+    header then position, and is converted without sorting.
+    """
+    tmp_bam = bam_filename if is_sorted else bam_filename + ".unsorted.bam"
+    with Samfile(sam_filename, 'r') as reader, \
+         Samfile(tmp_bam, 'wb', template=reader) as writer:
+        for alnseg in reader:
+            writer.write(alnseg)
+    if not is_sorted:
+        pysam_sort("-o", bam_filename, tmp_bam)
+        os.remove(tmp_bam)
+    pysam_index(bam_filename)
+    return bam_filename
@@ -0,0 +1,105 @@
+"""
+Reconstruct base-level alignments from daligner trace points.
+"""
+from libc.stdlib cimport malloc, free
+
+
+cdef int _align_segment(char *a, int la, char *b, int lb, int *D,
+                        char *q_out, char *m_out, char *s_out):
+    """
+    Globally align a[0:la] with b[0:lb] using unit edit costs, write
+    alignment columns of a, match string and b to q_out, m_out, s_out,
+    and return number of columns. D must hold (la+1)*(lb+1) ints.
+    """
+    cdef int i, j, w = lb + 1, n = 0, k, c
+    cdef char t
+    for j in range(lb + 1):
+        D[j] = j
+    for i in range(1, la + 1):
+        D[i * w] = i
+        for j in range(1, lb + 1):
+            c = D[(i - 1) * w + j - 1] + (0 if a[i - 1] == b[j - 1] else 1)
+            if D[(i - 1) * w + j] + 1 < c:
+                c = D[(i - 1) * w + j] + 1
+            if D[i * w + j - 1] + 1 < c:
+                c = D[i * w + j - 1] + 1
+            D[i * w + j] = c
+
+    # trace back, prefer (mis)matches, then gaps in a, then gaps in b
+    i, j = la, lb
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and \
+           D[i * w + j] == D[(i - 1) * w + j - 1] + (0 if a[i - 1] == b[j - 1] else 1):
+            q_out[n] = a[i - 1]
+            s_out[n] = b[j - 1]
+            m_out[n] = '|' if a[i - 1] == b[j - 1] else '*'
+            i -= 1
+            j -= 1
+        elif j > 0 and D[i * w + j] == D[i * w + j - 1] + 1:
+            q_out[n] = '-'
+            s_out[n] = b[j - 1]
+            m_out[n] = '*'
+            j -= 1
+        else:
+            q_out[n] = a[i - 1]
+            s_out[n] = '-'
+            m_out[n] = '*'
+            i -= 1
+        n += 1
+
+    # columns were written backwards
+    for k in range(n / 2):
+        t = q_out[k]; q_out[k] = q_out[n - 1 - k]; q_out[n - 1 - k] = t
+        t = m_out[k]; m_out[k] = m_out[n - 1 - k]; m_out[n - 1 - k] = t
+        t = s_out[k]; s_out[k] = s_out[n - 1 - k]; s_out[n - 1 - k] = t
+    return n
+
+
+def trace_to_alignment(char *aseq, char *bseq, int abpos, int aepos,
+                       int bbpos, int bepos, int tspace, b_lens):
+    """
+    Return (qAln, alnStr, sAln, num_matches) of an overlap between
+    aseq[abpos:aepos] and bseq[bbpos:bepos], where b_lens are lengths
+    of b in each trace interval of a. Trace intervals of a are split at
+    multiples of tspace. bseq must already be reverse complemented if
+    the overlap is on the complementary strand.
+    """
+    cdef int n_seg = len(b_lens)
+    cdef int max_cols = (aepos - abpos) + (bepos - bbpos) + 1
+    cdef int max_seg = tspace + 1
+    cdef int i, lb, a0, a1, b0 = bbpos, n = 0, n_match = 0
+    cdef char *q_out = <char *>malloc(max_cols * sizeof(char))
+    cdef char *m_out = <char *>malloc(max_cols * sizeof(char))
+    cdef char *s_out = <char *>malloc(max_cols * sizeof(char))
+    cdef int *D = NULL
+
+    for i in range(n_seg):
+        if b_lens[i] + 1 > max_seg:
+            max_seg = b_lens[i] + 1
+    D = <int *>malloc((tspace + 1) * max_seg * sizeof(int))
+
+    try:
+        a0 = abpos
+        for i in range(n_seg):
+            a1 = (a0 / tspace + 1) * tspace
+            if a1 > aepos or i == n_seg - 1:
+                a1 = aepos
+            lb = b_lens[i]
+            if a1 - a0 > tspace or b0 + lb > bepos:
+                raise ValueError("Invalid trace points of overlap [%d, %d) x [%d, %d)."
+                                 % (abpos, aepos, bbpos, bepos))
+            n += _align_segment(aseq + a0, a1 - a0, bseq + b0, lb, D,
+                                q_out + n, m_out + n, s_out + n)
+            a0, b0 = a1, b0 + lb
+        if a0 != aepos or b0 != bepos:
+            raise ValueError("Trace points of overlap [%d, %d) x [%d, %d) do not "
+                             "cover the overlap." % (abpos, aepos, bbpos, bepos))
+        for i in range(n):
+            if m_out[i] == '|':
+                n_match += 1
+        return q_out[:n], m_out[:n], s_out[:n], n_match
+    finally:
+        free(q_out)
+        free(m_out)
+        free(s_out)
+        free(D)
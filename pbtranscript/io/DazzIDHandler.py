@@ -9,11 +9,14 @@ class DazzIDHandler, which
 """
 
 import logging
+import os
 import os.path as op
 from cPickle import load, dump
 from pbcore.io import FastaWriter
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
-from pbtranscript.Utils import execute, realpath, nfs_exists, real_upath
+from pbtranscript.io.LasReader import read_dazz_fasta_sequences
+from pbtranscript.Utils import execute, realpath, nfs_exists, real_upath, \
+    files_signature
 
 __author__ = 'etseng@pacificbiosciences.com'
 
@@ -31,6 +34,10 @@ class DazzIDHandler(object):
     By default, converted is False, so go ahead with converting.
     Otherwise, just read the mapping pickle.
 
+    If reuse_if_unchanged is True, conversion is skipped when the input
+    file has not changed (same path, size and mtime) since it was last
+    converted, which is recorded in <input>.dazz.fasta.signature.
+
     NOTE: Consistent with dazz's indexing, the IDs will be 1-based!!!!
     e.g.:
         cat <input>.fasta
@@ -50,7 +57,8 @@ class DazzIDHandler(object):
     """
     dazz_movie_name = 'prolog'
 
-    def __init__(self, input_filename, converted=False, dazz_dir=None):
+    def __init__(self, input_filename, converted=False, dazz_dir=None,
+                 reuse_if_unchanged=False):
         """
         input_filename - input FASTA/FASTQ/ContigSet file
         converted - whether or not input file has been converted to
@@ -58,6 +66,8 @@ class DazzIDHandler(object):
         dazz_dir - if None, save all dazz.fasta, dazz.pickle, db files
                   in the same directory as inputfile.
                   if a valid path, save all output files to dazz_dir.
+        reuse_if_unchanged - if True, treat input file as converted if it
+                  has not changed since the last conversion.
         """
         self.dazz_dir = dazz_dir
         self.input_filename = realpath(input_filename)
@@ -65,6 +75,12 @@ class DazzIDHandler(object):
 
         # index --> original sequence ID ex: 1 --> movie/zmw/start_end_CCS
         self.dazz_mapping = {}
+        # sequences in dazz fasta, loaded on demand
+        self._sequences = None
+
+        if not converted and reuse_if_unchanged and self.is_unchanged():
+            log.debug("Reusing DAZZ database of unchanged %s.", self.input_filename)
+            converted = True
 
         if converted and not nfs_exists(self.db_filename):
             log.warning(str(self.input_filename) +
@@ -75,6 +91,7 @@ class DazzIDHandler(object):
         if not converted:
             self.convert_to_dazz_fasta()
             self.make_db()
+            self.write_signature()
         else:
             self.read_dazz_pickle()
 
@@ -117,6 +134,31 @@ class DazzIDHandler(object):
         """
         return self.dazz_filename + '.db'
 
+    @property
+    def signature_filename(self):
+        """Return name of a file which saves signature of the input file
+        when it was last converted.
+        e.g., *.dazz.fasta.signature
+        """
+        return self.dazz_filename + '.signature'
+
+    def write_signature(self):
+        """Save signature of input file after conversion."""
+        with open(self.signature_filename, 'w') as f:
+            dump(files_signature([self.input_filename]), f)
+
+    def is_unchanged(self):
+        """Return True if input file has been converted and has not
+        changed since then."""
+        if not (nfs_exists(self.signature_filename) and
+                nfs_exists(self.db_filename)):
+            return False
+        try:
+            with open(self.signature_filename) as f:
+                return load(f) == files_signature([self.input_filename])
+        except (IOError, OSError, EOFError, ValueError):
+            return False
+
     def convert_to_dazz_fasta(self):
         """
         Convert input fasta/fastq file to daligner-compatibe fasta with ids:
@@ -126,6 +168,9 @@ class DazzIDHandler(object):
         """
         log.debug("Converting %s to daligner compatible fasta %s.",
                   self.input_filename, self.dazz_filename)
+        if op.exists(self.signature_filename):
+            # invalid until conversion completes
+            os.remove(self.signature_filename)
         reader = ContigSetReaderWrapper(self.input_filename)
 
         with FastaWriter(self.dazz_filename) as f:
@@ -136,6 +181,7 @@ class DazzIDHandler(object):
                               r.sequence[:])
                 self.dazz_mapping[i] = r.name
                 i += 1
+        self._sequences = None
 
         reader.close()
 
@@ -175,6 +221,14 @@ class DazzIDHandler(object):
         cmd = "DBsplit -s200 %s" % real_upath(self.dazz_filename)
         execute(cmd)
 
+    @property
+    def sequences(self):
+        """Return sequences in dazz fasta as a list, where the i-th item
+        is the sequence of 1-based dazz id i+1. Used by LasReader."""
+        if getattr(self, '_sequences', None) is None:
+            self._sequences = read_dazz_fasta_sequences(self.dazz_filename)
+        return self._sequences
+
     def keys(self):
         """Return all dazz ids in input FASTA/FASTQ."""
         return self.dazz_mapping.keys()
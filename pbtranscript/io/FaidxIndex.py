@@ -0,0 +1,257 @@
+"""
+Define FaidxIndex, an offset index of reads in a FASTA or FASTQ file,
+which is shared by FastaRandomReader, SubreadFastaReader and
+FastqRandomReader.
+
+The index is saved next to the input file in samtools faidx format,
+    <input>.fai            --- name, length, offset, linebases, linewidth
+                               (and qualoffset if FASTQ) of each read,
+    <input>.fai.signature  --- size and mtime of input when indexed,
+so that the next reader of the same file loads the index instead of
+scanning the whole file, as long as the input has not changed.
+
+A read is fetched by reading all bytes of its sequence in one slice,
+then removing line breaks.
+
+Example:
+    index = FaidxIndex.load_or_build('reads.fasta')
+    with open('reads.fasta', 'rb') as f:
+        for entry in index:
+            print entry.name, index.read_sequence(f, entry.name)
+"""
+
+from collections import namedtuple
+import os
+import logging
+from cPickle import load, dump
+
+from pbtranscript.Utils import files_signature
+
+__all__ = ["FaidxEntry", "FaidxIndex"]
+
+log = logging.getLogger(__name__)
+
+
+class FaidxEntry(namedtuple("FaidxEntry", ["name", "length", "offset",
+                                           "linebases", "linewidth",
+                                           "span", "qualoffset"])):
+
+    """
+    Location of a read in a FASTA or FASTQ file.
+    name --- read id, the first word of the header line
+    length --- number of bases
+    offset --- offset of the first base in file
+    linebases, linewidth --- bases and bytes of each sequence line, or
+                             0 if lines of this read are of unequal
+                             length, which samtools faidx rejects
+    span --- number of bytes from the first to the last base
+    qualoffset --- offset of the first quality value (FASTQ), or None
+    """
+
+    __slots__ = ()
+
+    @property
+    def is_regular(self):
+        """Return True if this entry can be written to a faidx file."""
+        return self.linebases > 0 or self.length == 0
+
+
+def _span(length, linebases, linewidth):
+    """Return bytes from the first to the last base of a read of
+    length bases in lines of linebases bases and linewidth bytes."""
+    if linebases <= 0:
+        return 0
+    full, rest = divmod(length, linebases)
+    return full * linewidth + rest if rest > 0 else \
+        max(0, full * linewidth - (linewidth - linebases))
+
+
+class FaidxIndex(object):
+
+    """
+    An offset index of reads in a FASTA or FASTQ file, which can be
+    saved to and loaded from a samtools faidx compatible .fai file.
+    Entries are kept in the same order as reads in file.
+    """
+
+    SUFFIX = ".fai"
+    SIGNATURE_SUFFIX = ".signature"
+
+    def __init__(self, entries, is_fastq=False):
+        self.entries = list(entries)
+        self.is_fastq = is_fastq
+        self._d = dict((e.name, e) for e in self.entries)
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, name):
+        return name in self._d
+
+    def __getitem__(self, name):
+        return self._d[name]
+
+    def __iter__(self):
+        """Iterate over entries in file order."""
+        return iter(self.entries)
+
+    def keys(self):
+        """Return read ids."""
+        return self._d.keys()
+
+    @property
+    def is_regular(self):
+        """Return True if all entries can be written to a faidx file."""
+        return all(e.is_regular for e in self.entries)
+
+    @classmethod
+    def build(cls, filename):
+        """Scan a FASTA or FASTQ file and return its index."""
+        with open(filename, 'rb') as f:
+            first = f.read(1)
+        if first == '@':
+            return cls(cls._scan_fastq(filename), is_fastq=True)
+        return cls(cls._scan_fasta(filename), is_fastq=False)
+
+    @staticmethod
+    def _scan_fasta(filename):
+        """Yield a FaidxEntry for each read in a FASTA file.
+        The header of a read MUST be just 1 line."""
+        name = None
+        pos = 0
+        with open(filename, 'rb') as f:
+            for line in f:
+                if line.startswith('>'):
+                    if name is not None:
+                        yield FaidxEntry(name, length, offset,
+                                         linebases if regular else 0,
+                                         linewidth if regular else 0,
+                                         end - offset, None)
+                    name = line[1:].strip().split(None, 1)[0]
+                    offset = end = pos + len(line)
+                    length, linebases, linewidth = 0, 0, 0
+                    regular, short_line_seen = True, False
+                elif name is not None:
+                    bases = len(line.rstrip('\r\n'))
+                    if bases > 0:
+                        if linebases == 0:
+                            linebases, linewidth = bases, len(line)
+                        elif short_line_seen or bases > linebases or \
+                                (bases == linebases and len(line) != linewidth):
+                            regular = False
+                        if bases < linebases:
+                            short_line_seen = True
+                        length += bases
+                        end = pos + len(line.rstrip('\r\n'))
+                    else:
+                        # a blank line can only be followed by a header
+                        short_line_seen = True
+                pos += len(line)
+            if name is not None:
+                yield FaidxEntry(name, length, offset,
+                                 linebases if regular else 0,
+                                 linewidth if regular else 0,
+                                 end - offset, None)
+
+    @staticmethod
+    def _scan_fastq(filename):
+        """Yield a FaidxEntry for each read in a FASTQ file, of which
+        every record MUST be exactly 4 lines."""
+        pos = 0
+        with open(filename, 'rb') as f:
+            while True:
+                header = f.readline()
+                if len(header) == 0:
+                    break
+                seq, plus, qual = f.readline(), f.readline(), f.readline()
+                if not header.startswith('@') or not plus.startswith('+'):
+                    raise ValueError("Bad fastq format at offset %d of %s" %
+                                     (pos, filename))
+                name = header[1:].strip().split(None, 1)[0]
+                length = len(seq.rstrip('\r\n'))
+                offset = pos + len(header)
+                qualoffset = offset + len(seq) + len(plus)
+                yield FaidxEntry(name, length, offset, length, len(seq),
+                                 length, qualoffset)
+                pos = qualoffset + len(qual)
+
+    def read_sequence(self, f, name):
+        """Return sequence of read name from an open file f."""
+        return self._read(f, self._d[name].offset, self._d[name])
+
+    def read_quality(self, f, name):
+        """Return quality string of read name from an open FASTQ file f."""
+        return self._read(f, self._d[name].qualoffset, self._d[name])
+
+    @staticmethod
+    def _read(f, offset, entry):
+        """Read entry.length bases starting at offset in one slice."""
+        f.seek(offset)
+        s = f.read(entry.span).translate(None, '\r\n')
+        if len(s) != entry.length:
+            raise ValueError("Read %s in %s has %d bases, expecting %d, " %
+                             (entry.name, f.name, len(s), entry.length) +
+                             "file may have changed after it was indexed.")
+        return s
+
+    def save(self, fai_fn, signature):
+        """Write index to fai_fn in faidx format, and signature of
+        the indexed file to fai_fn.signature."""
+        tmp_fn = "%s.%d.tmp" % (fai_fn, os.getpid())
+        with open(tmp_fn, 'w') as writer:
+            for e in self.entries:
+                fields = [e.name, e.length, e.offset, e.linebases, e.linewidth]
+                if self.is_fastq:
+                    fields.append(e.qualoffset)
+                writer.write("\t".join(str(x) for x in fields) + "\n")
+        os.rename(tmp_fn, fai_fn)
+        with open(tmp_fn, 'wb') as writer:
+            dump(signature, writer)
+        os.rename(tmp_fn, fai_fn + self.SIGNATURE_SUFFIX)
+
+    @classmethod
+    def load(cls, fai_fn, signature):
+        """Load index from fai_fn. Return None if fai_fn does not exist,
+        or was built from a file of a different signature."""
+        try:
+            with open(fai_fn + cls.SIGNATURE_SUFFIX, 'rb') as reader:
+                if load(reader) != signature:
+                    log.info("Ignore out-of-date index %s.", fai_fn)
+                    return None
+            entries = []
+            is_fastq = False
+            with open(fai_fn, 'r') as reader:
+                for line in reader:
+                    fields = line.rstrip('\n').split('\t')
+                    length, offset, linebases, linewidth = \
+                        [int(x) for x in fields[1:5]]
+                    qualoffset = int(fields[5]) if len(fields) > 5 else None
+                    is_fastq = qualoffset is not None
+                    entries.append(FaidxEntry(fields[0], length, offset,
+                                              linebases, linewidth,
+                                              _span(length, linebases, linewidth),
+                                              qualoffset))
+            return cls(entries, is_fastq=is_fastq)
+        except (IOError, OSError, EOFError, ValueError, IndexError) as e:
+            if os.path.exists(fai_fn):
+                log.info("Unable to load index %s: %s", fai_fn, str(e))
+            return None
+
+    @classmethod
+    def load_or_build(cls, filename):
+        """Load index of filename from filename.fai if it is up to date,
+        otherwise scan filename, and try to save its index to filename.fai."""
+        fai_fn = filename + cls.SUFFIX
+        signature = files_signature([filename])
+        index = cls.load(fai_fn, signature)
+        if index is None:
+            index = cls.build(filename)
+            if not index.is_regular:
+                log.info("Not saving index of %s, which has lines of " +
+                         "unequal length.", filename)
+                return index
+            try:
+                index.save(fai_fn, signature)
+            except (IOError, OSError) as e:
+                log.warning("Unable to save index %s: %s", fai_fn, str(e))
+        return index
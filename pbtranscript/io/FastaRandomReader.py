@@ -5,6 +5,10 @@ or ContigSet files randomly.
 Note that a ContigSet can contain multiple FASTA files,
 but can only contain FASTA files and filters in the
 ContigSet will not be respected.
+
+Reads are located by a FaidxIndex of each FASTA file, which is
+saved as <fasta>.fai and reused as long as the FASTA file has not
+changed, so that opening a reader does not scan the whole file.
 """
 
 from collections import namedtuple
@@ -13,6 +17,7 @@ import logging
 
 from pbcore.io.FastaIO import FastaRecord
 from pbcore.io import ContigSet
+from pbtranscript.io.FaidxIndex import FaidxIndex
 
 __all__ = ["FastaRandomReader",
            "MetaSubreadFastaReader",
@@ -34,6 +39,7 @@ class FastaRandomReader(object):
         are too big to fit entirely to memory.
 
         The only requirement is that every id line begins with the symbol >.
+        An index of each FASTA file is saved as <fasta>.fai and reused.
 
         Example:
             r = FastaRandomReader('output/test.fna')
@@ -46,6 +52,7 @@ class FastaRandomReader(object):
     def __init__(self, *args):
         self.fasta_filenames = self.get_fasta_filenames(*args)
         self.fhandlers = self._open_files()
+        self.indices = []
         self.d = {}
         self._init_index()
 
@@ -69,21 +76,18 @@ class FastaRandomReader(object):
         return ret
 
     def _open_files(self):
-        return [open(fn) for fn in self.fasta_filenames]
+        return [open(fn, 'rb') for fn in self.fasta_filenames]
 
     def _init_index(self):
-        """Indexing reads in fasta_filenames"""
-        for index, f in enumerate(self.fhandlers):
-            while 1:
-                line = f.readline()
-                if len(line) == 0:
-                    break
-                if line.startswith('>'):
-                    sid = line.strip()[1:].split(None, 1)[0]
-                    # the header MUST be just 1 line
-                    # if id in self.d:
-                    #    print "duplicate id {0}!!".format(id)
-                    self.d[sid] = (index, f.tell())
+        """Load or build index of reads in fasta_filenames,
+        self.d maps read id --> index of file containing the read."""
+        for index, fn in enumerate(self.fasta_filenames):
+            faidx = FaidxIndex.load_or_build(fn)
+            self.indices.append(faidx)
+            for sid in faidx.keys():
+                # if id in self.d:
+                #    print "duplicate id {0}!!".format(id)
+                self.d[sid] = index
 
     def __getitem__(self, k):
         if k not in self.d:
@@ -93,14 +97,8 @@ class FastaRandomReader(object):
         return self._get_record(k)
 
     def _get_record(self, k):
-        index, tell = self.d[k]
-        f = self.fhandlers[index]
-        f.seek(tell)
-        content = ''
-        for line in f:
-            if line.startswith('>'):
-                break
-            content += line.strip()
+        index = self.d[k]
+        content = self.indices[index].read_sequence(self.fhandlers[index], k)
         return FastaRecord(header=k, sequence=content)
 
     def __len__(self):
@@ -160,22 +158,17 @@ class SubreadFastaReader(object):
     """Reader for reading PabBio subreads in a fasta file."""
 
     def __init__(self, fasta_filename):
-        self.f = open(fasta_filename)
-        self.d = {}
+        self.f = open(fasta_filename, 'rb')
+        self.index = FaidxIndex.load_or_build(fasta_filename)
+        self.d = self.index
         self.zmw_d = {}
-        while 1:
-            line = self.f.readline()
-            if len(line) == 0:
-                break
-            if line.startswith('>'):
-                # ex: m140..._s1_p0/155/0_1673 RQ=0.845
-                rid = line.strip()[1:].split(None, 1)[0]
-                # the header MUST be just 1 line
-                zmw = rid[:rid.rfind('/')]
-                self.d[rid] = (rid, self.f.tell())
-                if zmw not in self.zmw_d:
-                    self.zmw_d[zmw] = []
-                self.zmw_d[zmw].append((rid, self.f.tell()))
+        for entry in self.index:
+            # ex: m140..._s1_p0/155/0_1673 RQ=0.845
+            rid = entry.name
+            zmw = rid[:rid.rfind('/')]
+            if zmw not in self.zmw_d:
+                self.zmw_d[zmw] = []
+            self.zmw_d[zmw].append(rid)
 
     def __getitem__(self, k):
         """
@@ -186,21 +179,14 @@ class SubreadFastaReader(object):
         if k.count('/') == 2:  # is a subread
             if k not in self.d:
                 raise ValueError("key {0} not in dictionary!".format(k))
-            locations = [self.d[k]]
+            seqids = [k]
         else:  # is a ZMW
             if k not in self.zmw_d:
                 raise ValueError("key {0} not in dictionary!".format(k))
-            locations = self.zmw_d[k]
-        output = []
-        for seqid, loc in locations:
-            self.f.seek(loc)
-            content = ''
-            for line in self.f:
-                if line.startswith('>'):
-                    break
-                content += line.strip()
-            output.append(FastaRecord(header=seqid, sequence=content))
-        return output
+            seqids = self.zmw_d[k]
+        return [FastaRecord(header=seqid,
+                            sequence=self.index.read_sequence(self.f, seqid))
+                for seqid in seqids]
 
     def keys(self):
         """return keys (subreads)."""
@@ -3,6 +3,7 @@ Define miscBio.FastqRandomReader.
 It will be repaced by pbcore.io.FastqIO.FastqRandomReader.
 """
 from pbcore.io.FastqIO import FastqRecord
+from pbtranscript.io.FaidxIndex import FaidxIndex
 
 __all__ = ["FastqRandomReader"]
 
@@ -15,6 +16,7 @@ class FastqRandomReader:
         are too big to fit entirely to memory. The only requirement is that every id line
         begins with the symbol >. It is ok for the sequences to stretch multiple lines.
         The sequences, when read, are returned as Bio.SeqRecord objects.
+        An index of the fastq file is saved as <fastq>.fai and reused.
 
         Example:
             r = FastqRandomReader('test.fastq')
@@ -22,40 +24,25 @@ class FastqRandomReader:
     """
 
     def __init__(self, fastq_filename):
-        self.f = open(fastq_filename)
-        self.d = {}
-        self.locations = []
-        self.locations_d_key_map = {}
-
-        idx = -1
-        while 1:
-            line = self.f.readline()
-            if len(line) == 0:
-                break
-            idx += 1
-            if idx % 4 == 0:
-                assert line.startswith('@')
-                sid = line.strip()[1:].split(None, 1)[0]
-                # the header MUST be just 1 line
-                if sid in self.d:
+        self.f = open(fastq_filename, 'rb')
+        self.d = FaidxIndex.load_or_build(fastq_filename)
+        if len(self.d) > 0 and not self.d.is_fastq:
+            raise ValueError("Bad fastq format: {f}".format(f=fastq_filename))
+        if len(self.d) != len(self.d.entries):
+            sids = set()
+            for entry in self.d:
+                if entry.name in sids:
                     raise ValueError("Bad fastq format: redundant record {sid}".
-                                     format(sid=sid))
-                self.d[sid] = self.f.tell()
+                                     format(sid=entry.name))
+                sids.add(entry.name)
 
     def __getitem__(self, k):
         if k not in self.d:
             errMsg = "key {k} not in {f}!".format(k=k, f=self.f.name)
             raise ValueError(errMsg)
-        self.f.seek(self.d[k])
-        name, seq, plus, qv = k, "", "", ""
-
-        seq  = self.f.readline().strip()
-        plus = self.f.readline().strip()
-        qv = self.f.readline().strip()
-        if plus != '+':
-            raise ValueError("Bad fastq format: line 3 of {name}".
-                             format(name=name) + " is not '+'")
-        return FastqRecord(header=name, sequence=seq, qualityString=qv)
+        seq = self.d.read_sequence(self.f, k)
+        qv = self.d.read_quality(self.f, k)
+        return FastqRecord(header=k, sequence=seq, qualityString=qv)
 
     def __len__(self):
         return len(self.d)
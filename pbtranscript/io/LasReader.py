@@ -0,0 +1,138 @@
+#!/usr/env python
+
+"""
+Define LasReader which reads daligner .las files directly as BLASRRecord,
+without running LA4Ice and parsing its text output.
+"""
+
+import struct
+import numpy as np
+
+from pbcore.io import FastaReader
+from pbtranscript.io.BLASRRecord import BLASRRecord
+from pbtranscript.io.c_las import trace_to_alignment
+
+__all__ = ["LasReader", "read_dazz_fasta_sequences"]
+
+# .las header: number of overlaps (int64), trace spacing (int32)
+LAS_HEADER = struct.Struct("<qi")
+# Overlap record without the trace pointer: tlen, diffs, abpos, bbpos,
+# aepos, bepos, flags, aread, bread, and 4 bytes of padding.
+LAS_RECORD = struct.Struct("<iiiiiiIii4x")
+# Trace points are uint8 if tspace <= TRACE_XOVR, otherwise uint16.
+TRACE_XOVR = 125
+# B read is reverse complemented in overlap
+COMP_FLAG = 0x1
+# Complement table over all 256 bytes, mapping any base other than
+# acgt (e.g., n or IUPAC codes) to n, as LA4Ice tolerates them.
+_COMPLEMENT = "".join({'a': 't', 'c': 'g', 'g': 'c', 't': 'a'}.get(chr(i), 'n')
+                      for i in range(256))
+
+
+def _revcmp(seq):
+    """Return reverse complement of a lower case sequence."""
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def read_dazz_fasta_sequences(dazz_fasta_filename):
+    """
+    Return sequences in a daligner-compatible fasta file made by
+    DazzIDHandler, as a list where the i-th item is sequence of the
+    read with 0-based dazz id i, i.e., prolog/{i+1}/0_{len}.
+    """
+    return [r.sequence.lower() for r in FastaReader(dazz_fasta_filename)]
+
+
+class LasReader(object):
+
+    """
+    Reader for reading alignments in a daligner .las file, the same as
+    LA4IceReader reads the output of
+        'LA4Ice -m -i0 -w100000 -b0 -a {db} {las}'
+    Base-level alignments are reconstructed from trace points and
+    sequences in query and target dazz fasta files.
+
+    Example
+        [r for r in LasReader('*.las', 'q.dazz.fasta', 't.dazz.fasta')][0]
+        ==> this shows a BLASRRecord
+
+    query_seqs and target_seqs can be passed instead of fasta files
+    in order to share sequences across many .las files.
+    """
+
+    def __init__(self, las_filename, query_dazz_fasta=None, target_dazz_fasta=None,
+                 query_seqs=None, target_seqs=None):
+        self.file_name = las_filename
+        self.query_seqs = query_seqs if query_seqs is not None else \
+                read_dazz_fasta_sequences(query_dazz_fasta)
+        if target_seqs is not None:
+            self.target_seqs = target_seqs
+        elif target_dazz_fasta is None or target_dazz_fasta == query_dazz_fasta:
+            self.target_seqs = self.query_seqs
+        else:
+            self.target_seqs = read_dazz_fasta_sequences(target_dazz_fasta)
+        self._rc_cache = {}  # cached reverse complement of the last target
+        self.f = open(las_filename, 'rb')
+        try:
+            self.num_overlaps, self.tspace = LAS_HEADER.unpack(
+                self.f.read(LAS_HEADER.size))
+        except struct.error:
+            raise ValueError("Unable to read %s as a daligner las file." %
+                             las_filename)
+        self.trace_dtype = np.uint8 if self.tspace <= TRACE_XOVR else np.uint16
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close *.las file."""
+        self.f.close()
+
+    def _target_seq(self, bread, is_comp):
+        """Return sequence of target bread, reverse complemented if is_comp."""
+        if not is_comp:
+            return self.target_seqs[bread]
+        if bread not in self._rc_cache:
+            self._rc_cache = {bread: _revcmp(self.target_seqs[bread])}
+        return self._rc_cache[bread]
+
+    def next(self):
+        """Return the next overlap as a BLASRRecord."""
+        if self._index >= self.num_overlaps:
+            raise StopIteration
+        try:
+            (tlen, dummy_diffs, abpos, bbpos, aepos, bepos,
+             flags, aread, bread) = LAS_RECORD.unpack(self.f.read(LAS_RECORD.size))
+            trace = np.frombuffer(self.f.read(tlen * np.dtype(self.trace_dtype).itemsize),
+                                  dtype=self.trace_dtype)
+            self._index += 1
+            # trace is (diffs, b length) of each tspace interval of a.
+            b_lens = [int(x) for x in trace[1::2]]
+
+            is_comp = (flags & COMP_FLAG) != 0
+            aseq = self.query_seqs[aread]
+            bseq = self._target_seq(bread, is_comp)
+            qAln, alnStr, sAln, n_match = trace_to_alignment(
+                aseq, bseq, abpos, aepos, bbpos, bepos, self.tspace, b_lens)
+
+            sLen = len(bseq)
+            # Report target coordinates on the forward strand, as LA4Ice.
+            sStart, sEnd = (sLen - bepos, sLen - bbpos) if is_comp else (bbpos, bepos)
+            return BLASRRecord(qID=aread + 1, qLength=len(aseq),  # 1-based
+                               qStart=abpos, qEnd=aepos, qStrand=0,
+                               sID=bread + 1, sLength=sLen,
+                               sStart=sStart, sEnd=sEnd, sStrand=int(is_comp),
+                               score=-(bepos - bbpos), mapQV=None,
+                               qAln=qAln, alnStr=alnStr, sAln=sAln,
+                               identity=round(100. * n_match / max(1, len(alnStr)), 2),
+                               strand='-' if is_comp else '+')
+        except (IndexError, struct.error, ValueError) as exc:
+            raise ValueError("Unable to read overlap %d of %s: %r." %
+                             (self._index, self.file_name, exc))
@@ -4,7 +4,10 @@ Defines classes for fetching data from a collection of original SMRTCell bam
 files, and for writing bam files.
 """
 
+import os
 import os.path as op
+import json
+import logging
 import numpy as np
 
 from ..libs import AlignmentFile, AlignedSegment, array_to_qualitystring
@@ -13,12 +16,14 @@ from pbcore.io import (SubreadSet, ConsensusReadSet,
                        ContigSet, FastaReader, openDataFile, openDataSet, IndexedBamReader)
 from pbcore.io import BamAlignment
 
-from pbtranscript.Utils import get_files_from_file_or_fofn
+from pbtranscript.Utils import get_files_from_file_or_fofn, realpath, \
+        files_signature
 
 
 __all__ = ["BamCollection",
            "BamHeader",
-           "BamWriter"]
+           "BamWriter",
+           "ZmwIndex"]
 
 
 class BamZmw(object):
@@ -318,6 +323,119 @@ class BamCCSZmwRead(BamZmwRead):
         return "%s/ccs" % self.zmw.zmwName
 
 
+class ZmwIndex(object):
+
+    """
+    Index of (movie, holeNumber) --> rows in the pbi index of a dataset.
+
+    Keys are (movie_index << 32 | holeNumber), sorted, where movie_index
+    is the index of a movie in sorted movie names, so that rows of a zmw
+    are found by binary search and rows of a movie are contiguous.
+    The index can be saved to and loaded from a sidecar .npz file, which
+    is validated against sizes and mtimes of the bam and pbi files.
+    """
+
+    SUFFIX = ".zmwidx.npz"
+
+    def __init__(self, movie_names, keys, rows):
+        self.movie_names = list(movie_names)
+        self._movie_idx = dict((m, i) for i, m in enumerate(self.movie_names))
+        self.keys = keys  # sorted int64 keys
+        self.rows = rows  # rows[i] is the pbi row of keys[i]
+
+    @staticmethod
+    def _key(movie_idx, hole_number):
+        """Return key(s) of (movie_idx, hole_number)."""
+        return (np.asarray(movie_idx, dtype=np.int64) << 32) | \
+                np.asarray(hole_number, dtype=np.int64)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Build index from pbi index of a pbcore dataset."""
+        movie_names = sorted(dataset.movieIds.keys())
+        qid_to_movie_idx = dict((dataset.movieIds[m], i)
+                                for i, m in enumerate(movie_names))
+        qids, inverse = np.unique(dataset.index.qId, return_inverse=True)
+        movie_idx = np.array([qid_to_movie_idx[qid] for qid in qids],
+                             dtype=np.int64)[inverse]
+        keys = cls._key(movie_idx, dataset.index.holeNumber)
+        # stable, so that rows of a zmw are in the same order as in pbi
+        rows = np.argsort(keys, kind='mergesort')
+        return cls(movie_names, keys[rows], rows)
+
+    def rows_of(self, movie, hole_number):
+        """Return pbi rows of zmw movie/hole_number, ascending."""
+        if movie not in self._movie_idx:
+            return self.rows[0:0]
+        key = self._key(self._movie_idx[movie], hole_number)
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key, side='right')
+        return self.rows[lo:hi]
+
+    def zmws_of(self, movie):
+        """Yield pbi rows of each zmw of movie, by ascending hole number."""
+        if movie not in self._movie_idx:
+            return
+        idx = self._movie_idx[movie]
+        lo = np.searchsorted(self.keys, self._key(idx, 0), side='left')
+        hi = np.searchsorted(self.keys, self._key(idx + 1, 0), side='left')
+        bounds = [lo] + list(lo + 1 + np.flatnonzero(np.diff(self.keys[lo:hi]))) + [hi]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                yield self.rows[start:end]
+
+    def __len__(self):
+        """Return number of zmws."""
+        if len(self.keys) == 0:
+            return 0
+        return 1 + int(np.count_nonzero(np.diff(self.keys)))
+
+    def save(self, fn, signature):
+        """Save index and signature of its source files to fn."""
+        tmp_fn = "%s.%d.tmp.npz" % (fn[:-len(".npz")], os.getpid())
+        np.savez(tmp_fn, keys=self.keys, rows=self.rows,
+                 movie_names=np.array(self.movie_names, dtype=str),
+                 signature=np.array(json.dumps(signature)))
+        os.rename(tmp_fn, fn)
+
+    @classmethod
+    def load(cls, fn, signature):
+        """Load index from fn. Return None if fn does not exist, or
+        fn was built from files of a different signature."""
+        if not op.exists(fn):
+            return None
+        try:
+            data = np.load(fn)
+            saved_signature = json.loads(str(data['signature']))
+            if saved_signature != json.loads(json.dumps(signature)):
+                logging.info("Ignore out-of-date zmw index %s.", fn)
+                return None
+            return cls([str(m) for m in data['movie_names']],
+                       data['keys'], data['rows'])
+        except (IOError, ValueError, KeyError) as e:
+            logging.warning("Unable to load zmw index %s: %s", fn, str(e))
+            return None
+
+    @classmethod
+    def load_or_build(cls, dataset, fn, input_fns=()):
+        """Load index from sidecar file fn if it is up to date, otherwise
+        build it from dataset and try to save it to fn.
+        input_fns: input files of dataset, e.g., xml, which are validated
+                   together with bam and pbi files.
+        """
+        bam_fns = [rr.filename for rr in dataset.resourceReaders()]
+        signature = files_signature(list(input_fns) + bam_fns +
+                                    [f + ".pbi" for f in bam_fns])
+        index = cls.load(fn, signature)
+        if index is None:
+            index = cls.from_dataset(dataset)
+            try:
+                index.save(fn, signature)
+            except (IOError, OSError) as e:
+                logging.warning("Unable to save zmw index %s: %s", fn, str(e))
+        return index
+
+
 class BamCollection(object):
     """
     Class wraps PacBio bam fofn or datasets.
@@ -327,12 +445,18 @@ class BamCollection(object):
     ccs dataset.
 
     Note that ALL bam files MUST have pbi index generated.
+
+    Zmws are looked up through a ZmwIndex, which is built on first use
+    and cached in a sidecar file next to the first input file.
     """
 
     def __init__(self, *args):
         if len(args) == 1:
             args = get_files_from_file_or_fofn(args[0])
         self._dataset = openDataFile(*args)
+        self._input_fns = [realpath(fn) for fn in args]
+        self._zmw_index_fn = self._input_fns[0] + ZmwIndex.SUFFIX
+        self._zmw_index = None
         # Implementation notes: find all the bam files, and group
         # them together by movieName
         self._header = BamHeader(ignore_pg=True)
@@ -354,6 +478,14 @@ class BamCollection(object):
         """Return movie names as a list of string."""
         return self._dataset.movieIds.keys()
 
+    @property
+    def zmwIndex(self):
+        """Return ZmwIndex of this collection, load or build it if needed."""
+        if self._zmw_index is None:
+            self._zmw_index = ZmwIndex.load_or_build(
+                self._dataset, self._zmw_index_fn, self._input_fns)
+        return self._zmw_index
+
     @property
     def header(self):
         """Return a BamHeader object which combines headers from
@@ -396,9 +528,10 @@ class BamCollection(object):
             return ds2
 
         _hn = int(indices[1])
-        # for efficiency: first select on hn, then movie name.
-        _reads = self._dataset[self._dataset.index.holeNumber == _hn]
-        _reads = [_read for _read in _reads if _read.movieName == _movie]
+        _rows = self.zmwIndex.rows_of(_movie, _hn)
+        if len(_rows) == 0:
+            raise KeyError("Could not find %s in %s" % (key, str(self._dataset)))
+        _reads = self._dataset[_rows]
         if len(_reads) == 0:
             raise KeyError("Could not find %s in %s" % (key, str(self._dataset)))
 
@@ -418,17 +551,12 @@ class BamCollection(object):
     def __iter__(self):
         """Iterators over Zmw, ZmwRead objects.
         """
-        _qid_hns = np.unique(self._dataset.index[['qId', 'holeNumber']])
         for _movie in self.movieNames:
-            ds2 = self._dataset.copy()
-            ds2.filters.addRequirement(movie=[('==', _movie)])
-            _movie_id = self._dataset.movieIds[_movie]
-            for (__movie_id, _hn) in _qid_hns:
-                if __movie_id == _movie_id:
-                    _reads = ds2[ds2.index.holeNumber == _hn]
-                    assert all([_read.movieName == _movie for _read in _reads])
-                    if len(_reads) > 0:
-                        yield BamZmw(bamRecords=_reads, isCCS=self.isCCS)
+            for _rows in self.zmwIndex.zmws_of(_movie):
+                _reads = self._dataset[_rows]
+                assert all([_read.movieName == _movie for _read in _reads])
+                if len(_reads) > 0:
+                    yield BamZmw(bamRecords=_reads, isCCS=self.isCCS)
 
     def reads(self):
         """Iterate over all reads"""
@@ -461,7 +589,7 @@ class BamCollection(object):
 
     def __len__(self):
         """Return total number of zmws in all movies."""
-        return len(np.unique(self._dataset.index[['qId', 'holeNumber']]))
+        return len(self.zmwIndex)
 
     def close(self):
         """Close all readers."""
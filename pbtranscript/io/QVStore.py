@@ -0,0 +1,297 @@
+"""
+Define QVStore, a columnar store of per-base quality values.
+
+Instead of keeping a Python list of floats for every read and every
+QV type, QVStore keeps one contiguous uint8 array of phred QVs per QV
+name, plus an offset table mapping each read id to its (start, length)
+slice in the arrays and a bit mask of the QV names added for it, so
+that getting a QV name which was never added for a read raises
+KeyError. Probabilities are recovered through a 256-entry
+lookup table, which gives exactly the same doubles as converting every
+QV with 10**(-qv/10.) while using one byte per base.
+
+A store can be saved to disk and loaded back as read-only memory-mapped
+arrays, so that several processes can share the same QVs without
+copying them.
+
+Removing a read only drops its offset; its bases stay in the columns
+as garbage until there is more garbage than live bases, and the store
+compacts itself, so that removal is O(1) amortized.
+
+IdTable keeps the read ids of a QV holder (e.g., ProbFromQV.seqids),
+with O(1) add, remove and lookup.
+
+Example:
+    store = QVStore()
+    store.add('m/1/0_10_CCS', 'DeletionQV', np.array([10, 20, ...]))
+    store.get('m/1/0_10_CCS', 'DeletionQV')     ==> array of probs
+    store.get('m/1/0_10_CCS', 'DeletionQV', 3)  ==> prob at position 3
+    store.save('qvs')
+    shared = QVStore.load('qvs', mmap=True)
+"""
+
+import os.path as op
+import cPickle
+import numpy as np
+
+__all__ = ["QVStore", "IdTable", "qvs_to_probs"]
+
+
+# PROB_OF_QV[qv] == 10 ** (-qv / 10.), for every possible uint8 QV.
+PROB_OF_QV = np.power(10., -np.arange(256, dtype=np.float64) / 10.)
+
+
+def qvs_to_probs(qvs):
+    """Convert an array of phred QVs to an array of error probabilities."""
+    return PROB_OF_QV[np.asarray(qvs, dtype=np.uint8)]
+
+
+class QVStore(object):
+
+    """
+    A columnar, append-only store of uint8 QVs.
+
+    self.offsets: seqid --> (start, length, mask), where start and
+                  length are the slice of seqid in every column, and
+                  mask has the bits of QV names added for seqid.
+    self.columns: qv_name --> uint8 array, only the first self.size
+                  elements of which are in use.
+    self.qv_bits: qv_name --> bit of qv_name in masks.
+    """
+
+    INITIAL_CAPACITY = 1 << 16
+
+    def __init__(self):
+        self.offsets = {}
+        self.columns = {}
+        self.qv_bits = {}
+        # bits of dropped QV names are not reused
+        self.next_bit = 1
+        # number of elements in use, the same for all columns
+        self.size = 0
+        # number of elements of removed reads, not reclaimed yet
+        self.garbage = 0
+
+    def __contains__(self, seqid):
+        return seqid in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def qv_names(self):
+        """Return names of all QV columns in this store."""
+        return self.columns.keys()
+
+    def has(self, seqid, qv_name):
+        """Return True if QVs of read seqid, type qv_name are in the store."""
+        return seqid in self.offsets and qv_name in self.qv_bits and \
+            (self.offsets[seqid][2] & self.qv_bits[qv_name]) != 0
+
+    def _slice(self, seqid, qv_name):
+        """Return (start, length) of QVs of read seqid, type qv_name,
+        raise KeyError if they are not in the store."""
+        if not self.has(seqid, qv_name):
+            raise KeyError("{q} of {s} is not in QVStore.".
+                           format(q=qv_name, s=seqid))
+        return self.offsets[seqid][:2]
+
+    def _reserve(self, qv_name, capacity):
+        """Make sure column qv_name is writable and holds capacity elements."""
+        column = self.columns.get(qv_name, None)
+        if column is None:
+            self.columns[qv_name] = np.zeros(max(capacity, self.INITIAL_CAPACITY),
+                                             dtype=np.uint8)
+        elif capacity > len(column) or not column.flags.writeable:
+            # grow geometrically, also copies memory-mapped columns
+            # into memory before they are modified.
+            new_column = np.zeros(max(capacity, 2 * len(column)), dtype=np.uint8)
+            new_column[:len(column)] = column
+            self.columns[qv_name] = new_column
+
+    def add(self, seqid, qv_name, qvs):
+        """
+        Add QVs of read seqid, type qv_name to the store.
+        QVs of all types of a read must have the same length.
+        """
+        qvs = np.asarray(qvs, dtype=np.uint8)
+        if seqid in self.offsets and self.offsets[seqid][1] != len(qvs):
+            raise ValueError("Length of {q} of {s} is {n}, expecting {l}."
+                             .format(q=qv_name, s=seqid, n=len(qvs),
+                                     l=self.offsets[seqid][1]))
+        if seqid not in self.offsets:
+            # A new read is appended to the end of all columns.
+            self.offsets[seqid] = (self.size, len(qvs), 0)
+            self.size += len(qvs)
+            for name in self.columns.keys():
+                self._reserve(name, self.size)
+        self._reserve(qv_name, self.size)
+        if qv_name not in self.qv_bits:
+            self.qv_bits[qv_name] = self.next_bit
+            self.next_bit <<= 1
+        start, length, mask = self.offsets[seqid]
+        self.columns[qv_name][start:start + length] = qvs
+        self.offsets[seqid] = (start, length, mask | self.qv_bits[qv_name])
+
+    def get_qvs(self, seqid, qv_name):
+        """Return uint8 QVs of read seqid, type qv_name, as an array view."""
+        start, length = self._slice(seqid, qv_name)
+        return self.columns[qv_name][start:start + length]
+
+    def get(self, seqid, qv_name, position=None):
+        """
+        Return error probability of read seqid, type qv_name.
+        If position is None, return probabilities of all bases as
+        a float64 array, otherwise return probability at position.
+        Raise KeyError if QVs of seqid, type qv_name are not in the store.
+        """
+        start, length = self._slice(seqid, qv_name)
+        column = self.columns[qv_name]
+        if position is None:
+            return PROB_OF_QV[column[start:start + length]]
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError("Position {p} out of range of {s} ({l} bp)."
+                             .format(p=position, s=seqid, l=length))
+        return PROB_OF_QV[column[start + position]]
+
+    def mean(self, seqid, qv_name):
+        """Return mean error probability of read seqid, type qv_name."""
+        return float(self.get(seqid, qv_name).mean())
+
+    def remove(self, seqid):
+        """
+        Remove read seqid. Its space is reclaimed by compact(), which is
+        called when more than half of the elements in use are garbage,
+        unless columns are memory-mapped.
+        """
+        self.garbage += self.offsets.pop(seqid)[1]
+        if self.garbage > self.INITIAL_CAPACITY and 2 * self.garbage > self.size and \
+           all(column.flags.writeable for column in self.columns.itervalues()):
+            self.compact()
+
+    def drop(self, qv_name):
+        """Remove QV column qv_name for all reads."""
+        self.columns.pop(qv_name, None)
+        self.qv_bits.pop(qv_name, None)
+
+    def compact(self):
+        """Rewrite columns so that they only contain reads in the store."""
+        seqids = sorted(self.offsets, key=lambda k: self.offsets[k][0])
+        total = sum(self.offsets[seqid][1] for seqid in seqids)
+        for qv_name, column in self.columns.iteritems():
+            new_column = np.zeros(max(total, 1), dtype=np.uint8)
+            pos = 0
+            for seqid in seqids:
+                start, length = self.offsets[seqid][:2]
+                new_column[pos:pos + length] = column[start:start + length]
+                pos += length
+            self.columns[qv_name] = new_column
+        self.size = total
+        self.garbage = 0
+        pos = 0
+        for seqid in seqids:
+            dummy_start, length, mask = self.offsets[seqid]
+            self.offsets[seqid] = (pos, length, mask)
+            pos += length
+
+    @staticmethod
+    def _index_fn(prefix):
+        """Return file name of the offset table of a saved store."""
+        return prefix + ".qvidx"
+
+    @staticmethod
+    def _column_fn(prefix, qv_name):
+        """Return file name of a QV column of a saved store."""
+        return "{p}.{q}.npy".format(p=prefix, q=qv_name)
+
+    def save(self, prefix):
+        """Compact and save this store to files starting with prefix."""
+        self.compact()
+        for qv_name, column in self.columns.iteritems():
+            np.save(self._column_fn(prefix, qv_name),
+                    column[:self.size])
+        with open(self._index_fn(prefix), 'wb') as f:
+            cPickle.dump({'offsets': self.offsets, 'size': self.size,
+                          'qv_names': self.columns.keys(),
+                          'qv_bits': self.qv_bits, 'next_bit': self.next_bit},
+                         f, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """
+        Load a store saved by save(prefix). If mmap is True, columns
+        are memory-mapped read-only, and only copied into memory when
+        new reads are added.
+        """
+        if not op.exists(cls._index_fn(prefix)):
+            raise IOError("QVStore index {f} does not exist.".
+                          format(f=cls._index_fn(prefix)))
+        with open(cls._index_fn(prefix), 'rb') as f:
+            index = cPickle.load(f)
+        store = cls()
+        store.offsets = index['offsets']
+        store.size = index['size']
+        store.qv_bits = index['qv_bits']
+        store.next_bit = index['next_bit']
+        for qv_name in index['qv_names']:
+            column = np.load(cls._column_fn(prefix, qv_name),
+                             mmap_mode='r' if mmap else None)
+            store.columns[qv_name] = column
+        return store
+
+
+class IdTable(object):
+
+    """
+    A set of ids which keeps them in slots of a list, in order of add
+    except that new ids reuse slots of removed ids first.
+
+    self.slots: slot --> id, or None (a tombstone) if removed
+    self.index: id --> slot
+    self.free: slots of removed ids, to be reused
+    """
+
+    def __init__(self, ids=()):
+        self.slots = []
+        self.index = {}
+        self.free = []
+        self.extend(ids)
+
+    def __contains__(self, _id):
+        return _id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return (_id for _id in self.slots if _id is not None)
+
+    def __iadd__(self, ids):
+        self.extend(ids)
+        return self
+
+    def add(self, _id):
+        """Add _id, if it is not in the table."""
+        if _id in self.index:
+            return
+        if len(self.free) > 0:
+            slot = self.free.pop()
+            self.slots[slot] = _id
+        else:
+            slot = len(self.slots)
+            self.slots.append(_id)
+        self.index[_id] = slot
+
+    def extend(self, ids):
+        """Add ids."""
+        for _id in ids:
+            self.add(_id)
+
+    def remove(self, _id):
+        """Remove _id, raise ValueError if it is not in the table."""
+        slot = self.index.pop(_id, None)
+        if slot is None:
+            raise ValueError("{i} is not in IdTable.".format(i=_id))
+        self.slots[slot] = None
+        self.free.append(slot)
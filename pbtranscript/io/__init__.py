@@ -1,5 +1,6 @@
 #*from __future__ import absolute_import
 
+from .FaidxIndex import *
 from .FastaRandomReader import *
 from .FastqRandomReader import *
 from .FastaSplitter import *
@@ -8,9 +9,10 @@ from .BLASRRecord import *
 from .ReadAnnotation import *
 from .PbiBamIO import *
 from .LA4IceReader import *
+from .LasReader import *
 from .DazzIDHandler import DazzIDHandler
 from .ContigSetReaderWrapper import ContigSetReaderWrapper
-from .SAMReaders import GMAPSAMReader, GMAPSAMRecord, iter_gmap_sam
+from .SAMReaders import GMAPSAMReader, GMAPSAMRecord, iter_gmap_sam, gmap_sam_to_bam
 from .GroupIO import *
 from .GffIO import *
 from .ReadStatIO import *
@@ -3,6 +3,7 @@
 
 from pysam import array_to_qualitystring, Samfile
 from pysam import index as pysam_index
+from pysam import sort as pysam_sort
 
 try:
     from pysam.libcalignmentfile import AlignmentFile
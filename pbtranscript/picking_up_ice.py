@@ -3,11 +3,12 @@ import os.path as op
 import sys
 import logging
 from argparse import ArgumentParser
-from cPickle import load, dump
+from cPickle import dump
 from pbcore.io.FastaIO import FastaReader, FastaWriter
 from pbtranscript.ice.ProbModel import ProbFromModel, ProbFromFastq
 import pbtranscript.ice.IceIterative as ice
 from pbtranscript.ice.IceUtils import ice_fa2fq, realpath
+from pbtranscript.ice.IceCheckpoint import IceCheckpoint, load_ice_state
 from pbtranscript.PBTranscriptOptions import add_fofn_arguments
 
 FORMATTER = op.basename(__file__) + ':%(levelname)s:'+'%(message)s'
@@ -20,7 +21,8 @@ __author__ = "etseng@pacificbiosciences.com"
 
 def add_picking_up_ice_arguments(parser):
     """Add arguments for picking up ice."""
-    helpstr = "Last successful pickle (e.g., clusterOut/output/input.split_001.fa.pickle)"
+    helpstr = "Last successful pickle (e.g., clusterOut/output/input.split_001.fa.pickle), " + \
+              "or ICE checkpoint (e.g., clusterOut/output/ice.checkpoint)"
     parser.add_argument("pickle_filename", help=helpstr)
 
     helpstr = "root dir (default: cluster_out/)"
@@ -55,8 +57,13 @@ def ensure_pickle_goodness(pickle_filename, root_dir, fasta_files_to_add=None):
     Old versions of IceIterative.write_pickle is missing some key/values.
     Add if needed.
     Return a good pickle object, and the pickle's filename
+    pickle_filename can also be an ICE checkpoint, in which case the
+    pickle is written to <checkpoint prefix>.pickle.
     """
-    a = load(open(pickle_filename))
+    a = load_ice_state(pickle_filename)
+    checkpoint_prefix = IceCheckpoint.prefix_of(pickle_filename)
+    if checkpoint_prefix is not None:
+        pickle_filename = checkpoint_prefix + ".pickle"
     if realpath(a['fasta_filename']) != current_fasta(root_dir):
         raise ValueError("The pickle file %s indicates that " % pickle_filename +
                          "current.fasta is not being used. ICE likely did not " +
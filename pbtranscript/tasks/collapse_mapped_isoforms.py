@@ -59,6 +59,9 @@ class Constants(object):
 
     SKIP_5_EXON_ALT_DEFAULT = False
 
+    NPROC_DEFAULT = 1
+    NPROC_DESC = "Number of processes to collapse isoforms (default: %s)" % NPROC_DEFAULT
+
 
 def add_collapse_mapped_isoforms_io_arguments(arg_parser):
     """Add arguments for collapse isoforms."""
@@ -104,6 +107,10 @@ def add_collapse_mapped_isoforms_arguments(arg_parser):
     coll_group.add_argument("--skip_5_exon_alt", dest="skip_5_exon_alt",
                             default=Constants.SKIP_5_EXON_ALT_DEFAULT,
                             action="store_true", help=argparse.SUPPRESS)
+
+    coll_group.add_argument("--collapse_nproc", dest="collapse_nproc", type=int,
+                            default=Constants.NPROC_DEFAULT,
+                            help=Constants.NPROC_DESC)
     return arg_parser
 
 
@@ -117,7 +124,8 @@ def args_runner(args):
                                min_flnc_coverage=args.min_flnc_coverage,
                                max_fuzzy_junction=args.max_fuzzy_junction,
                                allow_extra_5exon=args.allow_extra_5exon,
-                               skip_5_exon_alt=args.skip_5_exon_alt)
+                               skip_5_exon_alt=args.skip_5_exon_alt,
+                               nproc=args.collapse_nproc)
     c.run()
 
     if args.collapsed_isoforms is not None:
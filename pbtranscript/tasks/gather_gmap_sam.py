@@ -13,7 +13,7 @@ from pbcoretools.chunking.gather import get_datum_from_chunks_by_chunk_key
 
 from pbtranscript.__init__ import get_version
 from pbtranscript.Utils import rmpath
-from pbtranscript.collapsing import concatenate_sam, sort_sam
+from pbtranscript.collapsing import concatenate_sam, sort_sam, merge_sorted_sam
 
 log = logging.getLogger(__name__)
 
@@ -57,6 +57,14 @@ def run_main(chunk_json, sam_output, chunk_key):
     sam_files = get_datum_from_chunks_by_chunk_key(chunks, chunk_key)
     log.debug("Chunked SAM files are %s.", (', '.join(sam_files)))
 
+    # chunked SAM files are sorted by map_isoforms_to_genome, k-way merge them
+    try:
+        log.info("Merge sorted chunked SAM files to %s.", sam_output)
+        merge_sorted_sam(sam_files, sam_output)
+        return 0
+    except ValueError:
+        log.warn("Chunked SAM files are not sorted, concatenate and sort them.")
+
     log.info("Concatenate chunked SAM files to %s.", sam_output)
 
     # concatenate sam files
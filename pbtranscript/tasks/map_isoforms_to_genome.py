@@ -15,6 +15,7 @@ from pbcommand.utils import setup_log
 
 from pbtranscript.PBTranscriptOptions import get_base_contract_parser
 from pbtranscript.collapsing.CollapsingUtils import map_isoforms_and_sort
+from pbtranscript.collapsing.SamSorter import SORT_MAX_MEMORY_DEFAULT
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +34,10 @@ class Constants(object):
     GMAP_NPROC_ID = "pbtranscript.task_options.gmap_nproc"
     GMAP_NPROC_DEFAULT = 24
 
+    SORT_MAX_MEMORY_MB_DEFAULT = SORT_MAX_MEMORY_DEFAULT / (1024 * 1024)
+
+    GMAP_SHARDS_DEFAULT = 1
+
 
 def add_map_isoforms_io_arguments(arg_parser):
     """Add io arguments"""
@@ -40,7 +45,8 @@ def add_map_isoforms_io_arguments(arg_parser):
     arg_parser.add_argument("input_filename", type=str,
                             help=helpstr)
 
-    helpstr = "Output SAM file mapping isoforms to reference using GMAP."
+    helpstr = "Output SAM file mapping isoforms to reference using GMAP, " + \
+              "or an indexed BAM file if it ends with .bam."
     arg_parser.add_argument("sam_filename", type=str,
                             help=helpstr)
 
@@ -66,6 +72,17 @@ def add_gmap_arguments(arg_parser):
     gmap_group.add_argument("--gmap_nproc", type=int,
                             default=Constants.GMAP_NPROC_DEFAULT, help=helpstr)
 
+    helpstr = "Memory in MB to sort GMAP output (default: %s)" % \
+              Constants.SORT_MAX_MEMORY_MB_DEFAULT
+    gmap_group.add_argument("--sort_max_memory", type=int,
+                            default=Constants.SORT_MAX_MEMORY_MB_DEFAULT, help=helpstr)
+
+    helpstr = "Split isoforms into this many shards, map shards by parallel GMAP " + \
+              "processes sharing gmap_nproc threads, retry failed shards and " + \
+              "merge sorted outputs (default: %s)" % Constants.GMAP_SHARDS_DEFAULT
+    gmap_group.add_argument("--gmap_shards", type=int,
+                            default=Constants.GMAP_SHARDS_DEFAULT, help=helpstr)
+
     return arg_parser
 
 
@@ -93,7 +110,9 @@ def args_runner(args):
                           sam_filename=args.sam_filename,
                           gmap_db_dir=gmap_db_dir,
                           gmap_db_name=gmap_db_name,
-                          gmap_nproc=args.gmap_nproc)
+                          gmap_nproc=args.gmap_nproc,
+                          sort_max_memory=args.sort_max_memory * 1024 * 1024,
+                          gmap_shards=args.gmap_shards)
     return 0
 
 
@@ -288,7 +288,9 @@ def args_runner(args):
     # (4) map HQ isoforms to GMAP reference genome
     map_isoforms_and_sort(input_filename=tofu_f.all_hq_fq, sam_filename=tofu_f.sorted_gmap_sam,
                           gmap_db_dir=args.gmap_db, gmap_db_name=args.gmap_name,
-                          gmap_nproc=args.gmap_nproc)
+                          gmap_nproc=args.gmap_nproc,
+                          sort_max_memory=args.sort_max_memory * 1024 * 1024,
+                          gmap_shards=args.gmap_shards)
 
     # (5) post mapping to genome analysis, including
     #     * collapse polished HQ isoform clusters into groups
@@ -310,7 +312,8 @@ def args_runner(args):
         out_group=args.group_fn, out_read_stat=args.read_stat_fn,
         min_aln_coverage=args.min_aln_coverage, min_aln_identity=args.min_aln_identity,
         min_flnc_coverage=args.min_flnc_coverage, max_fuzzy_junction=args.max_fuzzy_junction,
-        allow_extra_5exon=args.allow_extra_5exon, min_count=args.min_count)
+        allow_extra_5exon=args.allow_extra_5exon, min_count=args.min_count,
+        nproc=args.collapse_nproc)
 
     return 0
 
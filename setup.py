@@ -18,12 +18,18 @@ if 'setuptools.extension' in sys.modules:
 
 ext_modules = [Extension("pbtranscript.findECE",
                          ["pbtranscript/ice/C/findECE.pyx"]),
+               Extension("pbtranscript.ice.c_pClique",
+                         ["pbtranscript/ice/C/c_pClique.pyx"]),
                Extension("pbtranscript.ice.ProbModel",
                          ["pbtranscript/ice/C/ProbModel.pyx"], language="c++"),
                Extension("pbtranscript.io.c_basQV",
                          ["pbtranscript/ice/C/c_basQV.pyx"], language="c++"),
                Extension("pbtranscript.io.SAMReaders",
                          ["pbtranscript/io/C/SAMReaders.pyx"], language="c++"),
+               Extension("pbtranscript.c_primer",
+                         ["pbtranscript/C/c_primer.pyx"]),
+               Extension("pbtranscript.io.c_las",
+                         ["pbtranscript/io/C/c_las.pyx"]),
                Extension("pbtranscript.collapsing.intersection_unique",
                          ["pbtranscript/collapsing/C/intersection_unique.pyx"], language="c++"),
                Extension("pbtranscript.collapsing.intersection",
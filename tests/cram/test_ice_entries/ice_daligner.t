@@ -18,3 +18,15 @@ Set up
 
   $ ls $out_dir/*.out | wc -l
   8
+
+  $ rm -rf $out_dir && mkdir -p $out_dir
+  $ cp $query $oquery && cp $target $otarget
+
+  $ ice_daligner.py $oquery $otarget $out_dir --las_only && echo $?
+  0
+
+  $ ls $out_dir/*.las | wc -l
+  8
+
+  $ ls $out_dir/*.out 2>/dev/null | wc -l
+  0
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark pbtranscript.collapsing.iterative_merge_transcripts on synthetic
+high-depth loci, against the previous pairwise implementation, and check
+that both produce identical merged transcripts.
+
+Usage:
+    python bench_merge_transcripts.py [--depths 100,1000,5000] [--seed 0]
+"""
+import sys
+import time
+import random
+import argparse
+from collections import namedtuple
+import numpy as np
+
+from pbtranscript.collapsing.CollapsingUtils import compare_exon_matrix, \
+    iterative_merge_transcripts
+
+Node = namedtuple("Node", ["start", "end"])
+
+
+def make_locus(depth, num_exons=30, num_isoforms=20, seed=0):
+    """
+    Return (result_list, node_d) of a synthetic locus, where node_d maps
+    exon index --> Node, and result_list contains depth transcripts
+    drawn from num_isoforms isoforms, with random 5' and 3' truncation,
+    as collapse_sam_records makes them.
+    """
+    rng = random.Random(seed)
+    node_d, pos = {}, 0
+    for e in xrange(num_exons):
+        # about one third of exons are adjacent to the previous exon
+        pos += 0 if e > 0 and rng.random() < 0.3 else rng.randint(50, 500)
+        node_d[e] = Node(pos, pos + rng.randint(30, 300))
+        pos = node_d[e].end
+    isoforms = []
+    for dummy_i in xrange(num_isoforms):
+        first = rng.randint(0, num_exons / 3)
+        last = rng.randint(2 * num_exons / 3, num_exons - 1)
+        isoforms.append([e for e in xrange(first, last + 1)
+                         if e in (first, last) or rng.random() < 0.7])
+    result_list = []
+    for n in xrange(depth):
+        iso = isoforms[rng.randint(0, num_isoforms - 1)]
+        lo = rng.randint(0, min(2, len(iso) - 1))
+        hi = len(iso) - rng.randint(0, min(2, len(iso) - lo - 1))
+        m = np.zeros((1, num_exons), dtype=np.int)
+        m[0, iso[lo:hi]] = 1
+        result_list.append(("r%d" % n, '+' if rng.random() < 0.8 else '-', m))
+    return result_list, node_d
+
+
+def pairwise_merge_transcripts(result_list, node_d, merge5=True):
+    """The previous implementation, comparing exon matrices of all
+    overlapping pairs."""
+    result_list.sort(key=lambda x: (x[1], x[2].nonzero()[1][0]))
+    i = 0
+    while i < len(result_list) - 1:
+        j = i + 1
+        while j < len(result_list):
+            id1, strand1, m1 = result_list[i]
+            id2, strand2, m2 = result_list[j]
+            if (strand1 != strand2) or (m1.nonzero()[1][-1] < m2.nonzero()[1][0]):
+                break
+            else:
+                flag, m3 = compare_exon_matrix(m1, m2, node_d, strand1, merge5)
+                if flag:
+                    result_list[i] = (id1+','+id2, strand1, m3)
+                    result_list.pop(j)
+                else:
+                    j += 1
+        i += 1
+
+
+def _copy(result_list):
+    """Deep copy exon matrices, which are merged in place."""
+    return [(qid, strand, m.copy()) for qid, strand, m in result_list]
+
+
+def _to_exon_lists(result_list):
+    """Convert exon matrices to sorted arrays of exon indices."""
+    return [(qid, strand, m.nonzero()[1]) for qid, strand, m in result_list]
+
+
+def _same(a, b):
+    """Return True if two merged result lists are identical."""
+    return len(a) == len(b) and all(
+        x[0] == y[0] and x[1] == y[1] and list(x[2]) == list(y[2]) for x, y in zip(a, b))
+
+
+def run(depths, seed, merge5=True):
+    """Print run time of both implementations at each depth."""
+    print "depth\ttranscripts\tpairwise(s)\tindexed(s)\tspeedup"
+    for depth in depths:
+        result_list, node_d = make_locus(depth=depth, seed=seed)
+        old, new = _copy(result_list), _to_exon_lists(result_list)
+        start_t = time.time()
+        pairwise_merge_transcripts(old, node_d, merge5)
+        old_t = time.time() - start_t
+        start_t = time.time()
+        iterative_merge_transcripts(new, node_d, merge5)
+        new_t = time.time() - start_t
+        if not _same(_to_exon_lists(old), new):
+            raise AssertionError("Merged transcripts differ at depth %d" % depth)
+        print "%d\t%d\t%.3f\t%.3f\t%.1fx" % (depth, len(new), old_t, new_t,
+                                              old_t / max(new_t, 1e-6))
+    return 0
+
+
+def main(args=sys.argv[1:]):
+    """Main"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--depths", default="100,1000,5000", type=str,
+                        help="Comma separated numbers of transcripts per locus")
+    parser.add_argument("--seed", default=0, type=int, help="Random seed")
+    parser.add_argument("--no_merge5", default=False, action="store_true",
+                        help="Do not merge shorter 5' transcripts")
+    args = parser.parse_args(args)
+    return run(depths=[int(d) for d in args.depths.split(',')], seed=args.seed,
+               merge5=not args.no_merge5)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
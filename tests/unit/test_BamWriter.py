@@ -5,9 +5,10 @@ import unittest
 import os.path as op
 import hashlib
 import time
+import numpy as np
 
 from pbtranscript.Utils import make_pbi
-from pbtranscript.io.PbiBamIO import BamCollection, BamHeader, BamWriter, BamZmwRead
+from pbtranscript.io.PbiBamIO import BamCollection, BamHeader, BamWriter, BamZmwRead, ZmwIndex
 from pbcore.io import BamAlignment, IndexedBamReader, readFofn, ConsensusReadSet
 from test_setpath import OUT_DIR, STD_DIR
 from pbcore.util.Process import backticks
@@ -245,3 +246,36 @@ class TestIO(unittest.TestCase):
         with ConsensusReadSet(dataset_xml) as ds:
             for read in ds:
                 self.assertEqual(bc[read.qName].readName, read.qName)
+
+
+class TestZmwIndex(unittest.TestCase):
+    """Test pbtranscript.io.PbiBamIO.ZmwIndex."""
+    def setUp(self):
+        """Define an index of 2 movies with rows in pbi order."""
+        # pbi rows: (mB, 3), (mA, 7), (mB, 3), (mA, 1), (mB, 10)
+        movie_idx = np.array([1, 0, 1, 0, 1])
+        hns = np.array([3, 7, 3, 1, 10])
+        keys = ZmwIndex._key(movie_idx, hns)
+        rows = np.argsort(keys, kind='mergesort')
+        self.index = ZmwIndex(["mA", "mB"], keys[rows], rows)
+
+    def test_rows_of(self):
+        """Test ZmwIndex.rows_of"""
+        self.assertEqual(list(self.index.rows_of("mB", 3)), [0, 2])
+        self.assertEqual(list(self.index.rows_of("mA", 7)), [1])
+        self.assertEqual(list(self.index.rows_of("mA", 3)), [])
+        self.assertEqual(list(self.index.rows_of("mC", 3)), [])
+
+    def test_zmws_of(self):
+        """Test ZmwIndex.zmws_of and __len__"""
+        self.assertEqual([list(r) for r in self.index.zmws_of("mA")], [[3], [1]])
+        self.assertEqual([list(r) for r in self.index.zmws_of("mB")], [[0, 2], [4]])
+        self.assertEqual(len(self.index), 4)
+
+    def test_save_load(self):
+        """Test ZmwIndex.save and load"""
+        fn = op.join(OUT_DIR, "test_ZmwIndex" + ZmwIndex.SUFFIX)
+        self.index.save(fn, signature=[["a.bam", 10, 100]])
+        loaded = ZmwIndex.load(fn, signature=[["a.bam", 10, 100]])
+        self.assertEqual(list(loaded.rows_of("mB", 3)), [0, 2])
+        self.assertTrue(ZmwIndex.load(fn, signature=[["a.bam", 11, 100]]) is None)
@@ -3,13 +3,15 @@ from __future__ import print_function
 import unittest
 import os.path as op
 import cPickle
+import random
 import filecmp
 import numpy as np
 from pbcore.io.GffIO import Gff3Record
 from pbtranscript.Utils import rmpath, mkdir
 from pbtranscript.io import ContigSetReaderWrapper, iter_gmap_sam, GroupWriter, CollapseGffWriter
 from pbtranscript.collapsing import Branch, ContiVec, transfrag_to_contig, \
-        exons_match_sam_record, compare_exon_matrix, get_fl_from_id, collapse_sam_records
+        exons_match_sam_record, compare_exon_matrix, get_fl_from_id, collapse_sam_records, \
+        iterative_merge_transcripts
 from test_setpath import DATA_DIR, OUT_DIR, SIV_DATA_DIR, SIV_STD_DIR
 
 _OUT_DIR_ = op.join(OUT_DIR, "test_branch")
@@ -140,8 +142,61 @@ class TEST_Branch(unittest.TestCase):
         self.assertFalse(compare_exon_matrix(ms[0], mx, strand='+', node_d=node_d)[0])
 
     def test_iterative_merge_transcripts(self):
-        """No test yet"""
-        pass # skip
+        """
+        Test iterative_merge_transcripts, which merges compatible transcripts,
+        represented by sorted arrays of exon indices, and must produce the same
+        result as comparing exon matrices of all overlapping pairs.
+        """
+        exons = _get_exons() # contains 10 intervals
+        p = []
+        exons.traverse(p.append)
+        node_d = dict((x.interval.value, x) for x in p) # exon index --> exon node
+
+        def _pairwise_merge(result_list, merge5):
+            """Merge all overlapping pairs of transcripts, in sorted order."""
+            result_list.sort(key=lambda x: (x[1], x[2].nonzero()[1][0]))
+            i = 0
+            while i < len(result_list) - 1:
+                j = i + 1
+                while j < len(result_list):
+                    id1, strand1, m1 = result_list[i]
+                    id2, strand2, m2 = result_list[j]
+                    if strand1 != strand2 or m1.nonzero()[1][-1] < m2.nonzero()[1][0]:
+                        break
+                    flag, m3 = compare_exon_matrix(m1, m2, node_d, strand1, merge5)
+                    if flag:
+                        result_list[i] = (id1 + ',' + id2, strand1, m3)
+                        result_list.pop(j)
+                    else:
+                        j += 1
+                i += 1
+
+        # exon matrices of groups[0]["+"], which are all compatible with the first
+        ms = [[0, 0, 1, 1, 0, 1, 0, 1, 1, 0], [1, 1, 1, 1, 0, 1, 0, 1, 1, 1],
+              [0, 1, 1, 1, 0, 1, 0, 1, 0, 0], [0, 0, 0, 1, 0, 1, 0, 1, 1, 1],
+              [0, 1, 1, 1, 0, 1, 0, 1, 1, 1]]
+        result_list = [("r%d" % i, '+', np.flatnonzero(m)) for i, m in enumerate(ms)]
+        iterative_merge_transcripts(result_list, node_d, True)
+        self.assertEqual(len(result_list), 1)
+        self.assertEqual(result_list[0][0], "r1,r2,r4,r0,r3")
+        self.assertEqual(list(result_list[0][2]), [0, 1, 2, 3, 5, 7, 8, 9])
+
+        rng = random.Random(0)
+        for dummy_iter in xrange(50):
+            rows = []
+            for i in xrange(rng.randint(1, 40)):
+                start = rng.randint(0, 8)
+                end = rng.randint(start, 9)
+                m = [1 if start <= e <= end and (e in (start, end) or rng.random() < 0.7)
+                     else 0 for e in xrange(0, 10)]
+                rows.append(("r%d" % i, rng.choice('+-'), np.asarray([m])))
+            for merge5 in (True, False):
+                expected = [(qid, s, m.copy()) for qid, s, m in rows]
+                _pairwise_merge(expected, merge5)
+                result_list = [(qid, s, m.nonzero()[1]) for qid, s, m in rows]
+                iterative_merge_transcripts(result_list, node_d, merge5)
+                self.assertEqual([(r[0], r[1], list(r[2])) for r in result_list],
+                                 [(r[0], r[1], list(r[2].nonzero()[1])) for r in expected])
 
     def test_get_fl_from_id(self):
         """Test get_fl_from_id(list_of_ids)"""
@@ -238,3 +293,30 @@ class TEST_Branch(unittest.TestCase):
         self.assertTrue(filecmp.cmp(good_gff_fn, std_good_gff_fn))
         self.assertTrue(filecmp.cmp(bad_gff_fn, std_bad_gff_fn))
         self.assertTrue(filecmp.cmp(group_fn, std_group_fn))
+
+    def test_Branch_nproc(self):
+        """Test Branch.run collapsing shards by multiple processes,
+        outputs must be identical to running by a single process."""
+        test_name = "test_branch"
+        b = Branch(isoform_filename=READS_DS, sam_filename=SORTED_GMAP_SAM,
+                   cov_threshold=2, min_aln_coverage=0.99, min_aln_identity=0.95)
+
+        shards = [s for s in b.iter_shards(ignored_ids_writer=None, shard_num_records=1)]
+        cuff_indices = [cuff_index for shard in shards for cuff_index, dummy in shard]
+        self.assertEqual(cuff_indices, range(1, len(cuff_indices) + 1))
+        for shard in shards:
+            self.assertEqual(len(set(records[0].sID for dummy, records in shard)), 1)
+
+        good_gff_fn = op.join(_OUT_DIR_, test_name + ".nproc.good.gff.unfuzzy")
+        bad_gff_fn = op.join(_OUT_DIR_, test_name + ".nproc.bad.gff.unfuzzy")
+        group_fn = op.join(_OUT_DIR_, test_name + ".nproc.group.txt.unfuzzy")
+        b.run(allow_extra_5exon=True, skip_5_exon_alt=False,
+              ignored_ids_fn=None,
+              good_gff_fn=good_gff_fn,
+              bad_gff_fn=bad_gff_fn,
+              group_fn=group_fn, nproc=4)
+
+        std_dir = op.join(SIV_STD_DIR, "test_branch")
+        self.assertTrue(filecmp.cmp(good_gff_fn, op.join(std_dir, test_name + ".good.gff.unfuzzy")))
+        self.assertTrue(filecmp.cmp(bad_gff_fn, op.join(std_dir, test_name + ".bad.gff.unfuzzy")))
+        self.assertTrue(filecmp.cmp(group_fn, op.join(std_dir, test_name + ".group.txt.unfuzzy")))
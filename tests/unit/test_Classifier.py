@@ -3,7 +3,9 @@
 import unittest
 import os
 import os.path as op
+import random
 from pbtranscript.Classifier import Classifier, PBRead
+from pbtranscript.Utils import mknewdir, revcmp
 from pbtranscript.io.DOMIO import DOMRecord
 from collections import namedtuple
 from test_setpath import DATA_DIR, OUT_DIR, STD_DIR
@@ -90,6 +92,85 @@ class Test_Classifier(unittest.TestCase):
         self.assertTrue(filecmp.cmp(frontFN, stdoutFrontFN))
         self.assertTrue(filecmp.cmp(backFN, stdoutBackFN))
 
+    def test_startPhmmers(self):
+        """Test function _startPhmmers() runs chunks on a pool of workers,
+        and merges chunked dom files in order."""
+        class FakeClassifier(Classifier):
+            """Copy reads to dom instead of calling phmmer."""
+            def _phmmer(self, reads_fn, domFN, primer_fn, pbmaxtrixFN):
+                with open(reads_fn) as reader, open(domFN, 'w') as writer:
+                    writer.write(reader.read())
+
+        obj = FakeClassifier(cpus=2)
+        self.assertEqual(obj._numPhmmerChunks(3), 3)
+        self.assertEqual(obj._numPhmmerChunks(1000), 8)
+        self.assertEqual(obj._numPhmmerChunks(0), 1)
+
+        reads_fns = [op.join(self.outDir, "test_startPhmmers.%d.fasta" % i)
+                     for i in range(5)]
+        dom_fns = [fn + ".dom" for fn in reads_fns]
+        for i, fn in enumerate(reads_fns):
+            with open(fn, 'w') as writer:
+                writer.write("chunk%d\n" % i)
+        out_dom_fn = op.join(self.outDir, "test_startPhmmers.dom")
+        done = []
+        obj._startPhmmers(chunked_reads_fns=reads_fns,
+                          chunked_dom_fns=dom_fns,
+                          out_dom_fn=out_dom_fn,
+                          primer_fn=None, pbmatrix_fn=None,
+                          dom_callback=done.append)
+        self.assertEqual(done, dom_fns)
+        self.assertEqual(open(out_dom_fn).read(),
+                         "".join(["chunk%d\n" % i for i in range(5)]))
+        self.assertFalse(any(op.exists(fn) for fn in reads_fns + dom_fns))
+
+    def test_runStreaming(self):
+        """Test classifying reads in streaming mode with the native
+        primer engine."""
+        outDir = op.join(self.outDir, "test_runStreaming")
+        mknewdir(outDir)
+        F0 = "AAGCAGTGGTATCAACGCAGAGTACATGGGG"
+        R0 = "CGCCTTGACGATCGAGTCTCGACCA"
+        primer_fn = op.join(outDir, "primers.fasta")
+        with open(primer_fn, 'w') as writer:
+            writer.write(">F0\n{f}\n>R0\n{r}\n".format(f=F0, r=R0))
+
+        rng = random.Random(0)
+        insert = "".join(rng.choice("ACGT") for _i in range(300))
+        fl = F0 + insert + "A" * 20 + R0
+        reads = [("movie/1/ccs", fl),  # fl, non-chimeric
+                 ("movie/2/ccs", F0 + insert + fl),  # fl, chimeric
+                 ("movie/3/ccs", insert),  # nfl
+                 ("movie/4/ccs", revcmp(fl))]  # fl, non-chimeric, '-'
+        reads_fn = op.join(outDir, "reads.fasta")
+        with open(reads_fn, 'w') as writer:
+            for name, seq in reads:
+                writer.write(">{n}\n{s}\n".format(n=name, s=seq))
+
+        obj = Classifier(reads_fn=reads_fn, out_dir=outDir,
+                         out_reads_fn=op.join(outDir, "isoseq_draft.fasta"),
+                         primer_fn=primer_fn, cpus=2, streaming=True,
+                         batch_size=1)
+        self.assertEqual(obj.primer_engine, "native")
+        obj.runStreaming()
+
+        def names(fn):
+            """Return read names in fn."""
+            return [l[1:].split()[0] for l in open(fn) if l.startswith('>')]
+        self.assertEqual(names(obj.out_flnc_fn),
+                         ["movie/1/31_329_CCS", "movie/4/345_47_CCS"])
+        self.assertEqual(names(obj.out_flc_fn), ["movie/2/31_660_CCS"])
+        self.assertEqual(names(obj.out_nfl_fn), ["movie/3/0_300_CCS"])
+        self.assertEqual(names(obj.out_all_reads_fn),
+                         names(obj.out_flnc_fn) + names(obj.out_nfl_fn))
+        # _findPolyA allows two non-A bases in front of polyA
+        self.assertEqual(open(obj.out_flnc_fn).read().split('\n')[1], insert[:-2])
+        self.assertEqual((obj.summary.num_reads, obj.summary.num_fl,
+                          obj.summary.num_flnc, obj.summary.num_flc,
+                          obj.summary.num_nfl, obj.summary.num_flnc_bases),
+                         (4, 3, 2, 1, 1, 596))
+        self.assertEqual(len(open(obj.primer_report_fn).readlines()), 5)
+
     def test_findPolyA(self):
         """Test function _findPolyA(seq, minANum, p3Start)."""
         obj = Classifier()
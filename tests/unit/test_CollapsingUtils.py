@@ -4,8 +4,10 @@ import unittest
 import os.path as op
 from pbtranscript.Utils import rmpath, mkdir
 from pbtranscript.io import CollapseGffReader, CollapseGffRecord
+from pbcore.io import FastaReader, FastqReader
 from pbtranscript.collapsing.CollapsingUtils import copy_sam_header, map_isoforms_and_sort, \
-        concatenate_sam, can_merge, compare_fuzzy_junctions, collapse_fuzzy_junctions
+        concatenate_sam, can_merge, compare_fuzzy_junctions, collapse_fuzzy_junctions, \
+        expected_errors, pick_rep, split_isoforms, sort_sam
 import filecmp
 from test_setpath import DATA_DIR, OUT_DIR, SIV_DATA_DIR
 
@@ -79,6 +81,52 @@ class TEST_CollapsingUtils(unittest.TestCase):
                               gmap_nproc=10)
         self.assertTrue(op.exists(out_fn))
 
+    def test_map_isoforms_and_sort_shards(self):
+        """Test map_isoforms_and_sort mapping shards of isoforms in parallel,
+        which produces the same alignments as mapping all isoforms at once."""
+        out_fn = op.join(_OUT_DIR_, 'test map_isoforms_and_sort_fastq.sam')
+        map_isoforms_and_sort(input_filename=GMAP_INPUT_FASTQ,
+                              sam_filename=out_fn,
+                              gmap_db_dir=self.gmap_db_dir,
+                              gmap_db_name=GMAP_NAME,
+                              gmap_nproc=4)
+        shards_fn = op.join(_OUT_DIR_, 'test map_isoforms_and_sort_shards.sam')
+        map_isoforms_and_sort(input_filename=GMAP_INPUT_FASTQ,
+                              sam_filename=shards_fn,
+                              gmap_db_dir=self.gmap_db_dir,
+                              gmap_db_name=GMAP_NAME,
+                              gmap_nproc=4, gmap_shards=3)
+        self.assertFalse(op.exists(shards_fn + ".shards"))
+        out = [l for l in open(out_fn, 'r') if not l.startswith('@')]
+        shards = [l for l in open(shards_fn, 'r') if not l.startswith('@')]
+        self.assertEqual(out, shards)
+
+    def test_split_isoforms(self):
+        """Test split_isoforms, which splits isoforms round robin."""
+        out_prefix = op.join(_OUT_DIR_, 'test split_isoforms')
+        shard_fns = split_isoforms(GMAP_INPUT_FASTQ, out_prefix, 3)
+        self.assertEqual(shard_fns, ["%s.%d.fastq" % (out_prefix, i) for i in range(3)])
+        reads = [r.name for r in FastqReader(GMAP_INPUT_FASTQ)]
+        for i, fn in enumerate(shard_fns):
+            self.assertEqual([r.name for r in FastqReader(fn)], reads[i::3])
+
+        # no empty shards
+        reads = [r.name for r in FastaReader(GMAP_INPUT_FASTA)]
+        shard_fns = split_isoforms(GMAP_INPUT_FASTA, out_prefix, len(reads) + 10)
+        self.assertEqual(len(shard_fns), len(reads))
+        self.assertEqual([r.name for fn in shard_fns for r in FastaReader(fn)], reads)
+
+    def test_sort_empty_sam(self):
+        """Test sort_sam of an empty sam file, which can not be written as bam."""
+        in_fn = op.join(_OUT_DIR_, 'test sort_sam empty.sam')
+        open(in_fn, 'w').close()
+        out_fn = op.join(_OUT_DIR_, 'test sort_sam empty.sorted.sam')
+        sort_sam(in_fn, out_fn)
+        self.assertEqual(os.stat(out_fn).st_size, 0)
+        out_fn = op.join(_OUT_DIR_, 'test sort_sam empty.sorted.bam')
+        self.assertRaises(ValueError, sort_sam, in_fn, out_fn)
+        self.assertFalse(op.exists(out_fn))
+
     def test_concatenate_sam(self):
         """Test concatenate_sam(in_sam_files, out_sam)"""
         in_sam_files = [op.join(_SIV_DIR_, f)
@@ -136,3 +184,58 @@ class TEST_CollapsingUtils(unittest.TestCase):
         r4, r5 = [r for r in CollapseGffReader(output_gff)]
         self.assertEqual(r1, r4)
         self.assertEqual(r3, r5)
+
+    def test_pick_rep(self):
+        """Test pick_rep, which picks the longest or least-error member of each group."""
+        gff_fn = op.join(_OUT_DIR_, "pick_rep.gff")
+        group_fn = op.join(_OUT_DIR_, "pick_rep.group.txt")
+        fq_fn = op.join(_OUT_DIR_, "pick_rep.in.fastq")
+        with open(gff_fn, 'w') as writer:
+            for tid, start, end in (("PB.1.1", 101, 110), ("PB.1.2", 201, 220)):
+                for feature in ("transcript", "exon"):
+                    writer.write('SIRV1\tPacBio\t%s\t%d\t%d\t.\t+\t.\t' % (feature, start, end) +
+                                 'gene_id "PB.1"; transcript_id "%s";\n' % tid)
+        with open(group_fn, 'w') as writer:
+            writer.write("PB.1.1\ta,b,c\nPB.1.2\td\n")
+        # reads are not in group order; b and c are equally long
+        with open(fq_fn, 'w') as writer:
+            writer.write("@d\nACGT\n+\n####\n@c desc\nACGTACG\n+\n!!!!!!!\n" +
+                         "@a\nACGTA\n+\nIIIII\n@b\nACGTACC\n+\n5555555\n")
+
+        out_fa = op.join(_OUT_DIR_, "pick_rep.out.fasta")
+        pick_rep(isoform_filename=fq_fn, gff_filename=gff_fn,
+                 group_filename=group_fn, output_filename=out_fa)
+        self.assertEqual([(r.name, r.sequence) for r in FastaReader(out_fa)],
+                         [("PB.1.1|SIRV1:101-110(+)|c", "ACGTACG"),
+                          ("PB.1.2|SIRV1:201-220(+)|d", "ACGT")])
+
+        out_fq = op.join(_OUT_DIR_, "pick_rep.out.fastq")
+        pick_rep(isoform_filename=fq_fn, gff_filename=gff_fn,
+                 group_filename=group_fn, output_filename=out_fq,
+                 pick_least_err_instead=True)
+        records = [r for r in FastqReader(out_fq)]
+        self.assertEqual([r.name for r in records],
+                         ["PB.1.1|SIRV1:101-110(+)|a", "PB.1.2|SIRV1:201-220(+)|d"])
+        self.assertEqual(records[0].qualityString, "IIIII")
+
+        self.assertAlmostEqual(expected_errors([0, 10, 20]), 1 + 10 ** -1 + 20 ** -2)
+
+        # coordinates of groups only in bad_gff_filename are read from it
+        bad_gff_fn = op.join(_OUT_DIR_, "pick_rep.bad.gff")
+        with open(bad_gff_fn, 'w') as writer:
+            for feature in ("transcript", "exon"):
+                writer.write('SIRV2\tPacBio\t%s\t11\t20\t.\t-\t.\t' % feature +
+                             'gene_id "PB.2"; transcript_id "PB.2.1";\n')
+        with open(group_fn, 'a') as writer:
+            writer.write("PB.2.1\te\n")
+        with open(fq_fn, 'a') as writer:
+            writer.write("@e\nAC\n+\nII\n")
+        pick_rep(isoform_filename=fq_fn, gff_filename=gff_fn,
+                 group_filename=group_fn, output_filename=out_fa,
+                 bad_gff_filename=bad_gff_fn)
+        self.assertEqual([r.name for r in FastaReader(out_fa)][2],
+                         "PB.2.1|SIRV2:11-20(-)|e")
+
+        with open(group_fn, 'a') as writer:
+            writer.write("PB.1.2\te\n")
+        self.assertRaises(ValueError, pick_rep, fq_fn, gff_fn, group_fn, out_fa)
@@ -77,6 +77,26 @@ class Test_DazzIDHandler(unittest.TestCase):
         print("Testing DazzIDHandler.num_blocks")
         self.assertTrue(handler.num_blocks, 1)
 
+    def test_reuse_if_unchanged(self):
+        """Test DazzIDHandler only converts input again if it has changed."""
+        fn = op.join(self.outDir, self.fastaFileName)
+        handler = DazzIDHandler(fn, converted=False)
+        self.assertTrue(op.exists(handler.signature_filename))
+        self.assertTrue(handler.is_unchanged())
+
+        mtime = op.getmtime(handler.dazz_filename)
+        handler = DazzIDHandler(fn, converted=False, reuse_if_unchanged=True)
+        self.assertEqual(op.getmtime(handler.dazz_filename), mtime)
+        self.assertEqual(sorted(handler.keys()), range(1, 13))
+
+        # appending reads to input invalidates the dazz db
+        with open(fn, 'a') as writer:
+            writer.write(">newread\nACGTACGTACGT\n")
+        self.assertFalse(handler.is_unchanged())
+        handler = DazzIDHandler(fn, converted=False, reuse_if_unchanged=True)
+        self.assertEqual(sorted(handler.keys()), range(1, 14))
+        self.assertTrue(handler.is_unchanged())
+
 
 class Test_DazzIDHandler_DataSet(unittest.TestCase):
     """Test DazzIDHandler while input is dataset."""
@@ -0,0 +1,104 @@
+"""Test pbtranscript.io.FaidxIndex."""
+import unittest
+import os.path as op
+from pbtranscript.Utils import rmpath, mkdir, files_signature
+from pbtranscript.io.FaidxIndex import FaidxIndex
+from pbtranscript.io.FastaRandomReader import FastaRandomReader, \
+    SubreadFastaReader
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_FaidxIndex")
+
+FASTA = ">m/1/0_10 RQ=0.8\nACGTA\nCGTAC\n" + \
+        ">m/1/12_20\nAAAA\nCCCC\n\n" + \
+        ">m/2/0_7 irregular\nAC\nGTA\nCG\n" + \
+        ">empty\n" + \
+        ">m/3/0_3\nTTT"
+
+FASTQ = "@r1 desc\nACGT\n+\n!#%'\n@r2\nGG\n+r2\n55\n"
+
+
+class TEST_FaidxIndex(unittest.TestCase):
+    """Test FaidxIndex."""
+    def setUp(self):
+        """Write input files."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.fa = op.join(_OUT_DIR_, "reads.fasta")
+        with open(self.fa, 'w') as writer:
+            writer.write(FASTA)
+        self.fq = op.join(_OUT_DIR_, "reads.fastq")
+        with open(self.fq, 'w') as writer:
+            writer.write(FASTQ)
+
+    def test_build(self):
+        """Test scanning a FASTA file."""
+        index = FaidxIndex.build(self.fa)
+        self.assertEqual([e.name for e in index],
+                         ["m/1/0_10", "m/1/12_20", "m/2/0_7", "empty", "m/3/0_3"])
+        e = index["m/1/0_10"]
+        self.assertEqual((e.length, e.offset, e.linebases, e.linewidth),
+                         (10, 17, 5, 6))
+        self.assertFalse(index["m/2/0_7"].is_regular)
+        self.assertFalse(index.is_regular)
+
+        with open(self.fa, 'rb') as f:
+            self.assertEqual(index.read_sequence(f, "m/1/0_10"), "ACGTACGTAC")
+            self.assertEqual(index.read_sequence(f, "m/1/12_20"), "AAAACCCC")
+            self.assertEqual(index.read_sequence(f, "m/2/0_7"), "ACGTACG")
+            self.assertEqual(index.read_sequence(f, "empty"), "")
+            self.assertEqual(index.read_sequence(f, "m/3/0_3"), "TTT")
+
+    def test_save_load(self):
+        """Test saving an index in faidx format, and reloading it."""
+        with open(self.fa, 'w') as writer:
+            writer.write(FASTA.replace("AC\nGTA\nCG\n", "ACG\nTAC\nG\n"))
+        index = FaidxIndex.load_or_build(self.fa)
+        fai_fn = self.fa + FaidxIndex.SUFFIX
+        self.assertTrue(op.exists(fai_fn))
+        with open(fai_fn) as reader:
+            self.assertEqual(reader.readline(), "m/1/0_10\t10\t17\t5\t6\n")
+
+        loaded = FaidxIndex.load(fai_fn, files_signature([self.fa]))
+        self.assertEqual(loaded.entries, index.entries)
+
+        # stale if input has changed
+        with open(self.fa, 'a') as writer:
+            writer.write("\n>m/4/0_2\nAA\n")
+        self.assertTrue(FaidxIndex.load(fai_fn, files_signature([self.fa])) is None)
+        self.assertTrue("m/4/0_2" in FaidxIndex.load_or_build(self.fa))
+
+    def test_irregular_not_saved(self):
+        """Test that an index of lines of unequal length is not saved."""
+        index = FaidxIndex.load_or_build(self.fa)
+        self.assertEqual(len(index), 5)
+        self.assertFalse(op.exists(self.fa + FaidxIndex.SUFFIX))
+
+    def test_fastq(self):
+        """Test indexing a FASTQ file."""
+        index = FaidxIndex.load_or_build(self.fq)
+        self.assertTrue(index.is_fastq)
+        with open(self.fq + FaidxIndex.SUFFIX) as reader:
+            self.assertEqual(reader.readline(), "r1\t4\t9\t4\t5\t16\n")
+        index = FaidxIndex.load(self.fq + FaidxIndex.SUFFIX,
+                                files_signature([self.fq]))
+        with open(self.fq, 'rb') as f:
+            self.assertEqual(index.read_sequence(f, "r2"), "GG")
+            self.assertEqual(index.read_quality(f, "r2"), "55")
+            self.assertEqual(index.read_quality(f, "r1"), "!#%'")
+
+    def test_readers(self):
+        """Test FastaRandomReader and SubreadFastaReader using index."""
+        for dummy_i in range(2):
+            frr = FastaRandomReader(self.fa)
+            self.assertEqual(frr["m/2/0_7"].sequence, "ACGTACG")
+            self.assertEqual(len(frr), 5)
+
+        sfr = SubreadFastaReader(self.fa)
+        self.assertEqual([r.name for r in sfr["m/1"]], ["m/1/0_10", "m/1/12_20"])
+        self.assertEqual([r.sequence for r in sfr["m/1/12_20"]], ["AAAACCCC"])
+        self.assertRaises(ValueError, sfr.__getitem__, "m/9")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Test pbtranscript.ice.IceCheckpoint."""
+import unittest
+import os.path as op
+import cPickle
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.ice.IceCheckpoint import IceCheckpoint, load_ice_state
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_IceCheckpoint")
+
+
+class TEST_IceCheckpoint(unittest.TestCase):
+    """Test class pbtranscript.ice.IceCheckpoint."""
+    def setUp(self):
+        """Define output dir and an ICE state."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.prefix = op.join(_OUT_DIR_, "ice.checkpoint")
+        self.state = {'uc': {0: ['a', 'b'], 1: ['c']},
+                      'd': {'a': {0: -1.}, 'b': {0: -2.}, 'c': {1: 0}},
+                      'refs': {0: 'c0.fasta', 1: 'c1.fasta'},
+                      'newids': set(['a', 'b', 'c']),
+                      'changes': set(),
+                      'fasta_filename': 'current.fasta'}
+
+    def test_snapshot_and_deltas(self):
+        """Test replaying deltas on a snapshot."""
+        ckpt = IceCheckpoint(self.prefix, snapshot_every=2)
+        self.assertTrue(ckpt.needs_snapshot())
+        ckpt.write_snapshot(self.state)
+        # move c to cluster 0, delete cluster 1
+        ckpt.append({'uc': {0: ['a', 'b', 'c'], 1: None},
+                     'd': {'c': {0: -3.}},
+                     'refs': {1: None},
+                     'changes': set([0])})
+        self.assertFalse(ckpt.needs_snapshot())
+        ckpt.append({'uc': {}, 'd': {'a': None}, 'refs': {},
+                     'newids': set(['b', 'c'])})
+        self.assertTrue(ckpt.needs_snapshot())
+
+        expected = {'uc': {0: ['a', 'b', 'c']},
+                    'd': {'b': {0: -2.}, 'c': {0: -3.}},
+                    'refs': {0: 'c0.fasta'},
+                    'newids': set(['b', 'c']),
+                    'changes': set([0]),
+                    'fasta_filename': 'current.fasta'}
+        self.assertEqual(IceCheckpoint(self.prefix).load(), expected)
+        self.assertEqual(load_ice_state(self.prefix), expected)
+        self.assertEqual(load_ice_state(ckpt.snapshot_filename), expected)
+
+        # a partially written delta is ignored
+        with open(ckpt.log_filename, 'ab') as f:
+            f.write(cPickle.dumps({'uc': {2: ['d']}}, 2)[:-3])
+        self.assertEqual(load_ice_state(self.prefix), expected)
+
+        # a new snapshot empties the log
+        ckpt.write_snapshot(self.state)
+        self.assertEqual(load_ice_state(self.prefix), self.state)
+
+    def test_crash_before_emptying_log(self):
+        """Test deltas already in a new snapshot are not replayed, if the
+        job was killed after the snapshot was renamed but before the log
+        was emptied."""
+        ckpt = IceCheckpoint(self.prefix, snapshot_every=1)
+        ckpt.write_snapshot(self.state)
+        delta = {'uc': {0: ['a', 'b', 'c'], 1: None},
+                 'd': {'c': {0: -3.}}, 'refs': {1: None}}
+        ckpt.append(delta)
+        state = ckpt.load()
+        with open(ckpt.log_filename, 'rb') as f:
+            old_log = f.read()
+
+        # cluster 1 is added back after the delta, then a snapshot is
+        # written, and the job is killed before the log is emptied.
+        state['uc'][1] = ['d']
+        ckpt.write_snapshot(state)
+        with open(ckpt.log_filename, 'wb') as f:
+            f.write(old_log)
+        self.assertEqual(IceCheckpoint(self.prefix).load(), state)
+
+        # a restarted job keeps appending deltas of the new generation
+        ckpt = IceCheckpoint(self.prefix)
+        ckpt.append({'uc': {1: None}})
+        self.assertEqual(ckpt.load()['uc'], {0: ['a', 'b', 'c']})
+        self.assertEqual(ckpt.num_deltas, 1)
+
+    def test_load_pickle(self):
+        """Test load_ice_state of a plain pickle file."""
+        fn = op.join(_OUT_DIR_, "upto.pickle")
+        with open(fn, 'wb') as f:
+            cPickle.dump(self.state, f)
+        self.assertEqual(IceCheckpoint.prefix_of(fn), None)
+        self.assertEqual(load_ice_state(fn), self.state)
+
+
+if __name__ == "__main__":
+    unittest.main()
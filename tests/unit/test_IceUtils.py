@@ -225,7 +225,7 @@ class Test_ICEUtils(unittest.TestCase):
 
         hits = []
 
-        for la4ice_filename in runner.la4ice_filenames:
+        for la4ice_filename in runner.alignment_filenames:
             hits.extend(daligner_against_ref(query_dazz_handler=runner.query_dazz_handler,
                                              target_dazz_handler=runner.target_dazz_handler,
                                              la4ice_filename=la4ice_filename,
@@ -255,6 +255,23 @@ class Test_ICEUtils(unittest.TestCase):
         test_name = "test_daligner_against_ref_use_sge"
         self._test_daligner_against_ref(test_name=test_name, use_sge=True, sge_opts=SgeOptions(100))
 
+    def test_eval_blasr_alignment(self):
+        """Test eval_blasr_alignment"""
+        class _Record(object):
+            """A fake BLASRM5Record."""
+            qID, sID, qStrand, sStrand = "q", "s", "+", "-"
+            qStart, qEnd, qLength = 0, 6, 6
+            sStart, sEnd, sLength = 2, 8, 10
+            qAln, alnStr, sAln = "ACG-TAA", "|||*|*|", "ACGGT-A"
+
+        prob_model = ProbFromModel(0.01, 0.07, 0.06)
+        cigar_str, ece = eval_blasr_alignment(
+            record=_Record(), qver_get_func=prob_model.get_smoothed,
+            qvmean_get_func=prob_model.get_mean, sID_starts_with_c=False,
+            qv_prob_threshold=0.03)
+        self.assertEqual(cigar_str, "MMMDMIM")
+        self.assertEqual(list(ece), [0, 0, 0, 1, 0, 1, 0])
+
     def test_num_reads_in_fasta(self):
         """Test num_reads_in_fasta"""
         in_fa = op.join(self.sivDataDir, "flnc.fasta")
@@ -0,0 +1,90 @@
+"""Test pbtranscript.JobNotifier."""
+import unittest
+import os
+import os.path as op
+import subprocess
+import threading
+import time
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.JobNotifier import JobNotifier, FileWatcher, wait_for_files
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_JobNotifier")
+
+
+class TEST_JobNotifier(unittest.TestCase):
+    """Test JobNotifier, FileWatcher and wait_for_files."""
+    def setUp(self):
+        """Define input and output file."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+
+    def test_wrap_cmd(self):
+        """Test that a wrapped cmd notifies start and end events."""
+        notifier = JobNotifier(host="localhost")
+        script = op.join(_OUT_DIR_, "job.sh")
+        with open(script, 'w') as writer:
+            writer.write("\n".join(notifier.wrap_cmd("(exit 3)")))
+        env = dict(os.environ, JOB_ID="1234")
+        notifier.add_job("1234")
+        code = subprocess.call(["bash", script], env=env)
+        self.assertEqual(code, 3)
+
+        self.assertEqual(notifier.wait(["1234"], timeout=10), set(["1234"]))
+        self.assertEqual(notifier.ended["1234"][1], 3)
+        self.assertTrue(notifier.run_time("1234") >= 0)
+        self.assertEqual(notifier.finished(["1234", "5678"]), set(["1234"]))
+        notifier.log_timing(["1234", "5678"])
+        notifier.close()
+
+    def test_bad_events(self):
+        """Test that malformed events and events without the token
+        of the notifier are ignored."""
+        notifier = JobNotifier(host="localhost")
+        self.assertEqual(notifier._sock.getsockname()[0], "0.0.0.0")
+        for line in ["start x y z", "end 1234 0 0",
+                     "end %s 1234 x 0" % notifier.token,
+                     "end %s 1234 0 y" % notifier.token,
+                     "end wrongtoken 1234 0 0", ""]:
+            notifier._add_event(line)
+        self.assertEqual(notifier.started, {})
+        self.assertEqual(notifier.ended, {})
+        self.assertEqual(notifier.num_events, 0)
+
+        notifier._add_event("end %s 1234 10.5 0\n" % notifier.token)
+        self.assertEqual(notifier.ended, {"1234": (10.5, 0)})
+        self.assertEqual(notifier.num_events, 1)
+        self.assertNotEqual(JobNotifier(host="localhost").token, notifier.token)
+        notifier.close()
+
+        notifier = JobNotifier(host="localhost", bind_address="127.0.0.1")
+        self.assertEqual(notifier._sock.getsockname()[0], "127.0.0.1")
+        notifier.close()
+
+    def test_wait_timeout(self):
+        """Test waiting for a job which never ends."""
+        notifier = JobNotifier(host="localhost")
+        start_t = time.time()
+        self.assertEqual(notifier.wait(["1"], timeout=0.2), set())
+        self.assertTrue(time.time() - start_t < 5)
+        notifier.close()
+
+    def test_wait_for_files(self):
+        """Test waking up when a file is created."""
+        fn = op.join(_OUT_DIR_, "a.pickle.DONE")
+        t = threading.Timer(0.2, lambda: open(fn, 'w').close())
+        t.start()
+        start_t = time.time()
+        self.assertEqual(wait_for_files([fn], timeout=30, recheck_every=20), [])
+        self.assertTrue(time.time() - start_t < 20)
+        t.join()
+
+        missing = op.join(_OUT_DIR_, "missing")
+        self.assertEqual(wait_for_files([fn, missing], timeout=0.1), [missing])
+
+        with FileWatcher([_OUT_DIR_]) as watcher:
+            self.assertFalse(watcher.wait(timeout=0.1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Test classes defined within pbtranscript.io.LasReader."""
+import unittest
+import os.path as op
+import struct
+from pbtranscript.Utils import rmpath, mkdir, revcmp
+from pbtranscript.io import LasReader
+from pbtranscript.io.LasReader import LAS_HEADER, LAS_RECORD, COMP_FLAG, _revcmp
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_LasReader")
+
+READ0 = "acgtacgtaaccggttacgtacgtaaccggtt"  # 32 bp
+# READ1 aligns to READ0[4:28] with one deletion at READ0[12]
+READ1 = "gg" + READ0[4:12] + READ0[13:28] + "tt"
+
+
+def write_las(las_fn, tspace, overlaps):
+    """Write overlaps, a list of (flags, aread, bread, abpos, aepos,
+    bbpos, bepos, trace), to a daligner las file."""
+    with open(las_fn, 'wb') as f:
+        f.write(LAS_HEADER.pack(len(overlaps), tspace))
+        for flags, aread, bread, abpos, aepos, bbpos, bepos, trace in overlaps:
+            f.write(LAS_RECORD.pack(len(trace), sum(trace[0::2]), abpos, bbpos,
+                                    aepos, bepos, flags, aread, bread))
+            f.write(struct.pack("<%dB" % len(trace), *trace))
+
+
+class TEST_LASREADER(unittest.TestCase):
+    """Test classes defined within pbtranscript.io.LasReader."""
+    def setUp(self):
+        """Write a dazz fasta file and a las file."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.dazz_fasta = op.join(_OUT_DIR_, "reads.dazz.fasta")
+        with open(self.dazz_fasta, 'w') as writer:
+            for i, seq in enumerate([READ0, READ1, revcmp(READ1)]):
+                writer.write(">prolog/{i}/0_{l}\n{s}\n".format(i=i+1, l=len(seq), s=seq))
+        self.las = op.join(_OUT_DIR_, "reads.las")
+        # trace intervals of READ0 are [4, 10), [10, 20), [20, 28)
+        write_las(self.las, 10, [
+            (0, 0, 1, 4, 28, 2, 25, [0, 6, 1, 9, 0, 8]),
+            (COMP_FLAG, 0, 2, 4, 28, 2, 25, [0, 6, 1, 9, 0, 8])])
+
+    def test_read(self):
+        """Test LasReader reconstructs alignments from trace points."""
+        records = [r for r in LasReader(self.las, self.dazz_fasta)]
+        self.assertEqual(len(records), 2)
+
+        r = records[0]
+        self.assertEqual((r.qID, r.qStart, r.qEnd, r.qLength), (1, 4, 28, 32))
+        self.assertEqual((r.sID, r.sStart, r.sEnd, r.sLength), (2, 2, 25, 27))
+        self.assertEqual(r.strand, '+')
+        self.assertEqual(r.qAln.replace('-', ''), READ0[4:28])
+        self.assertEqual(r.sAln.replace('-', ''), READ1[2:25])
+        self.assertEqual(r.alnStr.count('*'), 1)
+        self.assertEqual(r.identity, round(100. * 23 / 24, 2))
+
+        r = records[1]
+        self.assertEqual((r.sID, r.sStart, r.sEnd, r.sLength), (3, 2, 25, 27))
+        self.assertEqual(r.strand, '-')
+        self.assertEqual(r.sStrand, '-')
+        self.assertEqual(r.sAln.replace('-', ''), READ1[2:25])
+
+    def test_read_non_acgt(self):
+        """Test LasReader tolerates non-acgt bases in reverse complemented targets."""
+        self.assertEqual(_revcmp("acgnrt"), "anncgt")
+        # Replace a base of READ1 outside of the aligned region by n.
+        read1_n = READ1[:26] + "n"
+        with open(self.dazz_fasta, 'w') as writer:
+            for i, seq in enumerate([READ0, read1_n, _revcmp(read1_n)]):
+                writer.write(">prolog/{i}/0_{l}\n{s}\n".format(i=i+1, l=len(seq), s=seq))
+        records = [r for r in LasReader(self.las, self.dazz_fasta)]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1].strand, '-')
+        self.assertEqual(records[1].sAln.replace('-', ''), READ1[2:25])
+
+    def test_invalid_trace(self):
+        """Test LasReader raises ValueError on inconsistent trace points."""
+        write_las(self.las, 10, [(0, 0, 1, 4, 28, 2, 25, [0, 6, 1, 9, 0, 9])])
+        self.assertRaises(ValueError, list, LasReader(self.las, self.dazz_fasta))
+
+
+if __name__ == "__main__":
+    unittest.main()
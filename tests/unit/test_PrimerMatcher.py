@@ -0,0 +1,118 @@
+"""Test pbtranscript.PrimerMatcher."""
+import unittest
+import random
+import os.path as op
+from pbcore.io import FastaReader
+from pbtranscript.Utils import rmpath, mkdir, revcmp
+from pbtranscript.PBTranscriptOptions import BaseConstants
+from pbtranscript.PrimerMatcher import PrimerMatcher
+from pbtranscript.c_primer import align_primer
+from pbtranscript.io.DOMIO import DOMReader
+from test_setpath import DATA_DIR, OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_PrimerMatcher")
+
+F0 = "AAGCAGTGGTATCAACGCAGAGTACATGGGG"
+R0 = "CGCCTTGACGATCGAGTCTCGACCA"  # as written to primer file, revcmp'ed
+INSERT = "CTGACTGATCGATCGGCTAGCTAGGACTTCAGGACTAGCCTAGGATCGA" * 3
+
+
+class TEST_PrimerMatcher(unittest.TestCase):
+    """Test pbtranscript.PrimerMatcher."""
+    def setUp(self):
+        """Write primers as Classifier._processPrimers does."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.primer_fn = op.join(_OUT_DIR_, "primers.front_end.fasta")
+        with open(self.primer_fn, 'w') as writer:
+            writer.write(">F0\n{f}\n>R0\n{r}\n".format(f=F0, r=R0))
+
+    def test_align_primer(self):
+        """Test banded local alignment of a primer against a window."""
+        self.assertEqual(align_primer("ACGTACGTAA", "TTTTACGTACGTAATTT", 48, 16),
+                         (20, 0, 10, 4, 14))
+        # one deletion in window
+        self.assertEqual(align_primer("ACGTACGTAA", "TTTTACGTCGTAATTT", 48, 16),
+                         (13, 0, 10, 4, 13))
+        # hits must start within the first max_start + 1 bases
+        self.assertEqual(align_primer("ACGTACGTAA", "TTTTACGTACGTAATTT", 3, 16),
+                         (12, 3, 9, 3, 9))
+        self.assertEqual(align_primer("CCCCAAAA", "TTTTTTTTCCCCAAAA", 3, 16),
+                         None)
+        self.assertEqual(align_primer("ACAC", "GGGG", 48, 16), None)
+
+    def test_match(self):
+        """Test finding primers in front and back windows of a read."""
+        m = PrimerMatcher(self.primer_fn, window_size=100)
+        read = "gg" + F0.lower() + INSERT + "A" * 20 + revcmp(R0) + "CC"
+        front, back = m.match("movie/1/ccs", read)
+
+        f = front['F0']
+        self.assertEqual((f.sid, f.pStart, f.pEnd, f.pLen), ("movie/1/ccs", 0, 31, 31))
+        self.assertEqual((f.sStart, f.sEnd, f.sLen), (2, 33, 100))
+        self.assertEqual(f.score, 34.2)  # round(31 * 2 * 0.6 - 3, 1)
+
+        r = back['R0']
+        self.assertEqual((r.pStart, r.pEnd, r.sStart, r.sEnd), (0, 25, 2, 27))
+        self.assertEqual(r.score, 27.0)
+
+        # a read without primers, only short spurious hits are found
+        front, back = m.match("movie/2/ccs", INSERT)
+        self.assertEqual(sorted(front.keys()), ['F0', 'R0'])
+        self.assertEqual(sorted(back.keys()), ['F0', 'R0'])
+        for hit, expected in [(front['F0'], (1.2, 10, 16, 44, 50)),
+                              (front['R0'], (6.0, 5, 15, 1, 12)),
+                              (back['F0'], (1.8, 3, 7, 42, 46)),
+                              (back['R0'], (5.4, 8, 15, 34, 41))]:
+            self.assertEqual((hit.score, hit.pStart, hit.pEnd, hit.sStart, hit.sEnd),
+                             expected)
+            self.assertTrue(hit.score < BaseConstants.MIN_SCORE_DEFAULT)
+
+    def test_score_scale(self):
+        """Test native scores are on the scale of phmmer scores, which
+        --min_score was chosen for, by matching windows which phmmer
+        searched in test_parseHmmDom.dom."""
+        primers = dict((r.name.split()[0], r.sequence)
+                       for r in FastaReader(op.join(DATA_DIR, "primers.fasta")))
+        primer_fn = op.join(_OUT_DIR_, "primers.F1R1.fasta")
+        with open(primer_fn, 'w') as writer:
+            writer.write(">F1\n{f}\n>R1\n{r}\n".format(
+                f=primers['F1'], r=revcmp(primers['R1'])))
+        m = PrimerMatcher(primer_fn, window_size=100)
+
+        windows = dict((r.name.split()[0], r.sequence)
+                       for r in FastaReader(op.join(DATA_DIR, "test_phmmer.fasta")))
+        n_hits = 0
+        phmmer_sids = set()
+        for expected in DOMReader(op.join(DATA_DIR, "test_parseHmmDom.dom")):
+            phmmer_sids.add(expected.sid)
+            if expected.sid not in windows:
+                continue
+            hit = m.match_window(expected.sid, windows[expected.sid])[expected.pid]
+            self.assertTrue(abs(hit.score - expected.score) <= 0.5,
+                            "{p} in {s}: native score {n}, phmmer score {e}".format(
+                                p=expected.pid, s=expected.sid, n=hit.score,
+                                e=expected.score))
+            self.assertEqual((hit.pStart, hit.sStart), (expected.pStart, expected.sStart))
+            n_hits += 1
+        self.assertEqual(n_hits, 4)
+
+        # windows where phmmer found no hit stay below --min_score
+        for sid, window in windows.iteritems():
+            if sid not in phmmer_sids:
+                for hit in m.match_window(sid, window).values():
+                    self.assertTrue(hit.score < BaseConstants.MIN_SCORE_DEFAULT)
+
+        # chance hits in the middle of random reads rarely pass --min_score
+        rng = random.Random(0)
+        n_chimeric = 0
+        for _i in range(100):
+            read = "".join(rng.choice("ACGT") for _j in range(1000))
+            hits = m.match_middle("movie/1/ccs", read, 100).values()
+            if any(hit.score >= BaseConstants.MIN_SCORE_DEFAULT for hit in hits):
+                n_chimeric += 1
+        self.assertTrue(n_chimeric < 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+"""Test pbtranscript.ice.ProbModel."""
+import unittest
+from math import log
+import numpy as np
+from pbtranscript.ice.ProbModel import calc_aln_log_prob, calc_aln_log_prob2
+
+
+class TestCalcAlnLogProb(unittest.TestCase):
+    """Test calc_aln_log_prob and calc_aln_log_prob2."""
+
+    def setUp(self):
+        self.prob_sub = np.array([0.01, 0.02, 0.03, 0.04, 0.05])
+        self.prob_ins = np.array([0.02, 0.01, 0.02, 0.01, 0.02])
+        self.prob_del = np.array([0.05, 0.04, 0.03, 0.02, 0.01])
+
+    def test_calc_aln_log_prob(self):
+        """Test calc_aln_log_prob scores M, S, I and D columns."""
+        s, i, d = self.prob_sub, self.prob_ins, self.prob_del
+        expected = log(1 - s[1] - i[1] - d[1]) + \
+                   log(s[2]) + log(1 / 3.) + \
+                   log(d[3]) + \
+                   log(i[3]) + log(1 / 3.)
+        score = calc_aln_log_prob("MSDI", s, i, d, 1, 4)
+        self.assertAlmostEqual(score, expected)
+        self.assertRaises(IndexError, calc_aln_log_prob, "MMMMMM", s, i, d, 1, 7)
+
+    def test_calc_aln_log_prob2(self):
+        """Test calc_aln_log_prob2 scores with a single error prob."""
+        e = self.prob_sub
+        expected = log(1 - e[0]) + log(e[1]) + log(1 / 3.) + log(e[2])
+        self.assertAlmostEqual(calc_aln_log_prob2("MSD", e, 0, 2), expected)
+        # stops at the end of the query
+        self.assertAlmostEqual(calc_aln_log_prob2("MMMMMM", e, 3, 9),
+                               log(1 - e[3]) + log(1 - e[4]))
+
+
+if __name__ == "__main__":
+    unittest.main()
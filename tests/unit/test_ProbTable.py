@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Test pbtranscript.ice.ProbTable."""
+import unittest
+import os.path as op
+import cPickle
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.ice.ProbTable import ProbTable
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_ProbTable")
+
+
+class TEST_ProbTable(unittest.TestCase):
+    """Test class pbtranscript.ice.ProbTable."""
+    def setUp(self):
+        """Create a table."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.d = ProbTable({'a': {0: -10., 1: -5.}, 'b': {1: -3.}, 'c': {}})
+
+    def test_dict_interface(self):
+        """Test modifying rows keeps the reverse index up to date."""
+        d = self.d
+        self.assertEqual(len(d), 3)
+        self.assertEqual(d.qids_of(1), set(['a', 'b']))
+        d['c'][1] = -1.
+        d['c'][2] = -2.
+        self.assertEqual(d.qids_of(1), set(['a', 'b', 'c']))
+        del d['a'][1]
+        self.assertEqual(d.qids_of(1), set(['b', 'c']))
+        d['b'] = {2: 0}
+        self.assertEqual(d.qids_of(1), set(['c']))
+        self.assertEqual(d.qids_of(2), set(['b', 'c']))
+        del d['c']
+        self.assertEqual(d.qids_of(2), set(['b']))
+        self.assertEqual(sorted(d.cids()), [0, 2])
+        self.assertEqual(d.nnz(), 2)
+        self.assertEqual(d.to_dict(), {'a': {0: -10.}, 'b': {2: 0}})
+
+    def test_pop_dirty(self):
+        """Test tracking qids with modified probs."""
+        d = self.d
+        self.assertEqual(d.pop_dirty(), set(['a', 'b', 'c']))
+        self.assertEqual(d.pop_dirty(), set())
+        d['a'][0] = -1.
+        d.delete_cluster(1)
+        del d['c']
+        self.assertEqual(d.pop_dirty(), set(['a', 'b', 'c']))
+        d['a'].get(0)
+        self.assertEqual(d.pop_dirty(), set())
+
+    def test_delete_and_clean(self):
+        """Test delete_cluster and clean."""
+        d = self.d
+        d.delete_cluster(1)
+        self.assertEqual(d.to_dict(), {'a': {0: -10.}, 'b': {}, 'c': {}})
+        d['b'][0] = -1.
+        d.clean(qids=['b'], cids=[0, 3])
+        self.assertEqual(d.to_dict(), {'a': {0: -10.}, 'b': {}, 'c': {}})
+
+    def test_best_cluster(self):
+        """Test best_cluster and max_probs."""
+        d = self.d
+        self.assertEqual(d.best_cluster('a'), (1, -5.))
+        self.assertEqual(d.best_cluster('a', exclude=1), (0, -10.))
+        self.assertEqual(d.best_cluster('b', exclude=1), None)
+        self.assertEqual(d.best_cluster('c'), None)
+        self.assertEqual(d.max_probs(), {'a': -5., 'b': -3.})
+
+    def test_max_prob(self):
+        """Test max probs are kept up to date as probs change."""
+        d = self.d
+        self.assertEqual(d.max_prob('a'), -5.)
+        self.assertEqual(d.max_prob('c'), None)
+        d['a'][1] = -20.
+        self.assertEqual(d.max_prob('a'), -10.)
+        d['a'][2] = -1.
+        self.assertEqual(d.max_prob('a'), -1.)
+        del d['a'][2]
+        self.assertEqual(d.max_prob('a'), -10.)
+        d.delete_cluster(0)
+        self.assertEqual(d.max_prob('a'), -20.)
+        d['c'] = {3: -4., 4: -2.}
+        self.assertEqual(d.max_prob('c'), -2.)
+        d.clean(qids=['c'], cids=[4])
+        self.assertEqual(d.max_prob('c'), -4.)
+        self.assertEqual(d['c'].max(), -4.)
+
+    def test_pickle_save_load(self):
+        """Test pickling rows as dicts, and saving as CSR arrays."""
+        d = self.d
+        self.assertEqual(cPickle.loads(cPickle.dumps(d['a'])), {0: -10., 1: -5.})
+        self.assertEqual(type(cPickle.loads(cPickle.dumps(d['a']))), dict)
+        self.assertEqual(cPickle.loads(cPickle.dumps(d)).to_dict(), d.to_dict())
+
+        prefix = op.join(_OUT_DIR_, "probs")
+        d.save(prefix)
+        qids, indptr, cids, probs = ProbTable.load_csr(prefix, mmap=True)
+        self.assertEqual(sorted(qids), ['a', 'b', 'c'])
+        self.assertEqual(len(cids), 3)
+        self.assertEqual(indptr[-1], 3)
+        loaded = ProbTable.load(prefix)
+        self.assertEqual(loaded.to_dict(), d.to_dict())
+        self.assertEqual(loaded.qids_of(1), set(['a', 'b']))
+
+
+if __name__ == "__main__":
+    unittest.main()
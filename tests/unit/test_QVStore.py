@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""Test pbtranscript.io.QVStore."""
+import unittest
+import os.path as op
+import numpy as np
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.io.QVStore import QVStore, IdTable, qvs_to_probs
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_QVStore")
+
+
+class TEST_QVStore(unittest.TestCase):
+    """Test class pbtranscript.io.QVStore."""
+    def setUp(self):
+        """Define output dir."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+
+    def test_qvs_to_probs(self):
+        """Test qvs_to_probs."""
+        self.assertEqual(list(qvs_to_probs([0, 10, 20])),
+                         [10 ** (-0 / 10.), 10 ** (-10 / 10.), 10 ** (-20 / 10.)])
+
+    def test_add_get(self):
+        """Test QVStore.add, get, get_qvs and remove."""
+        store = QVStore()
+        store.add('m/1/0_3_CCS', 'DeletionQV', [10, 20, 30])
+        store.add('m/2/0_2_CCS', 'DeletionQV', [5, 6])
+        store.add('m/1/0_3_CCS', 'InsertionQV', [1, 2, 3])
+
+        self.assertEqual(list(store.get_qvs('m/1/0_3_CCS', 'DeletionQV')), [10, 20, 30])
+        self.assertEqual(list(store.get_qvs('m/1/0_3_CCS', 'InsertionQV')), [1, 2, 3])
+        self.assertEqual(list(store.get_qvs('m/2/0_2_CCS', 'DeletionQV')), [5, 6])
+        self.assertEqual(store.get('m/1/0_3_CCS', 'DeletionQV', 1), 0.01)
+        self.assertEqual(store.get('m/1/0_3_CCS', 'DeletionQV', -1), 0.001)
+        self.assertRaises(IndexError, store.get, 'm/1/0_3_CCS', 'DeletionQV', 3)
+        self.assertRaises(ValueError, store.add, 'm/2/0_2_CCS', 'InsertionQV', [1])
+
+        store.remove('m/2/0_2_CCS')
+        self.assertTrue('m/2/0_2_CCS' not in store)
+        self.assertRaises(KeyError, store.get, 'm/2/0_2_CCS', 'DeletionQV')
+
+    def test_missing_qv_name(self):
+        """Test getting a QV name never added for a read raises KeyError."""
+        store = QVStore()
+        store.add('m/1/0_3_CCS', 'DeletionQV', [10, 20, 30])
+        store.add('m/2/0_2_CCS', 'InsertionQV', [5, 6])
+        self.assertTrue(store.has('m/1/0_3_CCS', 'DeletionQV'))
+        self.assertFalse(store.has('m/1/0_3_CCS', 'InsertionQV'))
+        self.assertFalse(store.has('m/1/0_3_CCS', 'MergeQV'))
+        self.assertRaises(KeyError, store.get, 'm/1/0_3_CCS', 'InsertionQV')
+        self.assertRaises(KeyError, store.get, 'm/1/0_3_CCS', 'InsertionQV', 0)
+        self.assertRaises(KeyError, store.get_qvs, 'm/2/0_2_CCS', 'DeletionQV')
+        self.assertRaises(KeyError, store.mean, 'm/2/0_2_CCS', 'DeletionQV')
+
+        # presence is kept through compact, drop, save and load
+        store.compact()
+        self.assertRaises(KeyError, store.get, 'm/1/0_3_CCS', 'InsertionQV')
+        store.drop('DeletionQV')
+        self.assertRaises(KeyError, store.get, 'm/1/0_3_CCS', 'DeletionQV')
+        store.add('m/2/0_2_CCS', 'DeletionQV', [7, 8])
+        self.assertRaises(KeyError, store.get, 'm/1/0_3_CCS', 'DeletionQV')
+        prefix = op.join(_OUT_DIR_, "missing")
+        store.save(prefix)
+        loaded = QVStore.load(prefix)
+        self.assertEqual(list(loaded.get_qvs('m/2/0_2_CCS', 'DeletionQV')), [7, 8])
+        self.assertRaises(KeyError, loaded.get, 'm/1/0_3_CCS', 'DeletionQV')
+        self.assertRaises(KeyError, loaded.get, 'm/1/0_3_CCS', 'InsertionQV')
+
+    def test_remove_compact(self):
+        """Test QVStore.remove reclaims space of removed reads."""
+        store = QVStore()
+        n = QVStore.INITIAL_CAPACITY
+        store.add('a', 'unsmoothed', np.ones(n, dtype=np.uint8))
+        store.add('b', 'unsmoothed', np.ones(n, dtype=np.uint8) * 2)
+        store.add('c', 'unsmoothed', [3, 4])
+        store.remove('a')
+        self.assertEqual((store.size, store.garbage), (2 * n + 2, n))
+        store.remove('b')
+        self.assertEqual((store.size, store.garbage), (2, 0))
+        self.assertEqual(list(store.get_qvs('c', 'unsmoothed')), [3, 4])
+
+    def test_IdTable(self):
+        """Test IdTable add, remove and reuse of slots."""
+        ids = IdTable(['a', 'b'])
+        ids += ['c', 'a']
+        self.assertEqual(list(ids), ['a', 'b', 'c'])
+        ids.remove('b')
+        self.assertTrue('b' not in ids)
+        self.assertEqual(list(ids), ['a', 'c'])
+        self.assertRaises(ValueError, ids.remove, 'b')
+        ids.add('d')
+        self.assertEqual(list(ids), ['a', 'd', 'c'])
+        self.assertEqual(len(ids), 3)
+
+    def test_save_load(self):
+        """Test QVStore.save and load as memory-mapped."""
+        store = QVStore()
+        store.add('a', 'unsmoothed', np.array([1, 2, 3], dtype=np.uint8))
+        store.add('b', 'unsmoothed', np.array([4, 5], dtype=np.uint8))
+        store.remove('a')
+        prefix = op.join(_OUT_DIR_, "qvs")
+        store.save(prefix)
+
+        loaded = QVStore.load(prefix, mmap=True)
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(list(loaded.get_qvs('b', 'unsmoothed')), [4, 5])
+
+        # adding reads to a memory-mapped store does not modify files on disk
+        loaded.add('c', 'unsmoothed', [7])
+        self.assertEqual(list(loaded.get_qvs('c', 'unsmoothed')), [7])
+        self.assertEqual(len(QVStore.load(prefix)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
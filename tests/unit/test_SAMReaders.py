@@ -6,15 +6,29 @@ Test SAMReaders
 import unittest
 import os.path as op
 
-from pbtranscript.Utils import rmpath
+from pbtranscript.Utils import rmpath, mkdir
 from pbtranscript.io import ContigSetReaderWrapper
-from pbtranscript.io.SAMReaders import GMAPSAMReader, SAMRecordBase, Interval, SAMflag, iter_gmap_sam
+from pbtranscript.io.SAMReaders import GMAPSAMReader, SAMRecordBase, Interval, SAMflag, \
+    iter_gmap_sam, gmap_sam_to_bam, parse_cigar, parse_cigartuples
 from test_setpath import DATA_DIR, OUT_DIR, SIV_DATA_DIR
 
 GMAP_SAM = op.join(SIV_DATA_DIR, 'test_SAMReader', "gmap-output.sam")
 SORTED_GMAP_SAM = op.join(SIV_DATA_DIR, 'test_SAMReader', "sorted-gmap-output.sam")
 READS_DS = op.join(SIV_DATA_DIR, 'test_SAMReader', 'gmap-input.fastq')
 
+_OUT_DIR_ = op.join(OUT_DIR, "test_SAMReaders")
+
+# Unsorted GMAP SAM of three loci on two references
+SMALL_GMAP_SAM = "\n".join([
+    "@SQ\tSN:chr1\tLN:5000",
+    "@SQ\tSN:chr2\tLN:3000",
+    "r4\t0\tchr2\t101\t60\t100M\t*\t0\t0\t*\t*\tNM:i:0\tXS:A:+",
+    "r1\t16\tchr1\t101\t60\t2S50M200N48M\t*\t0\t0\t*\t*\tNM:i:1\tXS:A:+",
+    "r2\t0\tchr1\t121\t60\t30M1I10M2D39M\t*\t0\t0\t*\t*\tNM:i:3\tXS:A:-",
+    "r3\t0\tchr1\t2001\t60\t100M\t*\t0\t0\t*\t*\tNM:i:0",
+    "r5\t4\t*\t0\t0\t*\t*\t0\t0\t*\t*", ""])
+SMALL_QUERY_LEN = {"r1": 100, "r2": 80, "r3": 100, "r4": 100, "r5": 100}
+
 
 def _get_sam_groups(ignored_ids_writer=None):
     """Returns grouped sam records read from SORTED_GMAP_SAM and READS_DS."""
@@ -148,5 +162,46 @@ class TestSAMReaders(unittest.TestCase):
         self.assertTrue(expected_g0_plus_sEnd, [r.sEnd for r in groups[4]["-"]])
 
 
+class TestGMAPBam(unittest.TestCase):
+    """Test reading GMAP output converted to sorted, indexed BAM."""
+    def setUp(self):
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.sam_fn = op.join(_OUT_DIR_, "small.sam")
+        with open(self.sam_fn, 'w') as writer:
+            writer.write(SMALL_GMAP_SAM)
+
+    def test_parse_cigartuples(self):
+        """Test parse_cigartuples, which parses binary cigar operations."""
+        for cigar, tuples in [("2S50M200N48M", [(4, 2), (0, 50), (3, 200), (0, 48)]),
+                              ("30M1I10M2D39M5H", [(0, 30), (1, 1), (0, 10), (2, 2),
+                                                   (0, 39), (5, 5)])]:
+            self.assertEqual(parse_cigartuples(tuples, 100), parse_cigar(cigar, 100))
+
+    def test_gmap_sam_to_bam(self):
+        """Test records read from BAM are the same as those read from SAM."""
+        bam_fn = gmap_sam_to_bam(self.sam_fn, op.join(_OUT_DIR_, "small.bam"))
+        self.assertTrue(op.exists(bam_fn + ".bai"))
+        from_sam = [r for r in GMAPSAMReader(self.sam_fn, query_len_dict=SMALL_QUERY_LEN)]
+        from_bam = [r for r in GMAPSAMReader(bam_fn, query_len_dict=SMALL_QUERY_LEN)]
+        self.assertEqual([r.qID for r in from_bam], ["r1", "r2", "r3", "r4", "r5"])
+        for r in from_bam:
+            self.assertEqual(r, [x for x in from_sam if x.qID == r.qID][0])
+        r1 = from_bam[0]
+        self.assertEqual(r1.segments, [Interval(100, 150), Interval(350, 398)])
+        self.assertEqual((r1.qStart, r1.qEnd, r1.flag.strand), (2, 100, '+'))
+
+    def test_iter_gmap_sam_region(self):
+        """Test iter_gmap_sam over all, or a region of a BAM file."""
+        bam_fn = gmap_sam_to_bam(self.sam_fn, op.join(_OUT_DIR_, "small.bam"))
+        def _groups(**kwargs):
+            """Return qIDs of groups."""
+            return [(sorted(r.qID for r in g['+']), sorted(r.qID for r in g['-']))
+                    for g in iter_gmap_sam(bam_fn, SMALL_QUERY_LEN, 0.5, 0.9, None, **kwargs)]
+        self.assertEqual(_groups(), [(["r1"], ["r2"]), (["r3"], []), (["r4"], [])])
+        self.assertEqual(_groups(reference="chr1", start=1000, end=3000), [(["r3"], [])])
+        self.assertEqual(_groups(reference="chr2"), [(["r4"], [])])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,124 @@
+"""Test pbtranscript.collapsing.SamSorter."""
+import unittest
+import random
+import os.path as op
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.libs import Samfile
+import pbtranscript.collapsing.SamSorter as SamSorter
+from pbtranscript.collapsing.SamSorter import sort_sam_file, split_ranges, \
+    read_sam_header, merge_sorted_sam_files
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_SamSorter")
+
+HEADER = "@HD\tVN:1.0\n@SQ\tSN:chr2\tLN:100000\n@SQ\tSN:chr1\tLN:100000\n" + \
+         "@SQ\tSN:chr10\tLN:100000\n"
+
+
+def _write_unsorted_sam(sam_fn, n=2000, seed=0):
+    """Write n alignments in random order, return them as lines."""
+    rng = random.Random(seed)
+    lines = []
+    for i in xrange(n):
+        ref = rng.choice(["chr1", "chr2", "chr10", "*"])
+        pos = 0 if ref == "*" else rng.randint(1, 1000)
+        flag = 4 if ref == "*" else rng.choice([0, 16])
+        cigar = "*" if ref == "*" else "%dM" % rng.randint(1, 500)
+        lines.append("r%d\t%d\t%s\t%d\t60\t%s\t*\t0\t0\t*\t*\n" % (i, flag, ref, pos, cigar))
+    with open(sam_fn, 'w') as writer:
+        writer.write(HEADER)
+        writer.writelines(lines)
+    return lines
+
+
+class TEST_SamSorter(unittest.TestCase):
+    """Test sort_sam_file, an external merge sort of SAM files."""
+    def setUp(self):
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+        self.in_sam = op.join(_OUT_DIR_, "unsorted.sam")
+        self.lines = _write_unsorted_sam(self.in_sam)
+        # make runs small, so that alignments are sorted in many runs
+        self.min_run_size, self.max_merge_width = \
+            SamSorter.MIN_RUN_SIZE, SamSorter.MAX_MERGE_WIDTH
+        SamSorter.MIN_RUN_SIZE, SamSorter.MAX_MERGE_WIDTH = 1000, 4
+
+    def tearDown(self):
+        SamSorter.MIN_RUN_SIZE, SamSorter.MAX_MERGE_WIDTH = \
+            self.min_run_size, self.max_merge_width
+
+    def test_split_ranges(self):
+        """Test split_ranges, which cuts alignments at line boundaries."""
+        header, start = read_sam_header(self.in_sam)
+        self.assertEqual("".join(header), HEADER)
+        ranges = split_ranges(self.in_sam, start, 1000)
+        self.assertTrue(len(ranges) > 10)
+        with open(self.in_sam) as reader:
+            content = reader.read()
+        self.assertEqual(content[start:], "".join(content[s:e] for s, e in ranges))
+        self.assertTrue(all(content[e-1] == '\n' for dummy_s, e in ranges))
+
+    def test_sort_sam(self):
+        """Test sorting SAM by reference name then position, the same as
+        `LC_ALL=C sort -k 3,3 -k 4,4n`, in one or more processes."""
+        expected = sorted(self.lines, key=lambda l: (l.split('\t')[2], int(l.split('\t')[3]), l))
+        for nproc in (1, 3):
+            out_sam = op.join(_OUT_DIR_, "sorted.%d.sam" % nproc)
+            sort_sam_file(self.in_sam, out_sam, max_memory=10000, nproc=nproc)
+            with open(out_sam) as reader:
+                self.assertEqual(reader.read(), HEADER + "".join(expected))
+
+    def test_sort_bam(self):
+        """Test sorting to an indexed BAM, by reference order in header."""
+        out_bam = op.join(_OUT_DIR_, "sorted.bam")
+        sort_sam_file(self.in_sam, out_bam, max_memory=10000, nproc=2)
+        self.assertTrue(op.exists(out_bam + ".bai"))
+        order = {"chr2": 0, "chr1": 1, "chr10": 2, "*": 3}
+        with Samfile(out_bam, 'rb') as reader:
+            names = [r.query_name for r in reader]
+            self.assertEqual(len(names), len(self.lines))
+            self.assertEqual(reader.count("chr1"),
+                             len([l for l in self.lines if l.split('\t')[2] == "chr1"]))
+        expected = sorted(self.lines, key=lambda l: (order[l.split('\t')[2]],
+                                                     int(l.split('\t')[3]), l))
+        self.assertEqual(names, [l.split('\t')[0] for l in expected])
+
+    def test_merge_sorted_sam_files(self):
+        """Test k-way merging sorted shards, to SAM, or to BAM if shards
+        are sorted by reference order."""
+        header, dummy_start = read_sam_header(self.in_sam)
+        shards = [op.join(_OUT_DIR_, "shard.%d.sam" % i) for i in range(9)]
+        for i, shard in enumerate(shards):
+            with open(shard, 'w') as writer:
+                writer.write(HEADER)
+                writer.writelines(self.lines[i::len(shards)])
+
+        # shards sorted by reference name are merged to SAM
+        sorted_shards = [shard + ".sorted.sam" for shard in shards]
+        for shard, sorted_shard in zip(shards, sorted_shards):
+            sort_sam_file(shard, sorted_shard)
+        out_sam = op.join(_OUT_DIR_, "merged.sam")
+        merge_sorted_sam_files(sorted_shards, header, out_sam)
+        sort_sam_file(self.in_sam, op.join(_OUT_DIR_, "sorted.sam"))
+        with open(out_sam) as reader, open(op.join(_OUT_DIR_, "sorted.sam")) as expected:
+            self.assertEqual(reader.read(), expected.read())
+
+        # BAM requires shards sorted by reference order
+        out_bam = op.join(_OUT_DIR_, "merged.bam")
+        with self.assertRaises(ValueError):
+            merge_sorted_sam_files(sorted_shards, header, out_bam)
+        for shard, sorted_shard in zip(shards, sorted_shards):
+            sort_sam_file(shard, sorted_shard, by_reference_order=True)
+        merge_sorted_sam_files(sorted_shards, header, out_bam)
+        self.assertTrue(op.exists(out_bam + ".bai"))
+        sort_sam_file(self.in_sam, op.join(_OUT_DIR_, "sorted.bam"))
+        with Samfile(out_bam, 'rb') as reader, \
+             Samfile(op.join(_OUT_DIR_, "sorted.bam"), 'rb') as expected:
+            self.assertEqual([r.query_name for r in reader],
+                             [r.query_name for r in expected])
+        # inputs are never removed
+        self.assertTrue(all(op.exists(fn) for fn in sorted_shards))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,9 @@ import filecmp
 from pbcore.util.Process import backticks
 from pbtranscript.ClusterOptions import SgeOptions
 from pbtranscript.Utils import mkdir, mknewdir
-from pbtranscript.ice_daligner import DalignerRunner
+from pbtranscript.io import LasReader, LA4IceReader
+from pbtranscript.ice_daligner import DalignerRunner, plan_local_jobs, \
+    max_concurrent_jobs, available_cpus
 from test_setpath import DATA_DIR, OUT_DIR, STD_DIR, SIV_DATA_DIR
 
 class TestDalignerRunner(unittest.TestCase):
@@ -27,7 +29,8 @@ class TestDalignerRunner(unittest.TestCase):
         self.runner = DalignerRunner(query_filename=op.join(self.data_dir, self.query_filename),
                                      target_filename=op.join(self.data_dir, self.target_filename),
                                      is_FL=False, same_strand_only=True,
-                                     dazz_dir=self.dazz_dir, script_dir=self.script_dir)
+                                     dazz_dir=self.dazz_dir, script_dir=self.script_dir,
+                                     use_la4ice=True)
         self.runner.output_dir = self.out_dir
 
     def test_query_prefix(self):
@@ -67,6 +70,52 @@ class TestDalignerRunner(unittest.TestCase):
                     for k in ('N0', 'N1', 'N2', 'N3')]
         self.assertEqual(self.runner.la4ice_filenames, expected)
 
+    def test_alignment_filenames(self):
+        """Test las files are read directly by default."""
+        self.assertEqual(self.runner.alignment_filenames,
+                         self.runner.la4ice_filenames)
+        runner = DalignerRunner(query_filename=op.join(self.data_dir, self.query_filename),
+                                target_filename=op.join(self.data_dir, self.target_filename),
+                                is_FL=False, same_strand_only=True,
+                                dazz_dir=self.dazz_dir, script_dir=self.script_dir)
+        runner.output_dir = self.out_dir
+        self.assertFalse(runner.use_la4ice)
+        self.assertEqual(runner.alignment_filenames, runner.las_filenames)
+
+    def test_las_vs_la4ice(self):
+        """Test alignments read from las files by LasReader are the same
+        as alignments in LA4Ice output of the same las files."""
+        mknewdir(self.out_dir)
+        self.runner.run(output_dir=self.out_dir)
+        query_seqs = self.runner.query_dazz_handler.sequences
+        target_seqs = self.runner.target_dazz_handler.sequences
+
+        n_compared = 0
+        for las_fn, la4ice_fn in zip(self.runner.las_filenames,
+                                     self.runner.la4ice_filenames):
+            with LasReader(las_fn, query_seqs=query_seqs,
+                           target_seqs=target_seqs) as reader:
+                las_records = dict(((r.qID, r.sID, r.qStart, r.qEnd), r)
+                                   for r in reader)
+            for expected in LA4IceReader(la4ice_fn):
+                key = (expected.qID, expected.sID, expected.qStart, expected.qEnd)
+                self.assertIn(key, las_records)
+                r = las_records[key]
+                for attr in ('qLength', 'sLength', 'sStart', 'sEnd',
+                             'qStrand', 'sStrand', 'strand'):
+                    self.assertEqual(getattr(r, attr), getattr(expected, attr))
+                # Both align every trace interval optimally, so columns
+                # may only differ in how ties are broken.
+                self.assertEqual(r.qAln.replace('-', '').lower(),
+                                 expected.qAln.replace('-', '').lower())
+                self.assertEqual(r.sAln.replace('-', '').lower(),
+                                 expected.sAln.replace('-', '').lower())
+                self.assertEqual(len(r.alnStr) - r.alnStr.count('|'),
+                                 len(expected.alnStr) - expected.alnStr.count('|'))
+                n_compared += 1
+        self.assertTrue(n_compared > 0)
+        self.runner.clean_run()
+
     def test_run(self):
         """Test run(output_dir, min_match_len, sensitive_mode).
         running on sge and locally.
@@ -110,3 +159,35 @@ class TestDalignerRunner(unittest.TestCase):
         for la4ice_filename in self.runner.la4ice_filenames:
             print("Checking %s has been removed.\n" % la4ice_filename)
             self.assertTrue(not op.exists(la4ice_filename))
+
+
+class TestPlanLocalJobs(unittest.TestCase):
+    """Test pbtranscript.ice_daligner.plan_local_jobs"""
+    def test_max_concurrent_jobs(self):
+        """Test max_concurrent_jobs(num_jobs, threads_per_job, job_memory, cpus, memory)."""
+        G = 1024 * 1024 * 1024
+        # bounded by cpus
+        self.assertEqual(max_concurrent_jobs(100, 4, G, 24, None), 6)
+        # bounded by number of jobs
+        self.assertEqual(max_concurrent_jobs(2, 4, G, 24, 100 * G), 2)
+        # bounded by memory, 80% of 10G / 2G
+        self.assertEqual(max_concurrent_jobs(100, 4, 2 * G, 24, 10 * G), 4)
+        # always run at least one job
+        self.assertEqual(max_concurrent_jobs(100, 4, 20 * G, 2, 10 * G), 1)
+
+    def test_plan_local_jobs(self):
+        """Test plan_local_jobs."""
+        G = 1024 * 1024 * 1024
+        # a single block pair in late ICE iterations
+        plan = plan_local_jobs(num_daligner_jobs=1, num_la4ice_jobs=4,
+                               daligner_job_bases=10**6, la4ice_job_bases=10**6,
+                               cpus=1024, memory=64 * G)
+        self.assertEqual(plan.cpus, available_cpus())
+        self.assertEqual(plan.daligner_jobs, 1)
+        self.assertEqual(plan.la4ice_jobs, min(4, available_cpus()))
+
+        # many block pairs in ice_partial
+        plan = plan_local_jobs(num_daligner_jobs=100, num_la4ice_jobs=400,
+                               daligner_job_bases=10**6, la4ice_job_bases=10**8,
+                               cpus=1, memory=64 * G)
+        self.assertEqual((plan.cpus, plan.daligner_jobs, plan.la4ice_jobs), (1, 1, 1))
@@ -1,6 +1,8 @@
 """Test pClique, CliqueSubList."""
 from __future__ import print_function
 import unittest
+import random
+import numpy as np
 import pbtranscript.ice.pClique as pClique
 from networkx import Graph
 
@@ -34,6 +36,58 @@ class Test_pClique(unittest.TestCase):
         print(c)
         self.assertTrue(set(c) == set(['a', 'b', 'c', 'd', 'e']))
 
+    def test_find_cliques(self):
+        """Test find_cliques on a CSR adjacency matrix."""
+        # A clique of 0-4, a clique of 5-7, and some other edges.
+        edges = [(0, 1), (0, 2), (0, 3), (0, 4), (1, 2), (1, 3), (1, 4),
+                 (2, 3), (2, 4), (3, 4), (5, 6), (5, 7), (6, 7), (4, 5),
+                 (7, 8), (1, 1), (1, 0)]
+        H = pClique.adjacency_matrix(10, [e[0] for e in edges], [e[1] for e in edges])
+        self.assertEqual(H.nnz, 2 * 15)
+        self.assertEqual(H[1, 1], 0)
+        cliques = pClique.find_cliques(H, gamma=1, maxitr=5)
+        self.assertEqual([sorted(c) for c in cliques], [[0, 1, 2, 3, 4], [5, 6, 7]])
+
+    def test_EdgeList(self):
+        """Test EdgeList streams edges of named nodes into a CSR matrix."""
+        g = pClique.EdgeList(['r0', 'r1', 'r2'])
+        for a, b in [('r1', 'r0'), ('r0', 'r1'), ('r3', 'r1'), ('r2', 'r2'),
+                     ('r1', 'r3'), ('r0', 'r2')]:
+            g.add_edge(a, b)
+        self.assertEqual(len(g), 6)
+        self.assertEqual(g.names, ['r0', 'r1', 'r2', 'r3'])
+        rows, cols = g.unique_edges()
+        self.assertEqual(zip(rows, cols), [(0, 1), (0, 2), (1, 3)])
+        H = g.adjacency_matrix()
+        self.assertEqual(H.shape, (4, 4))
+        self.assertEqual(H.toarray().tolist(),
+                         [[0, 1, 1, 0], [1, 0, 0, 1], [1, 0, 0, 0], [0, 1, 0, 0]])
+        self.assertEqual(pClique.EdgeList().adjacency_matrix().shape, (0, 0))
+
+    def test_grasp_rows(self):
+        """Test grasp_rows finds the same clique as grasp for a fixed seed."""
+        for seed in range(50):
+            rng = random.Random(seed)
+            n = rng.randint(2, 40)
+            edges = [(i, j) for i in range(n) for j in range(i + 1, n)
+                     if rng.random() < 0.5]
+            H = pClique.adjacency_matrix(n, [e[0] for e in edges], [e[1] for e in edges])
+            # seed node and its neighbors which are not used
+            used = np.array([rng.random() < 0.2 for dummy_i in range(n)])
+            node = rng.randrange(n)
+            row = H.indices[H.indptr[node]:H.indptr[node+1]]
+            nodes = np.sort(np.append(row[~used[row]], node))
+            pos = -np.ones(n, dtype=np.int)
+            pos[nodes] = np.arange(len(nodes))
+            seed_i = int(pos[node])
+
+            for gamma in (0.5, 0.8):
+                expected = pClique.grasp(None, H[nodes, :][:, nodes], gamma, 5, seed_i,
+                                         rng=random.Random(seed))
+                tQ = pClique.grasp_rows(H, nodes, pos, gamma, 5, seed_i,
+                                        rng=random.Random(seed))
+                self.assertEqual(list(tQ), list(expected))
+
 
 if __name__ == "__main__":
     unittest.main()